@@ -1,21 +1,47 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, File, UploadFile, Form, Request, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, File, UploadFile, Form, Request, HTTPException, Query
+from fastapi.responses import JSONResponse, StreamingResponse, FileResponse, Response
 from pydantic import BaseModel
 from redis import Redis
+from redis.asyncio import Redis as AsyncRedis, ConnectionPool as AsyncConnectionPool
 from rq import Queue
 from uuid import uuid4
 from fastapi.middleware.cors import CORSMiddleware
-from starlette.staticfiles import StaticFiles
+from starlette.concurrency import run_in_threadpool
+import mimetypes
 import json
 import asyncio
-from typing import Dict, Set, Optional, Union
 import os
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, Set, Optional, Tuple, Union
 import sys
 sys.path.append("/app")
 from worker import run_job
 from video_worker import run_video_job
+from config.settings import (
+    MAX_BATCH_SIZE, BATCH_TTL, MAX_VARIANTS, MAX_UPLOAD_BYTES, FORM_OVERHEAD_BYTES, SPEED_MODES, MAX_STATUS_IDS, REDIS_MAX_CONNECTIONS, MEME_PIPELINE_STAGED, MEME_DIFFUSION_QUEUE,
+    OUTPUT_GC_INTERVAL, OUTPUT_MAX_AGE, OUTPUT_MAX_BYTES, OUTPUT_PAGE_MAX,
+    WS_SEND_QUEUE_SIZE, WS_SEND_TIMEOUT, WS_MAX_SUBSCRIPTIONS, PUBSUB_MAX_BACKOFF, SSE_KEEPALIVE,
+)
+from services.upload_store import get_upload_store, UploadTooLargeError
+from utils.job_status import NOT_FOUND, fetch_job_status, fetch_job_statuses
+from utils.job_events import parse_event_id, read_job_events
+from services.admission import AdmissionController, AdmissionRejected
+from services.meme_pipeline import enqueue_staged_jobs
+from services.output_files import (
+    IMMUTABLE_CACHE_CONTROL, IMAGE_EXTENSIONS, VARIANT_FORMATS, RangeNotSatisfiable, VariantCache,
+    etag_matches, iter_file_range, parse_range, snap_width, strong_etag, wait_for_output,
+)
+from services.output_store import OutputStore, GC_LOCK_KEY
+from services.circuit_breaker import CircuitBreaker
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    gc_task = asyncio.create_task(output_gc_loop())
+    yield
+    gc_task.cancel()
 
-app = FastAPI(title="Meme AI API")
+app = FastAPI(title="Meme AI API", lifespan=lifespan)
 
 # CORS (ajusta origins en producción)
 app.add_middleware(
@@ -26,8 +52,185 @@ app.add_middleware(
 )
 
 redis = Redis(host="redis", port=6379)
+# Async client for status reads so they never block the event loop
+async_redis = AsyncRedis(connection_pool=AsyncConnectionPool(
+    host="redis", port=6379, max_connections=REDIS_MAX_CONNECTIONS
+))
 q = Queue("meme", connection=redis, default_timeout=1000)
 video_q = Queue("video", connection=redis, default_timeout=3000)  # Longer timeout for video processing
+diffusion_q = Queue(MEME_DIFFUSION_QUEUE, connection=redis)
+upload_store = get_upload_store(redis)
+admission = AdmissionController(redis)
+output_store = OutputStore(redis)
+ollama_breaker = CircuitBreaker(redis, "ollama")
+
+
+def rejected(e: AdmissionRejected) -> HTTPException:
+    return HTTPException(status_code=429, detail=e.reason, headers={"Retry-After": str(e.retry_after)})
+
+
+def check_queues(queue: Queue, jobs: int = 1):
+    """Answer 429 with Retry-After when `queue` (and the diffusion stage behind it) cannot take `jobs` more"""
+    try:
+        admission.check_queue(queue, jobs)
+        if queue is q and MEME_PIPELINE_STAGED:
+            admission.check_queue(diffusion_q, jobs)
+    except AdmissionRejected as e:
+        raise rejected(e)
+
+
+def charge_client(request: Request, cost: int = 1):
+    """
+    Take `cost` tokens from the client's bucket, answering 429 when it is empty. Called
+    once the request has validated, so a rejected request does not use up the client's rate.
+    """
+    if request.client is None:
+        return
+    try:
+        admission.take_tokens(request.client.host, cost)
+    except AdmissionRejected as e:
+        raise rejected(e)
+
+
+def admit_jobs(request: Request, queue: Queue, jobs: int = 1, cost: Optional[int] = None):
+    """Admission control for `jobs` validated jobs; `cost` tokens (default one per job) are charged last"""
+    check_queues(queue, jobs)
+    charge_client(request, jobs if cost is None else cost)
+
+
+def validate_variants(variants):
+    if variants is not None and not (isinstance(variants, int) and 1 <= variants <= MAX_VARIANTS):
+        raise HTTPException(status_code=400, detail=f"variants must be between 1 and {MAX_VARIANTS}")
+
+
+def form_number(form, field: str, cast=int):
+    """Numeric multipart field, None when empty; 422 when it is not a number"""
+    value = form.get(field)
+    if not value:
+        return None
+    try:
+        return cast(value)
+    except (TypeError, ValueError):
+        kind = "an integer" if cast is int else "a number"
+        raise HTTPException(status_code=422, detail=f"{field} must be {kind}")
+
+
+def validate_speed(speed):
+    if speed is not None and speed not in SPEED_MODES:
+        raise HTTPException(status_code=400, detail=f"speed must be one of {', '.join(SPEED_MODES)}")
+
+
+def enqueue_meme_jobs(jobs, pipeline=None):
+    """
+    Enqueue meme jobs, staged (text -> diffusion -> finish) or as single run_job jobs.
+
+    Args:
+        jobs: List of (job_id, payload, meta) tuples
+        pipeline: Optional Redis pipeline to add the writes to (executed by the caller)
+    """
+    if MEME_PIPELINE_STAGED:
+        enqueue_staged_jobs(redis, jobs, pipeline=pipeline)
+        return
+    job_datas = [
+        Queue.prepare_data(run_job, (job_id, payload), job_id=job_id, meta=meta)
+        for job_id, payload, meta in jobs
+    ]
+    pipe = pipeline if pipeline is not None else redis.pipeline()
+    q.enqueue_many(job_datas, pipeline=pipe)
+    if pipeline is None:
+        pipe.execute()
+
+
+class ClientConnection:
+    """Outbound side of one WebSocket: a bounded send queue drained by its own task"""
+    
+    def __init__(self, websocket: WebSocket, on_failure, max_pending: int = WS_SEND_QUEUE_SIZE):
+        self.websocket = websocket
+        self.max_pending = max_pending
+        # Pending messages in send order; progress updates are keyed per job so a
+        # newer update replaces a stale one still waiting in the queue
+        self.pending: "OrderedDict[str, str]" = OrderedDict()
+        self.dropped = 0
+        self._on_failure = on_failure
+        self._counter = 0
+        # Last event id queued per job, so replayed and live copies of an event go out once
+        self.last_event_ids: Dict[str, Tuple[int, int]] = {}
+        # Live events held back while a job's log is being replayed
+        self._held: Dict[str, list] = {}
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._sender())
+    
+    def hold(self, job_id: str):
+        """Buffer live events for a job until release() (used while replaying its log)"""
+        self._held.setdefault(job_id, [])
+    
+    def release(self, job_id: str) -> list:
+        """Stop buffering a job and return the live events held meanwhile"""
+        return self._held.pop(job_id, [])
+    
+    def enqueue(self, message: dict, job_id: Optional[str] = None) -> bool:
+        """Queue a message without waiting; returns False if the client is too slow to keep"""
+        event_id = parse_event_id(message.get("event_id"))
+        if job_id and event_id:
+            if job_id in self._held:
+                self._held[job_id].append(message)
+                return True
+            last = self.last_event_ids.get(job_id)
+            if last is not None and event_id <= last:
+                return True  # Already queued via replay or live
+            self.last_event_ids[job_id] = event_id
+        
+        text = json.dumps(message)
+        if job_id and message.get("status") in ("queued", "running"):
+            # Previews and live text coalesce separately so they don't replace progress updates
+            key = f"{message.get('type') if message.get('type') in ('preview', 'text') else 'progress'}:{job_id}"
+            if key in self.pending:
+                # Coalesce: keep the queue position, replace the stale payload
+                self.pending[key] = text
+                return True
+            if len(self.pending) >= self.max_pending:
+                # Progress, previews and live text are lossy by nature; make room by dropping the oldest one
+                if not self._drop_oldest_progress():
+                    self.dropped += 1
+                    return True
+        else:
+            self._counter += 1
+            key = f"msg:{self._counter}"
+            if len(self.pending) >= self.max_pending and not self._drop_oldest_progress():
+                # Only non-droppable messages are backed up: the client has fallen too far behind
+                return False
+        
+        self.pending[key] = text
+        self._wakeup.set()
+        return True
+    
+    def _drop_oldest_progress(self) -> bool:
+        for key in self.pending:
+            if key.startswith(("progress:", "preview:", "text:")):
+                del self.pending[key]
+                self.dropped += 1
+                return True
+        return False
+    
+    async def _sender(self):
+        try:
+            while True:
+                while not self.pending:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                _, text = self.pending.popitem(last=False)
+                await asyncio.wait_for(self.websocket.send_text(text), timeout=WS_SEND_TIMEOUT)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"WebSocket send failed: {e}")
+            self._on_failure(self.websocket)
+    
+    def close(self):
+        """Stop the sender task; pending messages are discarded"""
+        if self._task is not asyncio.current_task():
+            self._task.cancel()
+        self.pending.clear()
 
 
 class WebSocketManager:
@@ -36,10 +239,16 @@ class WebSocketManager:
     def __init__(self):
         # Store connections by job_id -> set of websockets
         self.job_connections: Dict[str, Set[WebSocket]] = {}
-        # Store all active connections for broadcasting
-        self.active_connections: Set[WebSocket] = set()
+        # Reverse index websocket -> job_ids so disconnects don't scan every job
+        self.connection_jobs: Dict[WebSocket, Set[str]] = {}
+        # Per-connection send queues; also the set of active connections for broadcasting
+        self.clients: Dict[WebSocket, ClientConnection] = {}
         # Start Redis listener task
         self._redis_task = None
+        # Pub/sub connection: only channels of jobs with a local watcher are subscribed
+        self._pubsub = None
+        self._stale_jobs: Set[str] = set()
+        self._pubsub_wakeup = asyncio.Event()
     
     async def start_redis_listener(self):
         """Start Redis pub/sub listener task"""
@@ -47,119 +256,390 @@ class WebSocketManager:
             self._redis_task = asyncio.create_task(self._redis_listener())
     
     async def _redis_listener(self):
-        """Listen for Redis pub/sub messages in async loop"""
-        try:
-            # Enable Redis pub/sub for real-time WebSocket updates
-            import aioredis
-            redis_client = aioredis.from_url("redis://redis:6379")
-            pubsub = redis_client.pubsub()
-            await pubsub.psubscribe("job_updates:*")
-            
-            print("Redis pub/sub listener: Connected and listening for job updates")
+        """Listen for Redis pub/sub messages in async loop, reconnecting with backoff"""
+        delay = 1.0
+        while True:
+            pubsub = async_redis.pubsub()
+            try:
+                self._pubsub = pubsub
+                # Fresh connection: (re)subscribe every job that currently has a watcher
+                self._stale_jobs.clear()
+                channels = [f"job_updates:{job_id}" for job_id in self.job_connections]
+                if channels:
+                    await pubsub.subscribe(*channels)
+                
+                print(f"Redis pub/sub listener: Connected, watching {len(channels)} jobs")
+                
+                while True:
+                    await self._drop_stale_subscriptions(pubsub)
+                    if not pubsub.subscribed:
+                        # Nothing watched locally; sleep until a subscription arrives
+                        self._pubsub_wakeup.clear()
+                        await self._pubsub_wakeup.wait()
+                        continue
+                    
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                    delay = 1.0
+                    if message and message['type'] == 'message':
+                        job_id = message['channel'].decode().split(':', 1)[1]
+                        data = json.loads(message['data'])
+                        self.send_job_update(job_id, data)
             
-            async for message in pubsub.listen():
-                if message['type'] == 'pmessage':
-                    job_id = message['channel'].decode().split(':', 1)[1]
-                    data = json.loads(message['data'])
-                    await self.send_job_update(job_id, data)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Redis listener error: {e}; reconnecting in {delay:.0f}s")
+            finally:
+                self._pubsub = None
+                try:
+                    await pubsub.aclose()
+                except Exception:
+                    pass
             
-        except Exception as e:
-            print(f"Redis listener error: {e}")
-            print("WebSocket connections will still work for direct updates")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, PUBSUB_MAX_BACKOFF)
+    
+    async def _drop_stale_subscriptions(self, pubsub):
+        """Unsubscribe channels whose last local watcher went away"""
+        if not self._stale_jobs:
+            return
+        stale = [job_id for job_id in self._stale_jobs if job_id not in self.job_connections]
+        self._stale_jobs.clear()
+        if stale:
+            await pubsub.unsubscribe(*[f"job_updates:{job_id}" for job_id in stale])
     
-    async def connect(self, websocket: WebSocket, job_id: str = None):
+    async def connect(self, websocket: WebSocket, job_id: str = None, last_event_id: Optional[str] = None):
         """Accept WebSocket connection and optionally subscribe to job updates"""
         await websocket.accept()
-        self.active_connections.add(websocket)
+        self.clients[websocket] = ClientConnection(websocket, on_failure=self.disconnect)
+        self.connection_jobs[websocket] = set()
         
         # Ensure Redis listener is started
         await self.start_redis_listener()
         
         if job_id:
+            since = {job_id: last_event_id} if last_event_id else None
+            await self.subscribe_many(websocket, [job_id], since=since)
+    
+    async def subscribe(self, websocket: WebSocket, job_id: str, send_status: bool = True):
+        """Subscribe an accepted WebSocket to updates for a job"""
+        await self.subscribe_many(websocket, [job_id], send_status=send_status)
+    
+    async def subscribe_many(self, websocket: WebSocket, job_ids: list, send_status: bool = True,
+                             since: Optional[Dict[str, Optional[str]]] = None):
+        """
+        Subscribe an accepted WebSocket to updates for several jobs.
+        Jobs listed in `since` replay their event log after the given event id
+        (None replays it all) instead of receiving a status snapshot; they still get
+        one when there is nothing to replay.
+        """
+        jobs = self.connection_jobs.get(websocket)
+        client = self.clients.get(websocket)
+        if jobs is None or client is None:
+            return
+        since = since or {}
+        
+        added = []
+        new_channels = []
+        for job_id in job_ids:
+            if job_id not in jobs and len(jobs) >= WS_MAX_SUBSCRIPTIONS:
+                self.send(websocket, {"status": "error", "job_id": job_id, "message": "too many subscriptions"})
+                break
             if job_id not in self.job_connections:
-                self.job_connections[job_id] = set()
-            self.job_connections[job_id].add(websocket)
-            
-            # Send initial job status when connecting
+                # First local watcher for this job
+                new_channels.append(f"job_updates:{job_id}")
+            jobs.add(job_id)
+            self.job_connections.setdefault(job_id, set()).add(websocket)
+            added.append(job_id)
+            if job_id in since:
+                client.hold(job_id)
+        replay = {job_id: since[job_id] for job_id in added if job_id in since}
+        
+        # Subscribe before reading the initial status so no update falls in between
+        if new_channels and self._pubsub is not None:
             try:
-                from rq.job import Job
-                job = Job.fetch(job_id, connection=redis)
-                if job:
-                    if job.is_finished:
-                        await websocket.send_text(json.dumps(job.result))
-                    elif job.is_failed:
-                        await websocket.send_text(json.dumps({
-                            "status": "error", 
-                            "message": str(job.exc_info)
-                        }))
-                    else:
-                        meta = job.meta or {}
-                        await websocket.send_text(json.dumps({
-                            "status": meta.get("status", "queued"),
-                            "progress": meta.get("progress", 0)
-                        }))
+                await self._pubsub.subscribe(*new_channels)
             except Exception as e:
-                print(f"Error sending initial job status: {e}")
+                # The listener resubscribes every watched job when it reconnects
+                print(f"Error subscribing to job updates: {e}")
+            self._pubsub_wakeup.set()
+        
+        status_ids = [job_id for job_id in added if job_id not in replay] if send_status else []
+        
+        if replay:
+            # Replay logged events, then whatever arrived live meanwhile (deduplicated by id)
+            try:
+                events = await read_job_events(async_redis, replay)
+            except Exception as e:
+                print(f"Error replaying job events: {e}")
+                events = {}
+            for job_id in replay:
+                logged = events.get(job_id, [])
+                if not logged and send_status:
+                    # Nothing logged yet, or the log expired or was trimmed past the client's
+                    # last event: send a snapshot so a finished job does not leave it waiting
+                    status_ids.append(job_id)
+                for message in logged + client.release(job_id):
+                    self.send(websocket, message, job_id=job_id)
+        
+        if not status_ids:
+            return
+        
+        # Send initial job status when subscribing, read in one pipelined round trip
+        try:
+            statuses = await fetch_job_statuses(async_redis, redis, status_ids)
+            for job_id, status in statuses.items():
+                if status is not None:
+                    self.send(websocket, {"job_id": job_id, **status}, job_id=job_id)
+        except Exception as e:
+            print(f"Error sending initial job status: {e}")
+    
+    def unsubscribe(self, websocket: WebSocket, job_id: str):
+        """Stop sending updates for a job to a WebSocket"""
+        self.connection_jobs.get(websocket, set()).discard(job_id)
+        connections = self.job_connections.get(job_id)
+        if connections is not None:
+            connections.discard(websocket)
+            if not connections:  # Remove empty sets
+                del self.job_connections[job_id]
+                # Last local watcher gone; the listener drops the channel subscription
+                self._stale_jobs.add(job_id)
     
     def disconnect(self, websocket: WebSocket):
         """Remove WebSocket connection from all subscriptions"""
-        self.active_connections.discard(websocket)
+        client = self.clients.pop(websocket, None)
+        if client is not None:
+            client.close()
         
-        # Remove from job-specific connections
-        for job_id in list(self.job_connections.keys()):
-            self.job_connections[job_id].discard(websocket)
-            if not self.job_connections[job_id]:  # Remove empty sets
-                del self.job_connections[job_id]
+        for job_id in self.connection_jobs.pop(websocket, set()):
+            self.unsubscribe(websocket, job_id)
     
-    async def send_job_update(self, job_id: str, message: dict):
+    def send(self, websocket: WebSocket, message: dict, job_id: Optional[str] = None):
+        """Queue a message for one WebSocket; slow clients that overflow are dropped"""
+        client = self.clients.get(websocket)
+        if client is not None and not client.enqueue(message, job_id):
+            print("WebSocket client too slow, disconnecting")
+            self.disconnect(websocket)
+            asyncio.create_task(self._close(websocket))
+    
+    async def _close(self, websocket: WebSocket):
+        try:
+            await websocket.close(code=1013)  # Try again later
+        except Exception:
+            pass
+    
+    def send_job_update(self, job_id: str, message: dict):
         """Send update to all connections subscribed to a specific job"""
-        if job_id in self.job_connections:
-            disconnected = set()
-            for websocket in self.job_connections[job_id]:
-                try:
-                    await websocket.send_text(json.dumps(message))
-                except:
-                    disconnected.add(websocket)
-            
-            # Clean up disconnected websockets
-            for ws in disconnected:
-                self.disconnect(ws)
+        for websocket in list(self.job_connections.get(job_id, ())):
+            self.send(websocket, message, job_id=job_id)
     
-    async def broadcast(self, message: dict):
+    def broadcast(self, message: dict):
         """Broadcast message to all active connections"""
-        disconnected = set()
-        for websocket in self.active_connections:
-            try:
-                await websocket.send_text(json.dumps(message))
-            except:
-                disconnected.add(websocket)
-        
-        # Clean up disconnected websockets
-        for ws in disconnected:
-            self.disconnect(ws)
+        for websocket in list(self.clients):
+            self.send(websocket, message)
+    
+    async def handle_message(self, websocket: WebSocket, message: dict):
+        """Handle a client message: keepalive pings and job (un)subscriptions"""
+        message_type = message.get("type")
+        if message_type == "ping":
+            self.send(websocket, {"type": "pong"})
+        elif message_type in ("subscribe", "unsubscribe"):
+            job_ids = message.get("jobIds")
+            if not isinstance(job_ids, list):
+                return
+            job_ids = [str(job_id) for job_id in job_ids]
+            if message_type == "subscribe":
+                # Optional {"lastEventIds": {job_id: event_id}} resumes those jobs from their log
+                last_event_ids = message.get("lastEventIds")
+                since = None
+                if isinstance(last_event_ids, dict):
+                    since = {job_id: last_event_ids[job_id] for job_id in job_ids if job_id in last_event_ids}
+                await self.subscribe_many(websocket, job_ids, since=since)
+            else:
+                for job_id in job_ids:
+                    self.unsubscribe(websocket, job_id)
+
+
+class EventStreamClient:
+    """
+    Adapter that lets a Server-Sent Events response register with the WebSocketManager
+    like a WebSocket, so SSE shares the same subscriptions and send queues.
+    """
+    
+    def __init__(self):
+        # Size 1 so a slow HTTP client backs up its ClientConnection queue, not this one
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+    
+    async def accept(self):
+        pass
+    
+    async def send_text(self, text: str):
+        await self.queue.put(text)
+    
+    async def close(self, code: int = 1000):
+        try:
+            self.queue.put_nowait(None)
+        except asyncio.QueueFull:
+            pass
 
 
 # Global WebSocket manager instance
 websocket_manager = WebSocketManager()
 
-# Archivos estáticos de salida
-app.mount("/outputs", StaticFiles(directory="/outputs"), name="outputs")
+# Archivos de salida: ETag fuerte, caché inmutable, rangos y variantes (miniaturas/WebP)
+variant_cache = VariantCache()
+
+@app.api_route("/outputs/{filename}", methods=["GET", "HEAD"])
+async def get_output(filename: str, request: Request, w: Optional[int] = None,
+                     fmt: Optional[str] = Query(None, alias="format")):
+    """
+    Serve a job output. Outputs never change, so responses are immutable and carry strong ETags.
+    Images accept ?w=<width> and/or ?format=webp|jpeg|png for cached resized variants;
+    full files honour single byte ranges (video seeking).
+    """
+    # A job can be reported done while its worker is still writing the file
+    path = await wait_for_output(async_redis, filename)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    
+    variant = ""
+    if w is not None or fmt is not None:
+        if not filename.lower().endswith(IMAGE_EXTENSIONS):
+            raise HTTPException(status_code=400, detail="Variants are only available for images")
+        if fmt is not None and fmt not in VARIANT_FORMATS:
+            raise HTTPException(status_code=400, detail=f"Unsupported format: {fmt}")
+        if w is not None and w <= 0:
+            raise HTTPException(status_code=400, detail="Width must be positive")
+        width = snap_width(w) if w is not None else None
+        fmt = fmt or os.path.splitext(filename)[1].lstrip(".").lower().replace("jpg", "jpeg")
+        variant = f"w{width or 0}.{fmt}"
+    
+    etag = strong_etag(path, variant)
+    headers = {"ETag": etag, "Cache-Control": IMMUTABLE_CACHE_CONTROL, "Accept-Ranges": "bytes"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    
+    if variant:
+        path = await variant_cache.get(path, width, fmt)
+        return FileResponse(path, media_type=VARIANT_FORMATS[fmt][1], headers=headers)
+    
+    media_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    size = os.path.getsize(path)
+    try:
+        byte_range = parse_range(request.headers.get("range"), size)
+    except RangeNotSatisfiable:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+    if byte_range is None:
+        return FileResponse(path, media_type=media_type, headers=headers)
+    
+    start, end = byte_range
+    headers.update({"Content-Range": f"bytes {start}-{end}/{size}", "Content-Length": str(end - start + 1)})
+    body = iter_file_range(path, start, end) if request.method == "GET" else iter(())
+    return StreamingResponse(body, status_code=206, media_type=media_type, headers=headers)
+
+@app.get("/api/outputs")
+def list_outputs(limit: int = Query(50, ge=1, le=OUTPUT_PAGE_MAX), before: Optional[float] = None):
+    """
+    Most recent outputs first, from the output index (no directory scan).
+    Pass the returned `next` as `before` to get the following page.
+    """
+    items, next_cursor = output_store.recent(limit, before)
+    return {"items": items, "next": next_cursor}
+
+
+async def output_gc_loop():
+    """
+    Enforce the output age/size budgets and the upload TTL every OUTPUT_GC_INTERVAL seconds
+    (one API process at a time)
+    """
+    while True:
+        await asyncio.sleep(OUTPUT_GC_INTERVAL)
+        try:
+            if await async_redis.set(GC_LOCK_KEY, os.getpid(), nx=True, ex=OUTPUT_GC_INTERVAL):
+                if OUTPUT_MAX_AGE > 0 or OUTPUT_MAX_BYTES > 0:
+                    await asyncio.to_thread(output_store.collect_garbage)
+                await asyncio.to_thread(upload_store.collect_garbage)
+        except Exception as e:
+            print(f"Output GC failed: {e}")
+
 
 class CreateJob(BaseModel):
     prompt: str
     seed: int | None = None
     negative: str | None = None
-    steps: int | None = 30
-    guidance: float | None = 5.0
+    steps: int | None = None  # Unset: the speed mode's default
+    guidance: float | None = None
     model: str | None = "SSD-1B"
     aspect: str | None = "1:1"
     top_text: str | None = None
     bottom_text: str | None = None
+    variants: int | None = 1  # Primary + alternates from one LLM call, rendered together
+    speed: str | None = None  # standard | fast | draft | turbo (SPEED_MODES), DEFAULT_SPEED if unset
+
+class CreateJobBatch(BaseModel):
+    jobs: list[CreateJob]
 
 class CreateVideoJob(BaseModel):
     imageUrl: str
     numFrames: int | None = 25
 
+
+async def batch_status(batch_id: str) -> Optional[dict]:
+    """Aggregate the status of every job in a batch, or None if the batch is unknown"""
+    job_ids = [job_id.decode() for job_id in await async_redis.lrange(f"batch:{batch_id}", 0, -1)]
+    if not job_ids:
+        return None
+    
+    jobs = {}
+    for job_id, status in (await fetch_job_statuses(async_redis, redis, job_ids)).items():
+        jobs[job_id] = status if status is not None else NOT_FOUND
+    
+    counts: Dict[str, int] = {}
+    progress = 0
+    for status in jobs.values():
+        state = status.get("status", "queued")
+        counts[state] = counts.get(state, 0) + 1
+        progress += 100 if state in ("done", "error") else status.get("progress", 0)
+    
+    finished = counts.get("done", 0) + counts.get("error", 0)
+    if finished == len(jobs):
+        state = "done"
+    elif counts.get("queued", 0) == len(jobs):
+        state = "queued"
+    else:
+        state = "running"
+    
+    return {
+        "batchId": batch_id,
+        "status": state,
+        "progress": progress // len(jobs),
+        "counts": counts,
+        "jobs": jobs,
+    }
+
+def limit_body(request: Request, max_bytes: int) -> Request:
+    """
+    The request, reading its body with a size limit.
+    Raises UploadTooLargeError right away when Content-Length is over the limit, and while
+    reading once more than `max_bytes` have arrived (chunked bodies have no Content-Length).
+    """
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > max_bytes:
+        raise UploadTooLargeError(f"Request body exceeds {max_bytes} bytes")
+
+    received = 0
+
+    async def receive():
+        nonlocal received
+        message = await request.receive()
+        if message["type"] == "http.request":
+            received += len(message.get("body", b""))
+            if received > max_bytes:
+                raise UploadTooLargeError(f"Request body exceeds {max_bytes} bytes")
+        return message
+
+    return Request(request.scope, receive)
+
 @app.post("/api/jobs")
 async def create_job(request: Request):
     """
@@ -167,41 +647,43 @@ async def create_job(request: Request):
     Supports both multipart/form-data (with image upload) and JSON payloads.
     """
     job_id = str(uuid4())
+    image_file = None
+    
+    # Reject before reading any upload when the queue is saturated; the client is charged once it validates
+    await run_in_threadpool(check_queues, q)
     
     # Check content type to determine how to parse the request
     content_type = request.headers.get("content-type", "")
     
     if content_type.startswith("multipart/form-data"):
-        # Handle multipart form data
-        form = await request.form()
+        # Handle multipart form data; oversized bodies are refused before the parser spools them
+        try:
+            form = await limit_body(request, MAX_UPLOAD_BYTES + FORM_OVERHEAD_BYTES).form()
+        except UploadTooLargeError as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        variants = form_number(form, "variants")
         payload_dict = {
             "prompt": form.get("prompt"),
-            "seed": int(form.get("seed")) if form.get("seed") else None,
+            "seed": form_number(form, "seed"),
             "negative": form.get("negative_prompt") or form.get("negative"),  # Support both field names
-            "steps": int(form.get("steps")) if form.get("steps") else 30,
-            "guidance": float(form.get("guidance")) if form.get("guidance") else 5.0,
+            "steps": form_number(form, "steps"),
+            "guidance": form_number(form, "guidance", float),
             "model": form.get("model", "SSD-1B"),
             "aspect": form.get("aspect", "1:1"),
             "top_text": form.get("top_text"),
             "bottom_text": form.get("bottom_text"),
+            "variants": variants if variants is not None else 1,
+            "speed": form.get("speed") or None,
             "has_image_upload": False,
         }
         
-        # Handle uploaded image
-        if "image" in form:
-            image_file = form["image"]
-            if hasattr(image_file, 'size') and image_file.size > 0:
-                # Save uploaded image temporarily
-                upload_dir = "/tmp/uploads"
-                os.makedirs(upload_dir, exist_ok=True)
-                image_path = os.path.join(upload_dir, f"{job_id}_input.png")
-                
-                content = await image_file.read()
-                with open(image_path, "wb") as f:
-                    f.write(content)
-                
-                payload_dict["image_path"] = image_path
-                payload_dict["has_image_upload"] = True
+        # Uploaded image, stored once the request has validated and been charged
+        image = form.get("image")
+        if getattr(image, "size", 0):
+            image_file = image
+            if image_file.size > MAX_UPLOAD_BYTES:
+                await image_file.close()
+                raise HTTPException(status_code=413, detail=f"Upload exceeds {MAX_UPLOAD_BYTES} bytes")
                 
     elif content_type.startswith("application/json"):
         # Handle JSON payload (backward compatibility)
@@ -212,12 +694,14 @@ async def create_job(request: Request):
                 "prompt": json_data.get("prompt"),
                 "seed": json_data.get("seed"),
                 "negative": json_data.get("negative"),
-                "steps": json_data.get("steps", 30),
-                "guidance": json_data.get("guidance", 5.0),
+                "steps": json_data.get("steps"),
+                "guidance": json_data.get("guidance"),
                 "model": json_data.get("model", "SSD-1B"),
                 "aspect": json_data.get("aspect", "1:1"),
                 "top_text": json_data.get("top_text"),
                 "bottom_text": json_data.get("bottom_text"),
+                "variants": json_data.get("variants") or 1,
+                "speed": json_data.get("speed"),
                 "has_image_upload": False,
             }
 
@@ -229,74 +713,216 @@ async def create_job(request: Request):
     print("payload_dict")
     print(payload_dict)
     
-    # Validate required fields
-    if not payload_dict.get("prompt"):
-        raise HTTPException(status_code=400, detail="Prompt is required")
+    try:
+        # Validate required fields
+        if not payload_dict.get("prompt"):
+            raise HTTPException(status_code=400, detail="Prompt is required")
+        validate_variants(payload_dict.get("variants"))
+        validate_speed(payload_dict.get("speed"))
+        
+        # One token per image to render
+        await run_in_threadpool(charge_client, request, payload_dict["variants"])
+        
+        if image_file is not None:
+            # Stream into the shared content-addressed store (deduplicated by hash)
+            try:
+                payload_dict["image_ref"] = await upload_store.save_stream(image_file)
+            except UploadTooLargeError as e:
+                raise HTTPException(status_code=413, detail=str(e))
+            payload_dict["has_image_upload"] = True
+    finally:
+        if image_file is not None:
+            await image_file.close()
     
-    # Queue the job using direct function reference
-    q.enqueue(run_job, job_id, payload_dict, job_id=job_id)
+    enqueue_meme_jobs([(job_id, payload_dict, None)])
     return {"jobId": job_id}
 
 
 # Keep old Pydantic endpoint for backward compatibility with existing clients
 @app.post("/api/jobs/json")
-def create_job_json(payload: CreateJob):
+def create_job_json(payload: CreateJob, request: Request):
     """Legacy JSON-only endpoint for backward compatibility"""
+    validate_variants(payload.variants)
+    validate_speed(payload.speed)
+    admit_jobs(request, q, cost=payload.variants or 1)
     job_id = str(uuid4())
     payload_dict = payload.model_dump()
     payload_dict["has_image_upload"] = False
-    q.enqueue(run_job, job_id, payload_dict, job_id=job_id)
+    enqueue_meme_jobs([(job_id, payload_dict, None)])
     return {"jobId": job_id}
 
+@app.post("/api/jobs/batch")
+def create_job_batch(payload: CreateJobBatch, request: Request):
+    """
+    Create many image generation jobs at once.
+    All jobs are validated up front and enqueued in a single Redis transaction,
+    together with a batch index that can be polled or watched as one unit.
+    """
+    if not payload.jobs:
+        raise HTTPException(status_code=400, detail="At least one job is required")
+    if len(payload.jobs) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"Batch size exceeds limit of {MAX_BATCH_SIZE}")
+    for index, item in enumerate(payload.jobs):
+        if not item.prompt:
+            raise HTTPException(status_code=400, detail=f"Prompt is required (job {index})")
+        validate_variants(item.variants)
+        validate_speed(item.speed)
+    admit_jobs(request, q, jobs=len(payload.jobs), cost=sum(item.variants or 1 for item in payload.jobs))
+    
+    batch_id = str(uuid4())
+    job_ids = []
+    jobs = []
+    for item in payload.jobs:
+        job_id = str(uuid4())
+        payload_dict = item.model_dump()
+        payload_dict["has_image_upload"] = False
+        job_ids.append(job_id)
+        jobs.append((job_id, payload_dict, {"batch_id": batch_id}))
+    
+    # Jobs and batch index go out in one MULTI/EXEC round trip
+    with redis.pipeline() as pipe:
+        enqueue_meme_jobs(jobs, pipeline=pipe)
+        pipe.rpush(f"batch:{batch_id}", *job_ids)
+        pipe.expire(f"batch:{batch_id}", BATCH_TTL)
+        pipe.execute()
+    
+    return {"batchId": batch_id, "jobIds": job_ids}
+
+@app.get("/api/batches/{batch_id}")
+async def get_batch(batch_id: str):
+    status = await batch_status(batch_id)
+    if status is None:
+        return {"status":"error","message":"not found"}
+    return status
+
 @app.post("/api/video-jobs")
-def create_video_job(payload: CreateVideoJob):
+def create_video_job(payload: CreateVideoJob, request: Request):
+    admit_jobs(request, video_q)
     job_id = str(uuid4())
     video_q.enqueue(run_video_job, job_id, payload.model_dump(), job_id=job_id)
     return {"jobId": job_id}
 
+@app.get("/api/jobs")
+async def get_jobs(ids: str = Query(..., description="Comma-separated job ids")):
+    """Bulk status lookup: status/meta/result for many jobs in one pipelined round trip"""
+    job_ids = list(dict.fromkeys(job_id.strip() for job_id in ids.split(",") if job_id.strip()))
+    if len(job_ids) > MAX_STATUS_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_STATUS_IDS} ids per request")
+    try:
+        statuses = await fetch_job_statuses(async_redis, redis, job_ids)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid job id")
+    return {"jobs": {job_id: status if status is not None else NOT_FOUND for job_id, status in statuses.items()}}
+
+@app.get("/api/jobs/{job_id}/events")
+async def get_job_events(job_id: str, request: Request, lastEventId: Optional[str] = None):
+    """
+    Server-Sent Events stream of a job's updates.
+    Replays the job's event log after Last-Event-ID (header or query), then tails it live.
+    """
+    last_event_id = request.headers.get("last-event-id") or lastEventId
+    client = EventStreamClient()
+    await websocket_manager.connect(client)
+    
+    async def stream():
+        try:
+            await websocket_manager.subscribe_many(client, [job_id], since={job_id: last_event_id})
+            while True:
+                try:
+                    text = await asyncio.wait_for(client.queue.get(), timeout=SSE_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if text is None:
+                    break
+                
+                message = json.loads(text)
+                event_id = message.get("event_id")
+                yield (f"id: {event_id}\n" if event_id else "") + f"data: {text}\n\n"
+                if message.get("status") in ("done", "error"):
+                    break
+        finally:
+            websocket_manager.disconnect(client)
+    
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",  # Don't let proxies buffer the stream
+    })
+
 @app.get("/api/jobs/{job_id}")
-def get_job(job_id: str):
-    from rq.job import Job
+async def get_job(job_id: str):
     try:
-        job = Job.fetch(job_id, connection=redis)
+        status = await fetch_job_status(async_redis, redis, job_id)
     except Exception:
-        return {"status":"error","message":"not found"}
-    if job.is_finished:
-        return job.result
-    if job.is_failed:
-        return {"status":"error","message":str(job.exc_info)}
-    meta = job.meta or {}
-    return {"status": meta.get("status","queued"), "progress": meta.get("progress",0)}
+        return NOT_FOUND
+    return status if status is not None else NOT_FOUND
 
 @app.get("/api/video-jobs/{job_id}")
-def get_video_job(job_id: str):
-    from rq.job import Job
+async def get_video_job(job_id: str):
     try:
-        job = Job.fetch(job_id, connection=redis)
+        status = await fetch_job_status(async_redis, redis, job_id)
     except Exception:
-        return {"status":"error","message":"not found"}
-    if job.is_finished:
-        return job.result
-    if job.is_failed:
-        return {"status":"error","message":str(job.exc_info)}
-    meta = job.meta or {}
-    return {"status": meta.get("status","queued"), "progress": meta.get("progress",0)}
+        return NOT_FOUND
+    return status if status is not None else NOT_FOUND
 
 @app.websocket("/ws/{job_id}")
-async def websocket_endpoint(websocket: WebSocket, job_id: str):
-    """WebSocket endpoint for real-time job updates"""
-    await websocket_manager.connect(websocket, job_id)
+async def websocket_endpoint(websocket: WebSocket, job_id: str, last_event_id: Optional[str] = None):
+    """WebSocket endpoint for real-time job updates (pass last_event_id to resume after a reconnect)"""
+    await websocket_manager.connect(websocket, job_id, last_event_id)
     
     try:
         # Keep connection alive and handle incoming messages
         while True:
             # We mainly use this for receiving job status updates
-            # but we can also handle ping/pong for keepalive
+            # but we can also handle ping/pong for keepalive and extra subscriptions
             data = await websocket.receive_text()
-            message = json.loads(data)
-            
-            if message.get("type") == "ping":
-                await websocket.send_text(json.dumps({"type": "pong"}))
+            await websocket_manager.handle_message(websocket, json.loads(data))
+    except WebSocketDisconnect:
+        websocket_manager.disconnect(websocket)
+    except Exception as e:
+        print(f"WebSocket error: {e}")
+        websocket_manager.disconnect(websocket)
+
+
+@app.websocket("/ws")
+async def websocket_multi_endpoint(websocket: WebSocket):
+    """
+    WebSocket endpoint for watching many jobs on one connection.
+    Clients send {"type": "subscribe"|"unsubscribe", "jobIds": [...]} to manage their jobs.
+    """
+    await websocket_manager.connect(websocket)
+    
+    try:
+        while True:
+            data = await websocket.receive_text()
+            await websocket_manager.handle_message(websocket, json.loads(data))
+    except WebSocketDisconnect:
+        websocket_manager.disconnect(websocket)
+    except Exception as e:
+        print(f"WebSocket error: {e}")
+        websocket_manager.disconnect(websocket)
+
+
+@app.websocket("/ws/batch/{batch_id}")
+async def websocket_batch_endpoint(websocket: WebSocket, batch_id: str):
+    """WebSocket endpoint for real-time updates of every job in a batch"""
+    await websocket_manager.connect(websocket)
+    
+    try:
+        status = await batch_status(batch_id)
+        if status is None:
+            websocket_manager.disconnect(websocket)
+            await websocket.send_text(json.dumps(NOT_FOUND))
+            await websocket.close()
+            return
+        
+        # Individual job updates carry their job_id; the snapshot covers the whole batch
+        await websocket_manager.subscribe_many(websocket, list(status["jobs"]), send_status=False)
+        websocket_manager.send(websocket, {"type": "batch", **status})
+        
+        while True:
+            data = await websocket.receive_text()
+            await websocket_manager.handle_message(websocket, json.loads(data))
     except WebSocketDisconnect:
         websocket_manager.disconnect(websocket)
     except Exception as e:
@@ -307,3 +933,11 @@ async def websocket_endpoint(websocket: WebSocket, job_id: str):
 @app.get("/api/health")
 def health():
     return {"ok": True}
+
+@app.get("/api/llm")
+def llm_status():
+    """Ollama circuit breaker state and counters, with the share of texts from the local fallback"""
+    stats = ollama_breaker.stats()
+    texts = stats.get("texts", 0)
+    stats["fallback_rate"] = round(stats.get("fallbacks", 0) / texts, 3) if texts else 0.0
+    return stats
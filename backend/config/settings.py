@@ -42,8 +42,151 @@ flux_model_id = {
 OUT_DIR = "/outputs"
 FONT_PATH = "/fonts/Anton-Regular.ttf"
 OLLAMA_HOST = os.environ.get("OLLAMA_HOST", "http://localhost:11434")
+OLLAMA_NUM_PARALLEL = int(os.environ.get("OLLAMA_NUM_PARALLEL", "4"))  # Match Ollama's parallel slots
+OLLAMA_CONNECT_TIMEOUT = float(os.environ.get("OLLAMA_CONNECT_TIMEOUT", "5"))
+# Stream generations: stop once the meme fields are complete and show the text live
+OLLAMA_STREAM = os.environ.get("OLLAMA_STREAM", "1") == "1"
+LIVE_TEXT_MIN_INTERVAL = float(os.environ.get("LIVE_TEXT_MIN_INTERVAL", "0.25"))  # Seconds between text updates per job
+# Share of streamed calls read to Ollama's last chunk anyway, for its real token counts and timings
+LLM_STATS_SAMPLE = float(os.environ.get("LLM_STATS_SAMPLE", "0.05"))
+# How long Ollama keeps the model loaded after a call: a duration ("30m") or seconds (-1 = never unload)
+OLLAMA_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "-1")
+OLLAMA_KEEP_ALIVE = int(OLLAMA_KEEP_ALIVE) if OLLAMA_KEEP_ALIVE.lstrip("-").isdigit() else OLLAMA_KEEP_ALIVE
+# Latency budget of the text stage and circuit breaker around Ollama (services/circuit_breaker.py)
+LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", "20"))  # Seconds before a job falls back to local captions
+LLM_BREAKER_FAILURES = int(os.environ.get("LLM_BREAKER_FAILURES", "3"))  # Consecutive failures that open it
+LLM_BREAKER_COOLDOWN = float(os.environ.get("LLM_BREAKER_COOLDOWN", "60"))  # Seconds Ollama is skipped once open
+LLM_BREAKER_SLOW = float(os.environ.get("LLM_BREAKER_SLOW", "10"))  # Slower calls count as failures (0 = off)
 HF_TOKEN = os.environ.get("HF_TOKEN", None)
 
+# Upload store shared by API and workers ("file" on a shared volume, or "redis" blobs)
+UPLOAD_DIR = os.environ.get("UPLOAD_DIR", "/uploads")
+UPLOAD_BACKEND = os.environ.get("UPLOAD_BACKEND", "file")
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+FORM_OVERHEAD_BYTES = 64 * 1024  # Text fields and multipart framing allowed on top of MAX_UPLOAD_BYTES
+UPLOAD_TTL = int(os.environ.get("UPLOAD_TTL", str(24 * 3600)))  # Seconds an upload is kept after its last upload
+
+# Redis connection pool used by the API for async status reads
+REDIS_MAX_CONNECTIONS = int(os.environ.get("REDIS_MAX_CONNECTIONS", "50"))
+MAX_STATUS_IDS = int(os.environ.get("MAX_STATUS_IDS", "500"))  # Ids per bulk GET /api/jobs
+
+# WebSocket fan-out
+WS_SEND_QUEUE_SIZE = int(os.environ.get("WS_SEND_QUEUE_SIZE", "64"))  # Pending messages per connection
+WS_SEND_TIMEOUT = float(os.environ.get("WS_SEND_TIMEOUT", "10"))  # Seconds before a stuck send drops the client
+WS_MAX_SUBSCRIPTIONS = int(os.environ.get("WS_MAX_SUBSCRIPTIONS", "1000"))  # Jobs per connection
+PUBSUB_MAX_BACKOFF = float(os.environ.get("PUBSUB_MAX_BACKOFF", "30"))  # Seconds between listener reconnects
+
+# Durable per-job event log (Redis Streams) for replay on reconnect
+JOB_EVENTS_MAXLEN = int(os.environ.get("JOB_EVENTS_MAXLEN", "200"))
+JOB_EVENTS_TTL = int(os.environ.get("JOB_EVENTS_TTL", str(24 * 3600)))
+SSE_KEEPALIVE = float(os.environ.get("SSE_KEEPALIVE", "15"))  # Seconds between SSE keepalive comments
+
+# Admission control: reject new jobs (429) once a queue's estimated wait exceeds its limit
+ADMISSION_MAX_WAIT = {
+    "meme": int(os.environ.get("ADMISSION_MAX_WAIT_MEME", "600")),    # meme jobs time out at 1000s
+    "video": int(os.environ.get("ADMISSION_MAX_WAIT_VIDEO", "1800")),  # video jobs time out at 3000s
+}
+ADMISSION_DEFAULT_JOB_SECONDS = {"meme": 20, "video": 180}  # Used until durations are recorded
+ADMISSION_DURATION_SAMPLES = 50  # Recent job durations kept per queue
+RATE_LIMIT_PER_MINUTE = float(os.environ.get("RATE_LIMIT_PER_MINUTE", "60"))  # Per client, 0 disables
+RATE_LIMIT_BURST = int(os.environ.get("RATE_LIMIT_BURST", "100"))
+
+# Output encoding: finished images are encoded off-thread and renamed into place
+OUTPUT_FORMAT = os.environ.get("OUTPUT_FORMAT", "png")  # png | webp | jpeg
+OUTPUT_PNG_COMPRESS_LEVEL = int(os.environ.get("OUTPUT_PNG_COMPRESS_LEVEL", "3"))  # 0-9, PIL's default is 6
+OUTPUT_QUALITY = int(os.environ.get("OUTPUT_QUALITY", "90"))  # WebP/JPEG quality
+OUTPUT_ENCODE_THREADS = int(os.environ.get("OUTPUT_ENCODE_THREADS", "2"))
+OUTPUT_PENDING_WAIT = float(os.environ.get("OUTPUT_PENDING_WAIT", "5"))  # Seconds the API waits for an encoding output
+
+# Output store: sharded output files indexed in Redis (durable results, recent listing, GC)
+OUTPUT_MAX_AGE = int(os.environ.get("OUTPUT_MAX_AGE", "0"))  # Seconds before GC deletes an output, 0 = never
+OUTPUT_MAX_BYTES = int(os.environ.get("OUTPUT_MAX_BYTES", "0"))  # GC deletes oldest outputs beyond this, 0 = no cap
+OUTPUT_GC_INTERVAL = int(os.environ.get("OUTPUT_GC_INTERVAL", "600"))  # Seconds between GC runs
+OUTPUT_PAGE_MAX = 100  # Max items per page of GET /api/outputs
+
+# Output serving: on-disk cache of thumbnail/WebP variants
+VARIANT_CACHE_DIR = os.environ.get("VARIANT_CACHE_DIR", os.path.join(OUT_DIR, ".variants"))
+VARIANT_CACHE_MAX_BYTES = int(os.environ.get("VARIANT_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+VARIANT_WIDTHS = (128, 256, 512, 1024)  # Requested widths are rounded up to one of these
+
+# Cache of pre-caption base images keyed by diffusion parameters (LRU, shared by workers)
+BASE_CACHE_ENABLED = os.environ.get("BASE_CACHE_ENABLED", "1") == "1"
+BASE_CACHE_DIR = os.environ.get("BASE_CACHE_DIR", os.path.join(OUT_DIR, ".base_cache"))
+BASE_CACHE_MAX_BYTES = int(os.environ.get("BASE_CACHE_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+
+# LLM result cache: (model, temperature, normalized prompt) -> meme texts
+LLM_CACHE_ENABLED = os.environ.get("LLM_CACHE_ENABLED", "1") == "1"
+LLM_CACHE_TTL = int(os.environ.get("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+LLM_CACHE_LOCAL_SIZE = int(os.environ.get("LLM_CACHE_LOCAL_SIZE", "512"))  # Entries kept in process memory
+LLM_CACHE_MAX_ANSWERS = int(os.environ.get("LLM_CACHE_MAX_ANSWERS", "4"))  # Answers kept per prompt
+LLM_CACHE_DIVERSITY = float(os.environ.get("LLM_CACHE_DIVERSITY", "0.2"))  # Chance of a fresh answer on a hit
+LLM_CACHE_NEAR_THRESHOLD = float(os.environ.get("LLM_CACHE_NEAR_THRESHOLD", "0.8"))  # MinHash similarity, 0 disables
+
+# Job progress updates: throttle per-step reports (milestones always go out)
+PROGRESS_MIN_INTERVAL = float(os.environ.get("PROGRESS_MIN_INTERVAL", "0.5"))  # Seconds between updates
+PROGRESS_MIN_DELTA = int(os.environ.get("PROGRESS_MIN_DELTA", "2"))  # Percent between updates
+
+# Live previews of in-progress diffusion (SSD-1B/SDXL), published on job_updates:* only
+PREVIEWS_ENABLED = os.environ.get("PREVIEWS_ENABLED", "1") == "1"
+PREVIEW_DECODER = os.environ.get("PREVIEW_DECODER", "linear")  # linear (latent->RGB projection) | taesd
+PREVIEW_EVERY = int(os.environ.get("PREVIEW_EVERY", "5"))  # Decode every k denoising steps
+PREVIEW_MIN_INTERVAL = float(os.environ.get("PREVIEW_MIN_INTERVAL", "1.0"))  # Seconds between frames per job
+PREVIEW_MAX_SIZE = int(os.environ.get("PREVIEW_MAX_SIZE", "256"))  # Pixels per side
+PREVIEW_QUALITY = int(os.environ.get("PREVIEW_QUALITY", "60"))  # JPEG quality, halved until under the byte cap
+PREVIEW_MAX_BYTES = int(os.environ.get("PREVIEW_MAX_BYTES", str(24 * 1024)))
+TAESD_MODEL_ID = "madebyollin/taesdxl"
+
+# Warm worker (warm_worker.py): models loaded and warmed up once per process
+WORKER_PRELOAD = [m.strip() for m in os.environ.get("WORKER_PRELOAD", "SSD-1B").split(",") if m.strip()]
+WORKER_WARMUP_STEPS = int(os.environ.get("WORKER_WARMUP_STEPS", "2"))
+WORKER_READY_FILE = os.environ.get("WORKER_READY_FILE", "/tmp/worker.ready")  # Exists once warm
+WORKER_MAX_JOBS = int(os.environ.get("WORKER_MAX_JOBS", "0"))  # Recycle the process after N jobs, 0 = never
+# CPU worker pool (cpu_pool.py): forked workers sharing the parent's weights, pinned to disjoint cores
+CPU_POOL_PROCESSES = int(os.environ.get("CPU_POOL_PROCESSES", "0"))  # 0 = one per 4 cores
+CPU_POOL_THREADS = int(os.environ.get("CPU_POOL_THREADS", "0"))  # Cores per process, 0 = split all evenly
+
+# Model registry: resident pipelines are kept under a memory budget (LRU eviction)
+MODEL_MEMORY_BUDGET = int(os.environ.get("MODEL_MEMORY_BUDGET", "0"))  # Bytes, 0 = 90% of GPU memory
+MODEL_PARK_MODE = os.environ.get("MODEL_PARK_MODE", "cpu")  # Evicted pipelines: free | cpu | offload
+MODEL_PARK_MAX_BYTES = int(os.environ.get("MODEL_PARK_MAX_BYTES", str(24 * 1024**3)))  # RAM for parked pipelines
+
+# Staged meme pipeline: text, diffusion and finish stages on their own queues/worker pools
+MEME_PIPELINE_STAGED = os.environ.get("MEME_PIPELINE_STAGED", "1") == "1"
+MEME_TEXT_QUEUE = "meme"  # Entry queue, same as the single-stage run_job
+MEME_DIFFUSION_QUEUE = "meme_diffusion"
+MEME_FINISH_QUEUE = "meme_finish"
+PIPELINE_HANDOFF_TTL = int(os.environ.get("PIPELINE_HANDOFF_TTL", "3600"))  # Seconds to keep stage state
+# Diffusion is the bottleneck stage, so admission also watches its queue
+ADMISSION_MAX_WAIT.setdefault(MEME_DIFFUSION_QUEUE, ADMISSION_MAX_WAIT["meme"])
+ADMISSION_DEFAULT_JOB_SECONDS.setdefault(MEME_DIFFUSION_QUEUE, 15)
+# Micro-batching diffusion worker (diffusion_batcher.py)
+DIFFUSION_BATCH_SIZE = int(os.environ.get("DIFFUSION_BATCH_SIZE", "4"))  # Max images per pipeline call
+DIFFUSION_BATCH_WAIT = float(os.environ.get("DIFFUSION_BATCH_WAIT", "0.25"))  # Seconds to wait for a batch to fill
+
+# Batch job submission
+MAX_BATCH_SIZE = int(os.environ.get("MAX_BATCH_SIZE", "100"))
+BATCH_TTL = int(os.environ.get("BATCH_TTL", str(24 * 3600)))  # Seconds to keep batch -> job ids index
+
+# Multi-variant memes: one LLM call, primary + alternates rendered together
+MAX_VARIANTS = int(os.environ.get("MAX_VARIANTS", "4"))  # Max variants per job, the primary included
+CONTACT_SHEET_THUMB = int(os.environ.get("CONTACT_SHEET_THUMB", "384"))  # Pixels per side of each sheet tile
+
+# Speed modes: sampler swapped into the pipeline per job, with matching defaults (models/schedulers.py)
+SPEED_MODES = {
+    "standard": {"scheduler": "default", "steps": 30, "guidance": 5.0},  # The checkpoint's own scheduler
+    "fast": {"scheduler": "dpmpp_2m", "steps": 12, "guidance": 5.0},     # DPM-Solver++ 2M Karras
+    "draft": {"scheduler": "euler_a", "steps": 8, "guidance": 4.0},      # Euler ancestral
+    "turbo": {"scheduler": "lcm", "steps": 4, "guidance": 1.0},          # LCM + LCM-LoRA, no CFG
+}
+DEFAULT_SPEED = os.environ.get("DEFAULT_SPEED", "standard")
+TURBO_FALLBACK = "draft"  # Used instead of turbo when a model has no local LCM-LoRA
+# LCM-LoRA per model: hub id (only used if already in ./model_cache) or local directory
+LCM_LORA_IDS = {
+    "SSD-1B": os.environ.get("LCM_LORA_SSD1B", "latent-consistency/lcm-lora-ssd-1b"),
+    "SDXL": os.environ.get("LCM_LORA_SDXL", "latent-consistency/lcm-lora-sdxl"),
+}
+
 # Device and dtype settings
 device = "cuda" if torch.cuda.is_available() else "cpu"
 dtype = torch.float16 if device == "cuda" else torch.float32
@@ -0,0 +1,243 @@
+"""
+Pool of CPU workers sharing one copy of the model weights.
+
+Each `rq worker` on a CPU node loads its own copy of the pipelines, so memory rather
+than cores limits how many can run. This entry point loads the WORKER_PRELOAD models
+once in a parent process and forks the workers from it: the weights are never written
+after loading, so all children share the same physical pages (copy-on-write). Each child
+is pinned to its own set of cores with a matching torch.set_num_threads, warms up and
+then runs jobs in-process like warm_worker.py. A child that exits (WORKER_MAX_JOBS
+recycling or a crash) is forked again from the still-loaded parent.
+
+    python cpu_pool.py [--processes N] [--threads T] meme_diffusion [queue ...]
+    python cpu_pool.py --benchmark [--steps S] [--images I]
+
+The benchmark runs every processes x threads split of the available cores and prints the
+throughput of each, to pick CPU_POOL_PROCESSES / CPU_POOL_THREADS for a host.
+"""
+import argparse
+import gc
+import multiprocessing
+import os
+import signal
+import sys
+import time
+from multiprocessing.connection import wait
+from typing import List, Tuple
+
+import torch
+
+from config.settings import (
+    WORKER_PRELOAD, WORKER_MAX_JOBS, CPU_POOL_PROCESSES, CPU_POOL_THREADS,
+)
+from services import output_encoder
+from warm_worker import WarmWorker, set_ready, warm_up
+
+# Fork (not spawn) is what lets the children share the parent's weights
+_ctx = multiprocessing.get_context("fork")
+
+
+def available_cores() -> List[int]:
+    """Cores this process may run on (respects container cpusets)"""
+    return sorted(os.sched_getaffinity(0))
+
+
+def core_groups(processes: int, threads: int = 0) -> List[List[int]]:
+    """
+    Split the available cores into disjoint groups, one per process.
+
+    Args:
+        processes: Number of worker processes
+        threads: Cores per process (0 = all cores divided evenly)
+
+    Returns:
+        List of core ids per process
+    """
+    cores = available_cores()
+    threads = threads or len(cores) // processes
+    if processes < 1 or threads < 1 or processes * threads > len(cores):
+        raise ValueError(f"Cannot run {processes} process(es) x {threads} thread(s) on {len(cores)} core(s)")
+    return [cores[i * threads:(i + 1) * threads] for i in range(processes)]
+
+
+def pool_splits(cores: int) -> List[Tuple[int, int]]:
+    """(processes, threads) splits that use all cores, from one big process to one per core"""
+    return [(processes, cores // processes) for processes in range(1, cores + 1) if cores % processes == 0]
+
+
+def pin_to_cores(cores: List[int]):
+    os.sched_setaffinity(0, cores)
+    torch.set_num_threads(len(cores))
+
+
+def load_shared_models(models=WORKER_PRELOAD):
+    """
+    Load the models in the parent, before forking.
+    No inference runs here: initializing the OpenMP thread pool before fork() can
+    deadlock the children, so warmup happens in each child once it is pinned.
+    """
+    from models.registry import model_registry
+    import models.image_models  # Registers the image pipelines
+
+    for model in models:
+        if model == "SVD":
+            import services.video_service  # Registers SVD
+        started_at = time.time()
+        model_registry.get(model)
+        print(f"== {model} loaded for sharing in {time.time() - started_at:.1f}s ==")
+
+    # Keep the GC from touching (and so un-sharing) the pages of the loaded objects
+    gc.collect()
+    gc.freeze()
+
+
+def _run_worker(cores: List[int], queues: List[str], ready):
+    pin_to_cores(cores)
+    # The parent's handlers would forward our own signals back to the pool
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    warm_up()
+    ready.set()
+
+    from redis import Redis
+    worker = WarmWorker(queues, connection=Redis(host="redis", port=6379))
+    print(f"Worker {os.getpid()} on cores {cores} listening on {', '.join(queues)}")
+    try:
+        worker.work(max_jobs=WORKER_MAX_JOBS or None)
+    finally:
+        output_encoder.drain()
+
+
+def run_pool(queues: List[str], processes: int, threads: int = 0):
+    """
+    Fork one pinned worker per core group and keep them running.
+
+    Args:
+        queues: RQ queues the workers listen on
+        processes: Number of worker processes
+        threads: Cores per process (0 = all cores divided evenly)
+    """
+    set_ready(False)
+    groups = core_groups(processes, threads)
+    load_shared_models()
+
+    def start(cores):
+        ready = _ctx.Event()
+        process = _ctx.Process(target=_run_worker, args=(cores, queues, ready), daemon=False)
+        process.start()
+        return process, ready
+
+    children = {i: start(cores) for i, cores in enumerate(groups)}
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for process, _ in children.values():
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGTERM)  # rq's warm shutdown
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for _, ready in children.values():
+        ready.wait()
+    set_ready(True)
+    print(f"CPU pool ready: {processes} worker(s) on cores {groups}")
+
+    try:
+        while not stopping:
+            sentinels = {process.sentinel: i for i, (process, _) in children.items()}
+            for sentinel in wait(list(sentinels)):
+                i = sentinels[sentinel]
+                process, _ = children[i]
+                process.join()
+                if not stopping:
+                    print(f"Worker {process.pid} exited with code {process.exitcode}; forking a new one")
+                    children[i] = start(groups[i])
+    finally:
+        set_ready(False)
+        for process, _ in children.values():
+            process.join()
+
+
+def _run_benchmark(cores: List[int], models: List[str], steps: int, images: int, barrier, results):
+    from services.image_service import generate_image
+
+    pin_to_cores(cores)
+    for model in models:
+        generate_image("warmup", steps=1, model=model, seed=0)
+    barrier.wait()
+    started_at = time.perf_counter()
+    for i in range(images):
+        for model in models:
+            generate_image("a cat wearing sunglasses", steps=steps, model=model, seed=i)
+    results.put(time.perf_counter() - started_at)
+
+
+def benchmark(models=WORKER_PRELOAD, steps: int = 10, images: int = 2):
+    """
+    Measure image throughput for every processes x threads split of the available cores.
+
+    Args:
+        models: Models each process generates with
+        steps: Denoising steps per image
+        images: Images per process and model
+
+    Returns:
+        (processes, threads) with the highest throughput
+    """
+    models = [model for model in models if model != "SVD"]
+    load_shared_models(models)
+    cores = len(available_cores())
+    print(f"\n{'processes':>9} {'threads':>7} {'images/min':>10} {'s/image':>8}")
+
+    best, best_rate = None, 0.0
+    for processes, threads in pool_splits(cores):
+        barrier = _ctx.Barrier(processes + 1)
+        results = _ctx.Queue()
+        children = [
+            _ctx.Process(target=_run_benchmark, args=(group, models, steps, images, barrier, results))
+            for group in core_groups(processes, threads)
+        ]
+        for process in children:
+            process.start()
+        barrier.wait()  # Start timing once every process is warm
+        started_at = time.perf_counter()
+        durations = [results.get() for _ in children]
+        elapsed = time.perf_counter() - started_at
+        for process in children:
+            process.join()
+
+        generated = processes * images * len(models)
+        rate = generated / elapsed * 60
+        latency = sum(durations) / (images * len(models) * processes)
+        print(f"{processes:>9} {threads:>7} {rate:>10.1f} {latency:>8.1f}")
+        if rate > best_rate:
+            best, best_rate = (processes, threads), rate
+
+    print(f"\nBest split: CPU_POOL_PROCESSES={best[0]} CPU_POOL_THREADS={best[1]} ({best_rate:.1f} images/min)")
+    return best
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("queues", nargs="*", default=["meme_diffusion"])
+    parser.add_argument("--processes", type=int, default=CPU_POOL_PROCESSES)
+    parser.add_argument("--threads", type=int, default=CPU_POOL_THREADS)
+    parser.add_argument("--benchmark", action="store_true", help="Time every processes x threads split and exit")
+    parser.add_argument("--steps", type=int, default=10, help="Benchmark denoising steps per image")
+    parser.add_argument("--images", type=int, default=2, help="Benchmark images per process")
+    args = parser.parse_args(argv)
+
+    if args.benchmark:
+        benchmark(steps=args.steps, images=args.images)
+        return
+    # One process per 4 cores unless configured
+    processes = args.processes or max(1, len(available_cores()) // 4)
+    run_pool(args.queues, processes, args.threads)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
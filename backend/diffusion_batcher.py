@@ -0,0 +1,128 @@
+"""
+Micro-batching worker for the diffusion stage of the meme pipeline.
+
+Runs instead of warm_worker.py on the meme_diffusion queue. It is a WarmWorker, so the
+WORKER_PRELOAD models are loaded and warmed up before it takes jobs, and jobs are
+dequeued by RQ as usual. When it dequeues a diffusion stage job it also takes up to
+DIFFUSION_BATCH_SIZE - 1 more from the same queue, waiting at most DIFFUSION_BATCH_WAIT
+seconds for the batch to fill, and lists their public jobs in the first job's meta
+("batch"). worker.run_diffusion_stage then renders them all with one call of
+worker.run_diffusion_batch, which groups compatible jobs into batched pipeline calls.
+
+Every job is then executed by RQ like any other: the first one does the work under its
+own timeout, the others find their public job already handed off and return at once.
+If the first job fails or its worker dies, its failure callback releases the public
+jobs of the whole batch. A job of another kind found while filling a batch is put back
+at the front of the queue.
+
+Only public RQ APIs are used; the version it was written against is pinned in
+requirements.txt and checked at startup.
+
+    python diffusion_batcher.py [queue ...]
+"""
+import sys
+import time
+from typing import List, Optional, Tuple
+
+import rq
+from redis import Redis
+from rq.exceptions import StopRequested
+from rq.job import Job
+from rq.queue import Queue
+from rq.worker import SimpleWorker
+
+from config.settings import (
+    MEME_DIFFUSION_QUEUE, DIFFUSION_BATCH_SIZE, DIFFUSION_BATCH_WAIT, WORKER_MAX_JOBS,
+)
+from services import output_encoder
+from services.meme_pipeline import DIFFUSION_STAGE
+from warm_worker import WarmWorker, publish_registry_stats, set_ready, warm_up
+
+RQ_VERSION = "2.12."
+
+
+class BatchingWorker(WarmWorker):
+    """WarmWorker that runs queued diffusion stage jobs in batches"""
+
+    def __init__(self, *args, batch_size: int = DIFFUSION_BATCH_SIZE, batch_wait: float = DIFFUSION_BATCH_WAIT,
+                 **kwargs):
+        super().__init__(*args, **kwargs)
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+
+    def execute_job(self, job, queue):
+        if job.func_name != DIFFUSION_STAGE or self.batch_size < 2:
+            return super().execute_job(job, queue)
+
+        extras, other = self.collect_batch(queue)
+        if other is not None:
+            self.requeue(other, queue)
+        if extras:
+            print(f"Processing batch of {len(extras) + 1} diffusion job(s)")
+            job.meta["batch"] = [extra.args[0] for extra in extras]
+            job.save_meta()
+        for batch_job in [job, *extras]:
+            SimpleWorker.execute_job(self, batch_job, queue)
+        publish_registry_stats(self.connection, self.name)
+        if self.fatal_error:
+            raise StopRequested()
+
+    def collect_batch(self, queue: Queue) -> Tuple[List[Job], Optional[Job]]:
+        """
+        Dequeue up to batch_size - 1 more diffusion stage jobs from the queue, polling
+        for at most batch_wait seconds. Returns them and the job of another kind that
+        stopped the batch, if any.
+        """
+        jobs = []
+        deadline = time.monotonic() + self.batch_wait
+        while len(jobs) < self.batch_size - 1:
+            result = self.queue_class.dequeue_any(
+                [queue], None, connection=self.connection, job_class=self.job_class, serializer=self.serializer,
+            )
+            if result is None:
+                if time.monotonic() >= deadline:
+                    break
+                time.sleep(0.02)
+                continue
+            job, _ = result
+            if job.func_name != DIFFUSION_STAGE:
+                return jobs, job
+            if len(self.queues) > 1:
+                # RQ only takes jobs off the intermediate queue itself for single-queue workers
+                queue.intermediate_queue.remove(job.id)
+            jobs.append(job)
+        return jobs, None
+
+    def requeue(self, job: Job, queue: Queue):
+        """Put a dequeued job back at the front of its queue"""
+        queue.intermediate_queue.remove(job.id)
+        queue.enqueue_job(job, at_front=True)
+
+
+def check_rq_version():
+    if not rq.__version__.startswith(RQ_VERSION):
+        sys.exit(f"diffusion_batcher.py needs rq {RQ_VERSION}x (see requirements.txt), found {rq.__version__}")
+
+
+def main(queues):
+    check_rq_version()
+    set_ready(False)
+    warm_up()
+
+    connection = Redis(host="redis", port=6379)
+    worker = BatchingWorker(queues or [MEME_DIFFUSION_QUEUE], connection=connection)
+    print(f"Diffusion batcher listening on {', '.join(queues or [MEME_DIFFUSION_QUEUE])} "
+          f"(batch size {DIFFUSION_BATCH_SIZE}, max wait {DIFFUSION_BATCH_WAIT}s)")
+    publish_registry_stats(connection, worker.name)
+    set_ready(True)
+    try:
+        worker.work(max_jobs=WORKER_MAX_JOBS or None)
+    finally:
+        set_ready(False)
+        output_encoder.drain()
+    if worker.fatal_error:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
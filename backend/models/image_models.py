@@ -3,80 +3,84 @@ from diffusers import StableDiffusionXLPipeline, DiffusionPipeline, FluxPipeline
 
 # Import configurations
 from config.settings import ssd1b_model_id, sdxl_model_id, sdxl_refiner_model_id, flux_model_id, device, dtype, HF_TOKEN
+from models.registry import model_registry
 
-# Global model instances
-_pipe = None
-_base_pipe = None
-_refiner_pipe = None
-_flux_pipe = None
 
-
-def load_sdxl_models():
-    """Load SDXL base and refiner models."""
-    global _base_pipe, _refiner_pipe
-    
-    if _base_pipe is None:
-        print("\n== Loading SDXL base model with dtype: {} ==".format(dtype))
-        _base_pipe = DiffusionPipeline.from_pretrained(
-            pretrained_model_name_or_path=sdxl_model_id["model_id"],
-            use_safetensors=sdxl_model_id["use_safetensors"],
-            variant=sdxl_model_id["variant"],
-            torch_dtype=sdxl_model_id["dtype"],
-            cache_dir="./model_cache",
-            token=HF_TOKEN
-        ).to(device)
+def _load_sdxl():
+    """Load SDXL base and refiner models (the refiner shares the base VAE and text encoder)."""
+    print("\n== Loading SDXL base model with dtype: {} ==".format(dtype))
+    base_pipe = DiffusionPipeline.from_pretrained(
+        pretrained_model_name_or_path=sdxl_model_id["model_id"],
+        use_safetensors=sdxl_model_id["use_safetensors"],
+        variant=sdxl_model_id["variant"],
+        torch_dtype=sdxl_model_id["dtype"],
+        cache_dir="./model_cache",
+        token=HF_TOKEN
+    ).to(device)
     print("\n== SDXL BASE MODEL LOADED ==")
 
-    if _refiner_pipe is None:
-        print("\n== Loading SDXL refiner model with dtype: {} ==".format(dtype))
-        _refiner_pipe = DiffusionPipeline.from_pretrained(
-            pretrained_model_name_or_path=sdxl_refiner_model_id["model_id"],
-            use_safetensors=sdxl_refiner_model_id["use_safetensors"],
-            variant=sdxl_refiner_model_id["variant"],
-            torch_dtype=sdxl_refiner_model_id["dtype"],
-            cache_dir="./model_cache",
-            vae=_base_pipe.vae,
-            text_encoder_2=_base_pipe.text_encoder_2,
-            token=HF_TOKEN
-        ).to(device)
+    print("\n== Loading SDXL refiner model with dtype: {} ==".format(dtype))
+    refiner_pipe = DiffusionPipeline.from_pretrained(
+        pretrained_model_name_or_path=sdxl_refiner_model_id["model_id"],
+        use_safetensors=sdxl_refiner_model_id["use_safetensors"],
+        variant=sdxl_refiner_model_id["variant"],
+        torch_dtype=sdxl_refiner_model_id["dtype"],
+        cache_dir="./model_cache",
+        vae=base_pipe.vae,
+        text_encoder_2=base_pipe.text_encoder_2,
+        token=HF_TOKEN
+    ).to(device)
     print("\n== SDXL REFINER MODEL LOADED ==")
-    
-    return _base_pipe, _refiner_pipe
 
+    return base_pipe, refiner_pipe
 
-def get_pipe():
-    """Load and return SSD-1B pipeline."""
-    global _pipe
-    
-    if _pipe is None:
-        print("\n== Loading SSD-1B model with dtype: {} ==".format(dtype))
-        _pipe = StableDiffusionXLPipeline.from_pretrained(
-            pretrained_model_name_or_path=ssd1b_model_id["model_id"],
-            use_safetensors=ssd1b_model_id["use_safetensors"],
-            variant=ssd1b_model_id["variant"],
-            torch_dtype=ssd1b_model_id["dtype"],
-            cache_dir="./model_cache",
-            token=HF_TOKEN
-        ).to(device)
+
+def _load_ssd1b():
+    """Load SSD-1B pipeline."""
+    print("\n== Loading SSD-1B model with dtype: {} ==".format(dtype))
+    pipe = StableDiffusionXLPipeline.from_pretrained(
+        pretrained_model_name_or_path=ssd1b_model_id["model_id"],
+        use_safetensors=ssd1b_model_id["use_safetensors"],
+        variant=ssd1b_model_id["variant"],
+        torch_dtype=ssd1b_model_id["dtype"],
+        cache_dir="./model_cache",
+        token=HF_TOKEN
+    ).to(device)
     print("\n== SSD-1B MODEL LOADED ==")
-    
-    return _pipe
 
+    return pipe
 
-def get_flux_pipe():
-    """Load and return Flux pipeline."""
-    global _flux_pipe
-    
-    if _flux_pipe is None:
-        print("\n== Loading Flux model with dtype: {} ==".format(flux_model_id["dtype"]))
-        _flux_pipe = FluxPipeline.from_pretrained(
-            pretrained_model_name_or_path=flux_model_id["model_id"],
-            torch_dtype=flux_model_id["dtype"],
-            cache_dir="./model_cache",
-            token=HF_TOKEN
-        ).to(device)
-        # Enable CPU offloading to save VRAM as recommended in docs
-        #_flux_pipe.enable_model_cpu_offload()
+
+def _load_flux():
+    """Load Flux pipeline."""
+    print("\n== Loading Flux model with dtype: {} ==".format(flux_model_id["dtype"]))
+    pipe = FluxPipeline.from_pretrained(
+        pretrained_model_name_or_path=flux_model_id["model_id"],
+        torch_dtype=flux_model_id["dtype"],
+        cache_dir="./model_cache",
+        token=HF_TOKEN
+    ).to(device)
     print("\n== FLUX MODEL LOADED ==")
-    
-    return _flux_pipe
+
+    return pipe
+
+
+# Pipelines live in the shared registry, which keeps them under the memory budget
+model_registry.register("SDXL", _load_sdxl)
+model_registry.register("SSD-1B", _load_ssd1b)
+model_registry.register("Flux-1", _load_flux)
+
+
+def load_sdxl_models():
+    """Return the SDXL (base, refiner) pipelines, loading them if needed."""
+    return model_registry.get("SDXL")
+
+
+def get_pipe():
+    """Return the SSD-1B pipeline, loading it if needed."""
+    return model_registry.get("SSD-1B")
+
+
+def get_flux_pipe():
+    """Return the Flux pipeline, loading it if needed."""
+    return model_registry.get("Flux-1")
@@ -0,0 +1,199 @@
+"""
+Memory-budgeted registry of loaded diffusion pipelines.
+
+Pipelines are loaded on first use and kept resident on the device while their measured
+footprint (parameter and buffer bytes) fits MODEL_MEMORY_BUDGET. Loading or reviving a
+pipeline that does not fit evicts the least recently used ones first. Depending on
+MODEL_PARK_MODE an evicted pipeline is freed, parked in CPU RAM (up to
+MODEL_PARK_MAX_BYTES) or switched to accelerate's model CPU offload, so coming back to it
+is cheaper than a cold load from disk.
+"""
+import gc
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List
+
+import torch
+
+from config.settings import device, MODEL_MEMORY_BUDGET, MODEL_PARK_MODE, MODEL_PARK_MAX_BYTES
+
+
+RESIDENT = "resident"
+PARKED = "parked"        # Moved to CPU RAM
+OFFLOADED = "offloaded"  # Model CPU offload: still usable, weights stream to the device per module
+
+PARK_MODES = ("free", "cpu", "offload")
+
+
+def _pipelines(pipe) -> tuple:
+    # SDXL is registered as a (base, refiner) pair sharing some components
+    return pipe if isinstance(pipe, tuple) else (pipe,)
+
+
+def pipeline_modules(pipe) -> List[torch.nn.Module]:
+    """The torch modules of a pipeline (or pipeline tuple), each counted once"""
+    modules = {}
+    for p in _pipelines(pipe):
+        for component in getattr(p, "components", {}).values():
+            if isinstance(component, torch.nn.Module):
+                modules[id(component)] = component
+    return list(modules.values())
+
+
+def measure_footprint(pipe) -> int:
+    """Bytes taken by the parameters and buffers of a pipeline"""
+    return sum(
+        tensor.numel() * tensor.element_size()
+        for module in pipeline_modules(pipe)
+        for tensor in itertools.chain(module.parameters(), module.buffers())
+    )
+
+
+def default_budget() -> int:
+    """Configured budget, or 90% of the GPU memory (unbounded on CPU)"""
+    if MODEL_MEMORY_BUDGET > 0:
+        return MODEL_MEMORY_BUDGET
+    if device == "cuda":
+        return int(torch.cuda.get_device_properties(0).total_memory * 0.9)
+    return 0
+
+
+class _Entry:
+    def __init__(self, pipe, footprint: int):
+        self.pipe = pipe
+        self.footprint = footprint
+        self.state = RESIDENT
+        self.last_used = time.time()
+
+
+class ModelRegistry:
+    """Loads pipelines on demand and keeps the resident ones under a memory budget"""
+
+    def __init__(self, budget_bytes: int = None, park_mode: str = MODEL_PARK_MODE,
+                 park_max_bytes: int = MODEL_PARK_MAX_BYTES):
+        """
+        Args:
+            budget_bytes: Device memory for resident pipelines (0 = unlimited, None = default_budget())
+            park_mode: What eviction does: "free", "cpu" (park in RAM) or "offload"
+            park_max_bytes: RAM allowed for parked pipelines before the oldest are freed
+        """
+        if park_mode not in PARK_MODES:
+            raise ValueError(f"Unknown MODEL_PARK_MODE '{park_mode}', expected one of {PARK_MODES}")
+        self.budget_bytes = default_budget() if budget_bytes is None else budget_bytes
+        # Parking on CPU saves nothing when the pipelines already live there
+        self.park_mode = "free" if device != "cuda" and park_mode != "free" else park_mode
+        self.park_max_bytes = park_max_bytes
+        self._loaders: Dict[str, Callable[[], Any]] = {}
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()  # Least recently used first
+        self._lock = threading.RLock()
+        self._stats = {"hits": 0, "misses": 0, "revivals": 0, "evictions": 0}
+
+    def register(self, name: str, loader: Callable[[], Any]):
+        """Register the loader of a pipeline; it must return the pipeline on `device`"""
+        self._loaders[name] = loader
+
+    def get(self, name: str):
+        """Return a ready-to-use pipeline, loading or reviving it as needed"""
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None and entry.state == RESIDENT:
+                self._stats["hits"] += 1
+            elif entry is not None:
+                self._revive(name, entry)
+            else:
+                entry = self._load(name)
+            entry.last_used = time.time()
+            self._entries.move_to_end(name)
+            return entry.pipe
+
+    def _load(self, name: str) -> _Entry:
+        if name not in self._loaders:
+            raise KeyError(f"No pipeline registered as '{name}'")
+        self._stats["misses"] += 1
+        # Footprint is unknown until loaded: make room for the largest seen so far
+        known = [entry.footprint for entry in self._entries.values()]
+        self._make_room(max(known) if known else 0, keep=name)
+        started_at = time.time()
+        pipe = self._loaders[name]()
+        entry = _Entry(pipe, measure_footprint(pipe))
+        self._entries[name] = entry
+        print(f"== Model registry: loaded {name} ({entry.footprint / 2**30:.2f} GiB) in {time.time() - started_at:.1f}s ==")
+        # The real footprint may be larger than the estimate
+        self._make_room(0, keep=name)
+        return entry
+
+    def _revive(self, name: str, entry: _Entry):
+        if entry.state == OFFLOADED and not self._fits(entry.footprint):
+            # Still usable offloaded; don't push everything else out for it
+            self._stats["hits"] += 1
+            return
+        self._stats["revivals"] += 1
+        self._make_room(entry.footprint, keep=name)
+        for p in _pipelines(entry.pipe):
+            if entry.state == OFFLOADED:
+                p.remove_all_hooks()
+            p.to(device)
+        entry.state = RESIDENT
+        print(f"== Model registry: revived {name} ==")
+
+    def _resident_bytes(self) -> int:
+        return sum(entry.footprint for entry in self._entries.values() if entry.state == RESIDENT)
+
+    def _fits(self, needed: int) -> bool:
+        return not self.budget_bytes or self._resident_bytes() + needed <= self.budget_bytes
+
+    def _make_room(self, needed: int, keep: str):
+        """Evict least recently used resident pipelines (other than `keep`) until `needed` more bytes fit"""
+        for name, entry in list(self._entries.items()):
+            if self._fits(needed):
+                break
+            if name != keep and entry.state == RESIDENT:
+                self._evict(name, entry, keep)
+
+    def _evict(self, name: str, entry: _Entry, keep: str):
+        self._stats["evictions"] += 1
+        if self.park_mode == "cpu":
+            for p in _pipelines(entry.pipe):
+                p.to("cpu")
+            entry.state = PARKED
+            self._trim_parked(keep)
+        elif self.park_mode == "offload":
+            for p in _pipelines(entry.pipe):
+                p.enable_model_cpu_offload()
+            entry.state = OFFLOADED
+        else:
+            del self._entries[name]
+        print(f"== Model registry: evicted {name} ({self.park_mode}) ==")
+        gc.collect()
+        if device == "cuda":
+            torch.cuda.empty_cache()
+
+    def _trim_parked(self, keep: str):
+        """Free the oldest parked pipelines (other than `keep`, which is being revived) over the RAM cap"""
+        parked = [(name, entry) for name, entry in self._entries.items() if entry.state == PARKED and name != keep]
+        total = sum(entry.footprint for _, entry in parked)
+        for name, entry in parked:
+            if not self.park_max_bytes or total <= self.park_max_bytes:
+                break
+            del self._entries[name]
+            total -= entry.footprint
+
+    def stats(self) -> dict:
+        """Hit/miss/eviction counters and the current state of each pipeline"""
+        with self._lock:
+            return {
+                **self._stats,
+                "budget_bytes": self.budget_bytes,
+                "resident_bytes": self._resident_bytes(),
+                "park_mode": self.park_mode,
+                "models": {
+                    name: {"state": entry.state, "bytes": entry.footprint, "last_used": entry.last_used}
+                    for name, entry in self._entries.items()
+                },
+            }
+
+
+# Shared by the image and video services of a worker process
+model_registry = ModelRegistry()
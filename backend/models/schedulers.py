@@ -0,0 +1,157 @@
+"""
+Speed modes: few-step samplers swapped into the loaded pipelines per job.
+
+A job's `speed` picks a scheduler plus matching default steps and guidance (SPEED_MODES):
+
+    standard   the checkpoint's own scheduler, 30 steps
+    fast       DPM-Solver++ 2M with Karras sigmas, 12 steps
+    draft      Euler ancestral, 8 steps
+    turbo      LCM with the LCM-LoRA, 4 steps and no classifier-free guidance
+
+Scheduler instances are built once per pipeline and kept alongside it (weakly, so they
+go away when the registry frees the pipeline), so switching modes between jobs only
+swaps a reference. The LCM-LoRA is never downloaded at job time: it is loaded from
+LCM_LORA_IDS only when already in the model cache (or a local directory). Workers load
+it (load_lcm_lora) while resolving a job's mode, before its steps and guidance are
+picked, and without it turbo runs as TURBO_FALLBACK. Flux keeps its flow-matching
+scheduler in every mode.
+"""
+import importlib.util
+import os
+import threading
+import weakref
+from typing import Optional
+
+from diffusers import (
+    DPMSolverMultistepScheduler, EulerAncestralDiscreteScheduler, LCMScheduler,
+)
+from huggingface_hub import try_to_load_from_cache
+
+from config.settings import SPEED_MODES, DEFAULT_SPEED, TURBO_FALLBACK, LCM_LORA_IDS
+
+
+MODEL_CACHE_DIR = "./model_cache"
+LCM_LORA_WEIGHTS = "pytorch_lora_weights.safetensors"
+LCM_ADAPTER = "lcm"
+
+
+def _dpmpp_2m(config):
+    return DPMSolverMultistepScheduler.from_config(
+        config, algorithm_type="dpmsolver++", solver_order=2, use_karras_sigmas=True,
+    )
+
+
+def _euler_a(config):
+    # Trailing spacing keeps the last step at t=0, which few-step runs need
+    return EulerAncestralDiscreteScheduler.from_config(config, timestep_spacing="trailing")
+
+
+def _lcm(config):
+    return LCMScheduler.from_config(config)
+
+
+SCHEDULERS = {
+    "dpmpp_2m": _dpmpp_2m,
+    "euler_a": _euler_a,
+    "lcm": _lcm,
+}
+
+_lock = threading.Lock()
+# pipeline -> {"default": original scheduler, <scheduler name>: instance, "lora": loaded/enabled state}
+_pipe_state: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+_lcm_failed = set()  # Models whose LCM-LoRA failed to load in this process
+
+
+def _lora_model(model: str) -> str:
+    return "SSD-1B" if model == "SSD-Lite" else model  # Same pipeline
+
+
+def lcm_lora_source(model: str) -> Optional[str]:
+    """Local directory or cached hub id of a model's LCM-LoRA, or None if not available offline"""
+    model = _lora_model(model)
+    source = LCM_LORA_IDS.get(model)
+    if not source or model in _lcm_failed or importlib.util.find_spec("peft") is None:
+        return None
+    if os.path.isdir(source):
+        return source if os.path.exists(os.path.join(source, LCM_LORA_WEIGHTS)) else None
+    cached = try_to_load_from_cache(source, LCM_LORA_WEIGHTS, cache_dir=MODEL_CACHE_DIR)
+    return source if isinstance(cached, str) else None
+
+
+def resolve_speed(speed: Optional[str], model: str) -> str:
+    """
+    The speed mode a job actually runs with.
+
+    Args:
+        speed: Requested mode (None = DEFAULT_SPEED)
+        model: Model of the job
+
+    Returns:
+        A SPEED_MODES key: "standard" for Flux, TURBO_FALLBACK for turbo without a local LCM-LoRA
+    """
+    speed = speed or DEFAULT_SPEED
+    if speed not in SPEED_MODES or model == "Flux-1":
+        return "standard"
+    if SPEED_MODES[speed]["scheduler"] == "lcm" and lcm_lora_source(model) is None:
+        return TURBO_FALLBACK
+    return speed
+
+
+def _set_lora(pipe, state: dict, enabled: bool, model: Optional[str]) -> bool:
+    """Load the LCM-LoRA on first use and switch it on or off; returns whether it is on"""
+    if enabled and "lora" not in state:
+        source = lcm_lora_source(model) if model else None
+        if source is None:
+            return False
+        try:
+            pipe.load_lora_weights(source, weight_name=LCM_LORA_WEIGHTS, adapter_name=LCM_ADAPTER,
+                                   cache_dir=MODEL_CACHE_DIR, local_files_only=True)
+            state["lora"] = True
+            print(f"== Loaded LCM-LoRA for {model} ==")
+        except Exception as e:
+            print(f"Error loading LCM-LoRA for {model}: {e}")
+            _lcm_failed.add(_lora_model(model))
+            return False
+    if "lora" in state and state["lora"] != enabled:
+        if enabled:
+            pipe.enable_lora()
+        else:
+            pipe.disable_lora()
+        state["lora"] = enabled
+    return enabled
+
+
+def load_lcm_lora(pipe, model: str) -> bool:
+    """Load a pipeline's LCM-LoRA if not loaded yet; returns whether turbo can run on it"""
+    with _lock:
+        state = _pipe_state.setdefault(pipe, {"default": pipe.scheduler})
+        return _set_lora(pipe, state, True, model)
+
+
+def use_speed_mode(pipe, speed: str, model: Optional[str] = None) -> str:
+    """
+    Switch a pipeline to the scheduler of a speed mode.
+
+    Args:
+        pipe: Diffusers pipeline (SSD-1B/SDXL family)
+        speed: SPEED_MODES key, resolved for the pipeline (turbo only once load_lcm_lora succeeded)
+        model: Model name, to switch the LCM-LoRA on for turbo (None = scheduler only)
+
+    Returns:
+        Name of the scheduler now in use ("default" for the checkpoint's own)
+
+    Raises:
+        ValueError: For turbo when the model's LCM-LoRA cannot be loaded
+    """
+    name = SPEED_MODES[speed]["scheduler"]
+    with _lock:
+        state = _pipe_state.setdefault(pipe, {"default": pipe.scheduler})
+        if name == "lcm" and model is not None and not _set_lora(pipe, state, True, model):
+            # 4 steps without guidance on another sampler give noise: the job should have resolved to TURBO_FALLBACK
+            raise ValueError(f"No LCM-LoRA for {model}; resolve the speed mode first")
+        elif name != "lcm":
+            _set_lora(pipe, state, False, model)
+        if name not in state:
+            state[name] = SCHEDULERS[name](state["default"].config)
+        pipe.scheduler = state[name]
+    return name
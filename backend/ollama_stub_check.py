@@ -0,0 +1,264 @@
+"""
+Checks of services.ollama_client against a local stub of the Ollama API.
+
+Starts a small HTTP server on 127.0.0.1 that answers /api/generate and /api/tags like
+Ollama (plain and streamed answers, HTTP errors, malformed JSON, stalls), points an
+OllamaClient at it and checks:
+
+    slots       no more than max_concurrency requests in flight, sync and asyncio
+    keep-alive  sequential calls reuse the pooled connections
+    stream      chunks are parsed, _stream_meme_fields stops once the fields are complete
+                (estimated stats) or reads to the end (Ollama's own stats)
+    errors      HTTP error statuses and malformed JSON raise OllamaRequestError
+    timeouts    slot wait, stalled headers, stalled body and a trickling stream all
+                end within the call's budget
+
+No Ollama, model or network access is needed. Prints one line per check and exits
+non-zero if any fails.
+
+    python ollama_stub_check.py [--concurrency N] [--budget S]
+"""
+import argparse
+import asyncio
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from services.ollama_client import OllamaClient, OllamaRequestError
+from services.ollama_service import _stream_meme_fields
+
+MEME_ANSWER = '{"imagePrompt": "a cat in a suit", "topText": "WHEN THE MEETING", "bottomText": "COULD BE AN EMAIL"}'
+
+
+class StubOllama(ThreadingHTTPServer):
+    """Fake Ollama; the request's "model" picks the behaviour ("ok", "slow", "error", ...)"""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _StubHandler)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.connections = set()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def handle_error(self, request, client_address):
+        pass  # Dropped connections (early stops, timeouts) are part of the checks
+
+    def reset(self):
+        with self.lock:
+            self.in_flight = self.max_in_flight = 0
+            self.connections.clear()
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self._send_json({"models": [{"name": "stub:latest"}]})
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with server.lock:
+            server.connections.add(self.client_address)
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            self._answer(body.get("model"), body.get("stream", False))
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def _answer(self, mode: str, stream: bool):
+        if mode == "slow":
+            time.sleep(0.2)
+        elif mode == "error":
+            self._send_json({"error": "model not found"}, status=500)
+            return
+        elif mode == "garbage":
+            self._send(b"not json", "text/plain")
+            return
+        elif mode == "stall_headers":
+            time.sleep(30)
+            return
+        elif mode == "stall_body":
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", "100")
+            self.end_headers()
+            self.wfile.write(b'{"response": ')
+            self.wfile.flush()
+            time.sleep(30)
+            return
+
+        if not stream:
+            self._send_json({"response": MEME_ANSWER, "done": True, "prompt_eval_count": 12, "eval_count": 30})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        # One token per chunk, as Ollama does; "trickle" never finishes in time
+        tokens = [MEME_ANSWER[i:i + 4] for i in range(0, len(MEME_ANSWER), 4)]
+        try:
+            for token in tokens if mode != "trickle" else tokens * 100:
+                self._chunk({"response": token, "done": False})
+                time.sleep(0.2 if mode == "trickle" else 0.005)
+            self._chunk({"response": "", "done": True, "prompt_eval_count": 12, "eval_count": len(tokens)})
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # The client stopped reading early
+
+    def _chunk(self, data: dict):
+        line = (json.dumps(data) + "\n").encode()
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+        self.wfile.flush()
+
+    def _send_json(self, data: dict, status: int = 200):
+        self._send(json.dumps(data).encode(), "application/json", status)
+
+    def _send(self, payload: bytes, content_type: str, status: int = 200):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def raises_request_error(call) -> bool:
+    try:
+        call()
+    except OllamaRequestError:
+        return True
+    return False
+
+
+def timed(call) -> float:
+    """Seconds until `call` raised OllamaRequestError (inf if it returned)"""
+    started_at = time.perf_counter()
+    if not raises_request_error(call):
+        return float("inf")
+    return time.perf_counter() - started_at
+
+
+def check_slots(server: StubOllama, concurrency: int) -> str:
+    client = OllamaClient(server.url, max_concurrency=concurrency)
+    server.reset()
+    with ThreadPoolExecutor(concurrency * 3) as pool:
+        list(pool.map(lambda _: client.generate({"model": "slow"}, timeout=10), range(concurrency * 3)))
+    sync_peak = server.max_in_flight
+
+    async def run_async():
+        await asyncio.gather(*(client.agenerate({"model": "slow"}, timeout=10) for _ in range(concurrency * 3)))
+        await client.aclose()
+
+    server.reset()
+    asyncio.run(run_async())
+    async_peak = server.max_in_flight
+    client.close()
+    assert sync_peak <= concurrency and async_peak <= concurrency, (sync_peak, async_peak)
+    return f"peak in flight {sync_peak} sync / {async_peak} async (limit {concurrency})"
+
+
+def check_keep_alive(server: StubOllama, concurrency: int) -> str:
+    client = OllamaClient(server.url, max_concurrency=concurrency)
+    server.reset()
+    for _ in range(10):
+        client.generate({"model": "ok"}, timeout=10)
+    connections = len(server.connections)
+    client.close()
+    assert connections == 1, connections
+    return f"10 sequential calls over {connections} connection"
+
+
+def check_stream(server: StubOllama, concurrency: int) -> str:
+    client = OllamaClient(server.url, max_concurrency=concurrency)
+    chunks = list(client.stream_generate({"model": "ok"}, timeout=10))
+    assert chunks[-1]["done"] and "".join(chunk["response"] for chunk in chunks) == MEME_ANSWER
+
+    updates = []
+    text, fields, stats = _stream_meme_fields(client, {"model": "ok"}, 10, lambda top, bottom: updates.append(bottom))
+    assert fields == json.loads(MEME_ANSWER), fields
+    assert updates and updates[-1] == "COULD BE AN EMAIL"
+    assert stats["estimated"] and stats["prompt_eval_count"] is None, stats
+    # Read to the end (as the LLM_STATS_SAMPLE calls are), Ollama's own counters come through
+    _, _, full_stats = _stream_meme_fields(client, {"model": "ok"}, 10, None, stop_when_complete=False)
+    client.close()
+    assert full_stats["prompt_eval_count"] == 12 and "estimated" not in full_stats, full_stats
+    return (f"{len(chunks)} chunks parsed; early stop after {len(text)} chars "
+            f"(~{stats['eval_count_est']} tokens, estimated); full read has prompt_eval_count")
+
+
+def check_errors(server: StubOllama, concurrency: int) -> str:
+    client = OllamaClient(server.url, max_concurrency=concurrency)
+    assert raises_request_error(lambda: client.generate({"model": "error"}, timeout=10))
+    assert raises_request_error(lambda: client.generate({"model": "garbage"}, timeout=10))
+    assert raises_request_error(lambda: list(client.stream_generate({"model": "error"}, timeout=10)))
+    assert raises_request_error(lambda: OllamaClient("http://127.0.0.1:9", connect_timeout=1).generate({}, timeout=2))
+    # The slots were all given back
+    assert client.generate({"model": "ok"}, timeout=10)["done"]
+    assert client.stats()["in_flight"] == 0
+    client.close()
+    return "HTTP 500, malformed JSON and refused connections raise OllamaRequestError"
+
+
+def check_timeouts(server: StubOllama, concurrency: int, budget: float) -> str:
+    client = OllamaClient(server.url, max_concurrency=1)
+    results = {
+        "stalled headers": timed(lambda: client.generate({"model": "stall_headers"}, timeout=budget)),
+        "stalled body": timed(lambda: client.generate({"model": "stall_body"}, timeout=budget)),
+        "trickling stream": timed(lambda: list(client.stream_generate({"model": "trickle"}, timeout=budget))),
+    }
+    # Hold the only slot, then ask for another
+    holder = threading.Thread(target=raises_request_error,
+                              args=(lambda: client.generate({"model": "stall_headers"}, timeout=budget * 2),))
+    holder.start()
+    time.sleep(0.1)
+    results["slot wait"] = timed(lambda: client.generate({"model": "ok"}, timeout=budget))
+    holder.join()
+    client.close()
+    late = {name: seconds for name, seconds in results.items() if seconds > budget + 0.5}
+    assert not late, late
+    return ", ".join(f"{name} {seconds:.2f}s" for name, seconds in results.items()) + f" (budget {budget:g}s)"
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=2, help="max_concurrency of the client under test")
+    parser.add_argument("--budget", type=float, default=1.0, help="Timeout of the timeout checks, in seconds")
+    args = parser.parse_args(argv)
+
+    server = StubOllama()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    checks = [
+        ("slots", lambda: check_slots(server, args.concurrency)),
+        ("keep-alive", lambda: check_keep_alive(server, args.concurrency)),
+        ("stream", lambda: check_stream(server, args.concurrency)),
+        ("errors", lambda: check_errors(server, args.concurrency)),
+        ("timeouts", lambda: check_timeouts(server, args.concurrency, args.budget)),
+    ]
+    failed = 0
+    for name, check in checks:
+        try:
+            print(f"ok    {name:<10} {check()}")
+        except Exception as e:
+            failed += 1
+            print(f"FAIL  {name:<10} {type(e).__name__}: {e}")
+    server.shutdown()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,112 @@
+"""
+Queue-depth-aware admission control.
+
+New jobs are admitted only while the estimated wait of their queue (queued jobs x
+recent average duration / workers) stays under a per-queue limit, and while the
+client still has tokens in its Redis-backed token bucket. Rejections carry the number
+of seconds after which a retry is expected to succeed.
+"""
+import math
+
+from config.settings import (
+    ADMISSION_MAX_WAIT, ADMISSION_DEFAULT_JOB_SECONDS, ADMISSION_DURATION_SAMPLES,
+    RATE_LIMIT_PER_MINUTE, RATE_LIMIT_BURST,
+)
+
+
+# Token bucket refilled continuously at `rate` tokens/second up to `burst`.
+# Returns {allowed, retry_after_ms}.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local now = redis.call('TIME')
+now = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + (now - ts) * rate / 1000)
+
+local allowed = 0
+local retry_after = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    retry_after = math.ceil((cost - tokens) * 1000 / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst * 1000 / rate) + 1000)
+return {allowed, retry_after}
+"""
+
+
+class AdmissionRejected(Exception):
+    """Raised when a job must not be admitted right now."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def durations_key(queue_name: str) -> str:
+    return f"queue_durations:{queue_name}"
+
+
+def record_job_duration(redis_connection, queue_name: str, seconds: float):
+    """Record how long a job took, for the queue's wait estimate (called by workers)"""
+    try:
+        with redis_connection.pipeline() as pipe:
+            pipe.lpush(durations_key(queue_name), round(seconds, 3))
+            pipe.ltrim(durations_key(queue_name), 0, ADMISSION_DURATION_SAMPLES - 1)
+            pipe.execute()
+    except Exception as e:
+        print(f"Error recording job duration: {e}")
+
+
+class AdmissionController:
+    """Decides whether a client may enqueue more jobs on a queue"""
+
+    def __init__(self, redis_connection):
+        self.redis = redis_connection
+        self._token_bucket = self.redis.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def _average_duration(self, queue_name: str, samples) -> float:
+        if not samples:
+            return ADMISSION_DEFAULT_JOB_SECONDS.get(queue_name, 60)
+        return sum(float(sample) for sample in samples) / len(samples)
+
+    def check_queue(self, queue, cost: int = 1):
+        """Reject when the queue's estimated wait would exceed its limit"""
+        max_wait = ADMISSION_MAX_WAIT.get(queue.name)
+        if max_wait is None:
+            return
+        with self.redis.pipeline(transaction=False) as pipe:
+            pipe.llen(queue.key)
+            pipe.scard(f"rq:workers:{queue.name}")
+            pipe.lrange(durations_key(queue.name), 0, -1)
+            depth, workers, samples = pipe.execute()
+
+        per_job = self._average_duration(queue.name, samples) / max(workers, 1)
+        wait = (depth + cost) * per_job
+        if wait > max_wait:
+            # Time for the backlog to drain far enough that these jobs fit under the limit
+            retry_after = max(1, math.ceil(wait - max_wait))
+            raise AdmissionRejected(
+                f"Queue '{queue.name}' is full (estimated wait {int(wait)}s)", retry_after
+            )
+
+    def take_tokens(self, client_id: str, cost: int = 1):
+        """Consume tokens from the client's bucket or reject with the refill time"""
+        rate = RATE_LIMIT_PER_MINUTE / 60.0
+        if rate <= 0:
+            return
+        # A request larger than the bucket drains it completely rather than never fitting
+        cost = min(cost, RATE_LIMIT_BURST)
+        allowed, retry_after_ms = self._token_bucket(
+            keys=[f"ratelimit:{client_id}"], args=[rate, RATE_LIMIT_BURST, cost]
+        )
+        if not allowed:
+            raise AdmissionRejected("Rate limit exceeded", max(1, math.ceil(retry_after_ms / 1000)))
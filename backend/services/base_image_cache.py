@@ -0,0 +1,122 @@
+"""
+Content-addressed cache of pre-caption base images.
+
+Diffusion output is fully determined by (image prompt, negative prompt, seed, steps,
+guidance, model, aspect, speed mode), so a repeated request can skip diffusion and only re-run the
+caption overlay. Images live on the shared outputs volume; a Redis index (sorted set by
+last access + per-entry sizes) lets every worker share one LRU size budget.
+"""
+import hashlib
+import json
+import os
+import time
+from typing import Optional
+from uuid import uuid4
+
+from PIL import Image
+
+from config.settings import BASE_CACHE_DIR, BASE_CACHE_MAX_BYTES
+
+
+LRU_KEY = "base_cache:lru"        # key -> last access time
+SIZES_KEY = "base_cache:sizes"    # key -> bytes on disk
+TOTAL_KEY = "base_cache:bytes"    # total bytes on disk
+INDEX_KEYS = [LRU_KEY, SIZES_KEY, TOTAL_KEY]
+
+# Index updates run as scripts so concurrent workers keep the byte total consistent
+PUT_SCRIPT = """
+local previous = tonumber(redis.call('HGET', KEYS[2], ARGV[1]) or '0')
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+redis.call('ZADD', KEYS[1], ARGV[3], ARGV[1])
+return redis.call('INCRBY', KEYS[3], tonumber(ARGV[2]) - previous)
+"""
+
+FORGET_SCRIPT = """
+local freed = 0
+for _, key in ipairs(ARGV) do
+    local size = redis.call('HGET', KEYS[2], key)
+    if size then
+        freed = freed + tonumber(size)
+        redis.call('HDEL', KEYS[2], key)
+    end
+    redis.call('ZREM', KEYS[1], key)
+end
+return redis.call('DECRBY', KEYS[3], freed)
+"""
+
+
+def base_image_key(image_prompt: str, neg_prompt: str, seed: int, steps: int,
+                   guidance: float, model: str, aspect: str, speed: str = "standard") -> str:
+    """Cache key for a diffusion request"""
+    params = [image_prompt, neg_prompt, int(seed), int(steps), float(guidance), model, aspect]
+    if speed != "standard":
+        # Other samplers give other images; standard keys stay as they were before speed modes
+        params.append(speed)
+    return hashlib.sha256(json.dumps(params).encode()).hexdigest()
+
+
+class BaseImageCache:
+    """Disk-backed LRU cache of generated base images, indexed in Redis"""
+
+    def __init__(self, redis_connection, root: str = BASE_CACHE_DIR, max_bytes: int = BASE_CACHE_MAX_BYTES):
+        self.redis = redis_connection
+        self.root = root
+        self.max_bytes = max_bytes
+        self._put_index = self.redis.register_script(PUT_SCRIPT)
+        self._forget_index = self.redis.register_script(FORGET_SCRIPT)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], f"{key}.png")
+
+    def get(self, key: str) -> Optional[Image.Image]:
+        """Return the cached image for a key, or None on a miss"""
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with Image.open(path) as img:
+                image = img.convert("RGB")
+        except OSError:
+            # Unreadable (e.g. evicted mid-read): make sure the index forgets it
+            self._forget([key])
+            return None
+        self.redis.zadd(LRU_KEY, {key: time.time()})
+        return image
+
+    def put(self, key: str, image: Image.Image):
+        """Store a base image and evict least recently used entries over budget"""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid4().hex}.tmp"
+        # Low compression: this is a cache, encode speed matters more than size
+        image.save(tmp_path, "PNG", compress_level=1)
+        os.replace(tmp_path, path)
+        size = os.path.getsize(path)
+
+        total = self._put_index(keys=INDEX_KEYS, args=[key, size, time.time()])
+        if total > self.max_bytes:
+            self._evict(total)
+
+    def _evict(self, total: int):
+        target = int(self.max_bytes * 0.9)
+        while total > target:
+            oldest = [k.decode() for k in self.redis.zrange(LRU_KEY, 0, 31)]
+            if not oldest:
+                break
+            # Take only as many of the oldest entries as needed to get under target
+            victims = []
+            for key, size in zip(oldest, self.redis.hmget(SIZES_KEY, oldest)):
+                victims.append(key)
+                total -= int(size or 0)
+                if total <= target:
+                    break
+            for key in victims:
+                try:
+                    os.remove(self._path(key))
+                except OSError:
+                    pass
+            total = self._forget(victims)
+
+    def _forget(self, keys) -> int:
+        """Drop keys from the index; returns the remaining cached bytes"""
+        return self._forget_index(keys=INDEX_KEYS, args=list(keys))
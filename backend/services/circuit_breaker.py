@@ -0,0 +1,149 @@
+"""
+Redis-backed circuit breaker shared by every worker calling a dependency (Ollama).
+
+After LLM_BREAKER_FAILURES consecutive failures or slow calls (slower than
+LLM_BREAKER_SLOW seconds) the breaker opens: calls are skipped for LLM_BREAKER_COOLDOWN
+seconds and callers use their fallback right away instead of waiting on a sick
+service. Once the cool-down is over a single probe call is let through (half-open);
+its success closes the breaker and its failure opens it again.
+
+State and counters live in one hash, `breaker:{name}`, so they can be monitored:
+    opened_until, probe_until   ms timestamps (Redis clock), 0 when unset
+    consecutive                 failures since the last success
+    calls, failures, slow, rejected, trips, probes, and any count() events
+"""
+import time
+from typing import Optional
+
+from config.settings import LLM_BREAKER_FAILURES, LLM_BREAKER_COOLDOWN, LLM_BREAKER_SLOW
+
+
+# Decide whether a call may go through. ARGV: probe ttl (ms)
+# Returns 1 (closed), 2 (half-open probe) or 0 (rejected)
+ALLOW_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+local state = redis.call('HMGET', KEYS[1], 'opened_until', 'probe_until')
+local opened_until = tonumber(state[1]) or 0
+if opened_until == 0 then
+    redis.call('HINCRBY', KEYS[1], 'calls', 1)
+    return 1
+end
+if now < opened_until or now < (tonumber(state[2]) or 0) then
+    redis.call('HINCRBY', KEYS[1], 'rejected', 1)
+    return 0
+end
+redis.call('HSET', KEYS[1], 'probe_until', now + tonumber(ARGV[1]))
+redis.call('HINCRBY', KEYS[1], 'calls', 1)
+redis.call('HINCRBY', KEYS[1], 'probes', 1)
+return 2
+"""
+
+# Record a call outcome. ARGV: ok (1/0), failure threshold, cool-down (ms)
+# Returns 1 if this outcome opened the breaker
+RECORD_SCRIPT = """
+if ARGV[1] == '1' then
+    redis.call('HSET', KEYS[1], 'consecutive', 0, 'opened_until', 0, 'probe_until', 0)
+    return 0
+end
+local now = redis.call('TIME')
+now = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+redis.call('HINCRBY', KEYS[1], 'failures', 1)
+local consecutive = redis.call('HINCRBY', KEYS[1], 'consecutive', 1)
+local half_open = (tonumber(redis.call('HGET', KEYS[1], 'opened_until')) or 0) > 0
+if half_open or consecutive >= tonumber(ARGV[2]) then
+    redis.call('HSET', KEYS[1], 'opened_until', now + tonumber(ARGV[3]), 'probe_until', 0, 'consecutive', 0)
+    redis.call('HINCRBY', KEYS[1], 'trips', 1)
+    return 1
+end
+return 0
+"""
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency while its breaker is open."""
+    pass
+
+
+def breaker_key(name: str) -> str:
+    return f"breaker:{name}"
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with a cool-down and a half-open probe"""
+
+    def __init__(self, redis_connection, name: str, failure_threshold: int = LLM_BREAKER_FAILURES,
+                 cooldown: float = LLM_BREAKER_COOLDOWN, slow_threshold: float = LLM_BREAKER_SLOW,
+                 probe_timeout: float = 120):
+        """
+        Args:
+            redis_connection: Redis connection holding the shared state
+            name: Protected dependency, e.g. "ollama"
+            failure_threshold: Consecutive failures (or slow calls) that open the breaker
+            cooldown: Seconds the breaker stays open
+            slow_threshold: Calls slower than this many seconds count as failures (0 = never)
+            probe_timeout: Seconds after which a probe that never reported is given up
+        """
+        self.redis = redis_connection
+        self.name = name
+        self.key = breaker_key(name)
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.slow_threshold = slow_threshold
+        self.probe_timeout = probe_timeout
+        self._allow = self.redis.register_script(ALLOW_SCRIPT)
+        self._record = self.redis.register_script(RECORD_SCRIPT)
+
+    def allow(self) -> bool:
+        """Whether a call may go through now (fails open if Redis is unreachable)"""
+        try:
+            return bool(self._allow(keys=[self.key], args=[int(self.probe_timeout * 1000)]))
+        except Exception as e:
+            print(f"Circuit breaker {self.name} unavailable, allowing the call: {e}")
+            return True
+
+    def record(self, duration: Optional[float] = None, failed: bool = False):
+        """
+        Record the outcome of an allowed call.
+
+        Args:
+            duration: Seconds the call took (a slow success counts as a failure)
+            failed: Whether the call failed
+        """
+        slow = bool(self.slow_threshold and duration is not None and duration > self.slow_threshold)
+        try:
+            if slow:
+                self.redis.hincrby(self.key, "slow", 1)
+            opened = self._record(
+                keys=[self.key],
+                args=[0 if failed or slow else 1, self.failure_threshold, int(self.cooldown * 1000)],
+            )
+            if opened:
+                print(f"Circuit breaker {self.name} opened for {self.cooldown:g}s")
+        except Exception as e:
+            print(f"Error recording circuit breaker outcome: {e}")
+
+    def count(self, event: str, amount: int = 1):
+        """Bump a monitoring counter kept with the breaker state"""
+        try:
+            self.redis.hincrby(self.key, event, amount)
+        except Exception as e:
+            print(f"Error counting {event} for breaker {self.name}: {e}")
+
+    def stats(self) -> dict:
+        """Breaker state ("closed", "open" or "half-open") and counters"""
+        fields = {key.decode(): int(value) for key, value in self.redis.hgetall(self.key).items()}
+        seconds, micros = self.redis.time()
+        now = seconds * 1000 + micros // 1000
+        opened_until = fields.pop("opened_until", 0)
+        fields.pop("probe_until", None)
+        if not opened_until:
+            state = "closed"
+        elif now < opened_until:
+            state = "open"
+        else:
+            state = "half-open"
+        stats = {"name": self.name, "state": state, **fields}
+        if state == "open":
+            stats["retry_in"] = round((opened_until - now) / 1000, 1)
+        return stats
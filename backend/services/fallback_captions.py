@@ -0,0 +1,107 @@
+"""
+Local meme captions for when Ollama is unavailable, too slow or returns nothing.
+
+Template and keyword based, CPU only and well under a millisecond: the prompt's
+language (Spanish or English) picks the template set, its first content words fill the
+templates, and a hash of the prompt picks the templates so the same prompt always
+gets the same captions.
+"""
+import hashlib
+import re
+import unicodedata
+from typing import List, Tuple
+
+MAX_LINE = 60
+
+_STOPWORDS = {
+    "en": set(
+        "a an the and or but of to in on at for with from by about as is are was were be been being "
+        "i me my we our you your he she it its they them their this that these those what when who "
+        "how why which do does did doing have has had not no so too very just can will would should "
+        "could meme memes make create funny some any all more most into out up down over again".split()
+    ),
+    "es": set(
+        "el la los las un una unos unas y o pero de del al a en con por para sin sobre como que qué "
+        "es son fue era ser estar está están yo me mi mis tu tus su sus nosotros vosotros ellos ellas "
+        "él ella lo le les se este esta estos estas ese esa eso cuando quien quién muy más menos ya "
+        "no sí hacer haz crea crear meme memes gracioso graciosa algo todo todos hay".split()
+    ),
+}
+
+# (top, bottom); {subject} is the prompt's key phrase
+_TEMPLATES = {
+    "en": [
+        ("WHEN {subject}", "AND NOBODY ASKED"),
+        ("NOBODY:", "ABSOLUTELY NOBODY: {subject}"),
+        ("ONE DOES NOT SIMPLY", "{subject}"),
+        ("ME, 5 MINUTES INTO {subject}", "I HAVE SEEN THINGS"),
+        ("{subject}", "{subject} EVERYWHERE"),
+        ("THEY SAID {subject}", "WOULD BE EASY"),
+        ("EXPECTATION: {subject}", "REALITY: SEND HELP"),
+        ("FIRST TIME?", "{subject}"),
+    ],
+    "es": [
+        ("CUANDO {subject}", "Y NADIE TE AVISA"),
+        ("NADIE:", "ABSOLUTAMENTE NADIE: {subject}"),
+        ("YO A LOS 5 MINUTOS DE {subject}", "HE VISTO COSAS"),
+        ("{subject}", "{subject} POR TODAS PARTES"),
+        ("ME DIJERON QUE {subject}", "SERÍA FÁCIL"),
+        ("EXPECTATIVA: {subject}", "REALIDAD: SOCORRO"),
+        ("¿PRIMERA VEZ?", "{subject}"),
+        ("LUNES POR LA MAÑANA", "{subject}"),
+    ],
+}
+
+_WORD = re.compile(r"[^\W\d_]+(?:'[^\W\d_]+)?")
+
+
+def detect_language(words: List[str]) -> str:
+    """"es" or "en", by stopword hits and Spanish-only characters"""
+    spanish = sum(word in _STOPWORDS["es"] for word in words) + sum(
+        any(char in "ñáéíóú¿¡" for char in word) for word in words
+    )
+    english = sum(word in _STOPWORDS["en"] for word in words)
+    return "es" if spanish > english else "en"
+
+
+def keywords(prompt: str, language: str, limit: int = 4) -> List[str]:
+    """Distinct content words of a prompt, in order of appearance"""
+    words = [word for word in _WORD.findall(prompt.casefold()) if word not in _STOPWORDS[language]]
+    return list(dict.fromkeys(word for word in words if len(word) > 2))[:limit]
+
+
+def _fit(text: str) -> str:
+    text = " ".join(text.split()).upper()
+    if len(text) <= MAX_LINE:
+        return text
+    return text[:MAX_LINE].rsplit(" ", 1)[0]
+
+
+def fallback_captions(prompt: str, count: int = 1) -> List[Tuple[str, str, str]]:
+    """
+    Captions for a prompt without the LLM.
+
+    Args:
+        prompt: User prompt
+        count: Number of distinct caption pairs wanted
+
+    Returns:
+        List of (image_prompt, top, bottom), same shape as call_ollama's answer
+    """
+    text = unicodedata.normalize("NFKC", prompt or "").strip()
+    language = detect_language(_WORD.findall(text.casefold()))
+    words = keywords(text, language)
+    subject = " ".join(words[:3]) or text or ("ESTO" if language == "es" else "THIS")
+    image_prompt = f"{text}, funny meme photo, expressive, high quality" if text else "funny meme photo"
+
+    templates = _TEMPLATES[language]
+    start = int.from_bytes(hashlib.blake2b(text.casefold().encode(), digest_size=4).digest(), "big")
+    captions = []
+    for index in range(min(count, len(templates))):
+        top, bottom = templates[(start + index) % len(templates)]
+        captions.append((
+            image_prompt,
+            _fit(top.format(subject=subject)),
+            _fit(bottom.format(subject=subject)),
+        ))
+    return captions
@@ -1,10 +1,39 @@
 import torch
+from typing import Callable, List, Optional, Tuple
 from PIL import Image
 from models.image_models import load_sdxl_models, get_pipe, get_flux_pipe
-from config.settings import MODEL_LIST_ID, SELECTED_MODEL_ID, device
+from models.schedulers import load_lcm_lora, resolve_speed, use_speed_mode
+from config.settings import MODEL_LIST_ID, SELECTED_MODEL_ID, PREVIEW_EVERY, SPEED_MODES, TURBO_FALLBACK, device
+from services.preview import decode_latents
 from diffusers.utils import logging as dlogging
 dlogging.enable_progress_bar() 
 
+def step_callback(on_step: Optional[Callable[[float], None]], start: float = 0.0, end: float = 1.0,
+                  on_preview: Optional[Callable[[List[Image.Image]], None]] = None,
+                  preview_every: int = PREVIEW_EVERY):
+    """
+    Build a diffusers `callback_on_step_end` that reports the fraction of denoising done,
+    mapped onto start..end (e.g. the base and refiner parts of an SDXL run), and passes
+    approximate decodes of the current latents to `on_preview` every `preview_every` steps.
+    """
+    if on_step is None and on_preview is None:
+        return None
+
+    def callback(pipe, step, timestep, callback_kwargs):
+        total = getattr(pipe, "num_timesteps", None) or 1
+        if on_step is not None:
+            on_step(start + (end - start) * min((step + 1) / total, 1.0))
+        if on_preview is not None and (step + 1) % preview_every == 0 and step + 1 < total:
+            try:
+                on_preview(decode_latents(callback_kwargs["latents"]))
+            except Exception as e:
+                # A preview is never worth failing the generation
+                print(f"Error decoding preview: {e}")
+        return callback_kwargs
+
+    return callback
+
+
 class DummyCtx:
     """Dummy context manager for non-CUDA environments."""
     def __enter__(self):
@@ -14,9 +43,50 @@ class DummyCtx:
         return False
 
 
+# Model selection - for now, we'll map different model names to our available models
+# This allows the UI to show different options while using what we have
+MODEL_MAPPING = {
+    "SSD-1B": "SSD-1B",
+    "SSD-Lite": "SSD-1B",  # Fallback to SSD-1B
+    "Flux-1": "Flux-1",    # Now properly supported
+    "SDXL": "SDXL"
+}
+
+
+def _uses_sdxl(selected_model: str) -> bool:
+    return selected_model == "SDXL" and MODEL_LIST_ID["SDXL"] == SELECTED_MODEL_ID
+
+
+def resolve_pipeline_speed(speed: Optional[str], model: str) -> str:
+    """
+    The speed mode a job runs with on this worker's pipelines. For turbo the LCM-LoRA is
+    loaded now, before the job's steps and guidance are chosen; if it cannot be loaded
+    the job runs as TURBO_FALLBACK.
+
+    Args:
+        speed: Requested mode (None = DEFAULT_SPEED)
+        model: Model of the job
+
+    Returns:
+        A SPEED_MODES key
+    """
+    speed = resolve_speed(speed, model)
+    if SPEED_MODES[speed]["scheduler"] != "lcm":
+        return speed
+    selected_model = MODEL_MAPPING.get(model, "SSD-1B")
+    if _uses_sdxl(selected_model):
+        loaded = load_lcm_lora(load_sdxl_models()[0], "SDXL")
+    else:
+        loaded = load_lcm_lora(get_pipe(), "SSD-1B")
+    return speed if loaded else TURBO_FALLBACK
+
+
 def generate_image(image_prompt: str, neg_prompt: str = "ugly, blurry, poor quality", 
                   steps: int = 30, guidance: float = 5.0, model: str = "SSD-1B", 
-                  aspect: str = "1:1") -> Image.Image:
+                  aspect: str = "1:1", seed: Optional[int] = None,
+                  on_step: Optional[Callable[[float], None]] = None,
+                  on_preview: Optional[Callable[[Image.Image], None]] = None,
+                  speed: str = "standard") -> Image.Image:
     """
     Generate an image using either SDXL models or SSD-1B model.
     
@@ -27,10 +97,49 @@ def generate_image(image_prompt: str, neg_prompt: str = "ugly, blurry, poor qual
         guidance: Guidance scale for generation (3.0-9.0)
         model: Model to use (SSD-1B, SSD-Lite, Flux-1, SDXL)
         aspect: Aspect ratio (1:1, 4:3, 16:9, 9:16)
+        seed: Random seed; the same seed and parameters reproduce the same image
+        on_step: Optional callback receiving the fraction (0-1) of denoising done
+        on_preview: Optional callback receiving approximate in-progress images (SSD-1B, SDXL)
+        speed: Speed mode picking the sampler (see models/schedulers.py), from resolve_pipeline_speed
         
     Returns:
         Generated PIL Image
     """
+    on_previews = (lambda images: on_preview(images[0])) if on_preview is not None else None
+    return generate_images([(image_prompt, neg_prompt, seed)], steps, guidance, model, aspect, on_step, on_previews,
+                           speed=speed)[0]
+
+
+def generate_images(requests: List[Tuple[str, str, Optional[int]]], steps: int = 30,
+                    guidance: float = 5.0, model: str = "SSD-1B", aspect: str = "1:1",
+                    on_step: Optional[Callable[[float], None]] = None,
+                    on_preview: Optional[Callable[[List[Image.Image]], None]] = None,
+                    speed: str = "standard") -> List[Image.Image]:
+    """
+    Generate several images that share model, aspect, steps and guidance in one batched
+    pipeline call. Each image gets its own seeded generator, so it matches what
+    generate_image would produce for the same prompt and seed.
+    
+    Args:
+        requests: (image_prompt, neg_prompt, seed) per image
+        steps: Number of inference steps for generation (20-60)
+        guidance: Guidance scale for generation (3.0-9.0)
+        model: Model to use (SSD-1B, SSD-Lite, Flux-1, SDXL)
+        aspect: Aspect ratio (1:1, 4:3, 16:9, 9:16)
+        on_step: Optional callback receiving the fraction (0-1) of denoising done,
+            called once per step for the whole batch
+        on_preview: Optional callback receiving approximate in-progress images, one per
+            request, every PREVIEW_EVERY steps (SSD-1B and SDXL; Flux latents are packed)
+        speed: Speed mode picking the sampler (SSD-1B and SDXL; Flux keeps its own), from
+            resolve_pipeline_speed. Turbo runs SDXL without the refiner, which has no LCM-LoRA
+        
+    Returns:
+        Generated PIL Images, in request order
+    """
+    prompts = [image_prompt for image_prompt, _, _ in requests]
+    neg_prompts = [neg_prompt for _, neg_prompt, _ in requests]
+    seeds = [seed for _, _, seed in requests]
+    
     # Convert aspect ratio to dimensions
     aspect_ratios = {
         "1:1": (512, 512),
@@ -53,16 +162,15 @@ def generate_image(image_prompt: str, neg_prompt: str = "ugly, blurry, poor qual
     else:
         width, height = aspect_ratios.get(aspect, (512, 512))
     
-    # Model selection - for now, we'll map different model names to our available models
-    # This allows the UI to show different options while using what we have
-    model_mapping = {
-        "SSD-1B": "SSD-1B",
-        "SSD-Lite": "SSD-1B",  # Fallback to SSD-1B
-        "Flux-1": "Flux-1",    # Now properly supported
-        "SDXL": "SDXL"
-    }
+    selected_model = MODEL_MAPPING.get(model, "SSD-1B")
     
-    selected_model = model_mapping.get(model, "SSD-1B")
+    # Seeded generator per image so identical requests give identical images (Flux samples on CPU)
+    def make_generators(gen_device: str):
+        generators = []
+        for seed in seeds:
+            generator = torch.Generator(gen_device)
+            generators.append(generator.manual_seed(seed) if seed is not None else generator)
+        return generators
     
     if selected_model == "Flux-1":
         pipe = get_flux_pipe()
@@ -70,54 +178,79 @@ def generate_image(image_prompt: str, neg_prompt: str = "ugly, blurry, poor qual
         
         print("\n== GENERATING IMAGE WITH FLUX ==")
         print("\n== With params ==")
-        print("Image Prompt: {}".format(image_prompt))
+        print("Image Prompts: {}".format(prompts))
         print("Steps: {}".format(steps))
         print("Guidance: {}".format(guidance))
         print("Dimensions: {}x{}".format(width, height))
+        print("Seeds: {}".format(seeds))
         
         # Use Flux-specific parameters
-        image = pipe(
-            prompt=image_prompt,
+        images = pipe(
+            prompt=prompts,
             height=height,
             width=width,
             guidance_scale=guidance,
             num_inference_steps=steps,
             max_sequence_length=512,
-            generator=torch.Generator("cpu").manual_seed(0)  # Fixed seed for consistency
-        ).images[0]
+            generator=make_generators("cpu"),
+            callback_on_step_end=step_callback(on_step),
+        ).images
         print("\n== FLUX IMAGE GENERATED ==")
         
-    elif selected_model == "SDXL" and MODEL_LIST_ID["SDXL"] == SELECTED_MODEL_ID:
+    elif _uses_sdxl(selected_model):
         _base_pipe, _refiner_pipe = load_sdxl_models()
         print(f"\n== SDXL MODEL LOADED ({width}x{height}) ==")
         
+        scheduler = use_speed_mode(_base_pipe, speed, selected_model)
+        generators = make_generators(device)
+        
+        if scheduler == "lcm":
+            print(f"\n== GENERATING IMAGE ({scheduler}, no refiner) ==")
+            images = _base_pipe(
+                prompt=prompts,
+                num_inference_steps=steps,
+                guidance_scale=guidance,
+                width=width,
+                height=height,
+                generator=generators,
+                callback_on_step_end=step_callback(on_step, on_preview=on_preview),
+            ).images
+            print("\n== BASE IMAGE GENERATED ==")
+            return images
+        
+        use_speed_mode(_refiner_pipe, speed)
         high_noise_frac = 0.8
         
-        print("\n== GENERATING IMAGE ==")
-        image = _base_pipe(
-            prompt=image_prompt,
+        print(f"\n== GENERATING IMAGE ({scheduler}) ==")
+        latents = _base_pipe(
+            prompt=prompts,
             num_inference_steps=steps,
             denoising_end=high_noise_frac,
             guidance_scale=guidance,
             width=width,
             height=height,
             output_type="latent",
-        ).images[0]
+            generator=generators,
+            callback_on_step_end=step_callback(on_step, 0.0, high_noise_frac, on_preview),
+        ).images
         print("\n== BASE IMAGE GENERATED ==")
         
         print("\n== REFINER IMAGE GENERATING ==")
-        image = _refiner_pipe(
-            prompt=image_prompt,
+        images = _refiner_pipe(
+            prompt=prompts,
             num_inference_steps=steps,
             denoising_end=high_noise_frac,
             guidance_scale=guidance,
-            image=image,
-        ).images[0]
+            image=latents,
+            generator=generators,
+            callback_on_step_end=step_callback(on_step, high_noise_frac, 1.0, on_preview),
+        ).images
         print("\n== REFINER IMAGE GENERATED ==")
         
     else:
         pipe = get_pipe()
         print(f"\n== {selected_model} MODEL LOADED ({width}x{height}) ==")
+        scheduler = use_speed_mode(pipe, speed, "SSD-1B")  # Every other model runs on the SSD-1B pipeline
 
         # autocast helper
         if device == "cuda":
@@ -127,21 +260,25 @@ def generate_image(image_prompt: str, neg_prompt: str = "ugly, blurry, poor qual
 
         print("\n== GENERATING IMAGE ==")
         print("\n== With params ==")
-        print("Image Prompt: {}".format(image_prompt))
-        print("Negative Prompt: {}".format(neg_prompt))
+        print("Image Prompts: {}".format(prompts))
+        print("Negative Prompts: {}".format(neg_prompts))
+        print("Scheduler: {} ({})".format(scheduler, speed))
         print("Steps: {}".format(steps))
         print("Guidance: {}".format(guidance))
         print("Dimensions: {}x{}".format(width, height))
+        print("Seeds: {}".format(seeds))
     
         with autocast:
-            image = pipe(
-                prompt=image_prompt,
-                negative_prompt=neg_prompt,
+            images = pipe(
+                prompt=prompts,
+                negative_prompt=neg_prompts,
                 num_inference_steps=steps,
                 guidance_scale=guidance,
                 width=width,
                 height=height,
-            ).images[0]
+                generator=make_generators(device),
+                callback_on_step_end=step_callback(on_step, on_preview=on_preview),
+            ).images
         print("\n== IMAGE GENERATED ==")
     
-    return image
+    return images
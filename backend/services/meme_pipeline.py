@@ -0,0 +1,170 @@
+"""
+Staged meme pipeline.
+
+A meme job runs as three RQ jobs on separate queues, so each stage gets its own worker
+pool: text (Ollama), diffusion (GPU) and finish (caption overlay, PNG encode, notify).
+The public job id belongs to the finish job, which is created deferred at submission
+time; earlier stages report progress on its meta and enqueue it when they are done, so
+status lookups and updates keep working on a single id. Intermediate state and the base
+image are handed between stages through a short-lived Redis hash, never the disk.
+"""
+import json
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+from PIL import Image
+from rq import Queue
+from rq.job import Callback, Job, JobStatus
+
+from config.settings import (
+    MEME_TEXT_QUEUE, MEME_DIFFUSION_QUEUE, MEME_FINISH_QUEUE, PIPELINE_HANDOFF_TTL,
+)
+
+
+# Referenced by import path so the API does not need the stage code loaded
+TEXT_STAGE = "worker.run_text_stage"
+DIFFUSION_STAGE = "worker.run_diffusion_stage"
+FINISH_STAGE = "worker.run_finish_stage"
+
+STAGE_TIMEOUT = 1000
+
+# Error reported on the public job when a stage job fails without handing off
+STAGE_ERRORS = {
+    TEXT_STAGE: "Text generation failed",
+    DIFFUSION_STAGE: "Image generation failed",
+}
+
+
+def handoff_key(job_id: str) -> str:
+    return f"meme_pipeline:{job_id}"
+
+
+def stage_job_id(job_id: str, stage: str) -> str:
+    return f"{job_id}-{stage}"
+
+
+def enqueue_staged_jobs(connection, jobs: Iterable[Tuple[str, dict, Optional[dict]]], pipeline=None):
+    """
+    Submit meme jobs to the staged pipeline.
+
+    Args:
+        connection: Redis connection
+        jobs: (job_id, payload, meta) per job; meta is stored on the public job
+        pipeline: Optional Redis pipeline to add the writes to (executed by the caller)
+    """
+    text_queue = Queue(MEME_TEXT_QUEUE, connection=connection, default_timeout=STAGE_TIMEOUT)
+    finish_queue = Queue(MEME_FINISH_QUEUE, connection=connection, default_timeout=STAGE_TIMEOUT)
+
+    pipe = pipeline if pipeline is not None else connection.pipeline()
+    text_jobs = []
+    for job_id, payload, meta in jobs:
+        # The public job waits outside any queue until the diffusion stage releases it
+        finish_job = finish_queue.create_job(
+            FINISH_STAGE, args=(job_id,), job_id=job_id, meta=meta, status=JobStatus.DEFERRED
+        )
+        finish_job.save(pipeline=pipe)
+        text_jobs.append(Queue.prepare_data(
+            TEXT_STAGE, (job_id, payload), job_id=stage_job_id(job_id, "text"), result_ttl=0,
+            on_failure=Callback(release_failed_stage),
+        ))
+    text_queue.enqueue_many(text_jobs, pipeline=pipe)
+    if pipeline is None:
+        pipe.execute()
+
+
+def _image_fields(image: Image.Image, suffix: str = "") -> dict:
+    return {
+        f"image{suffix}": image.tobytes(),
+        f"image_mode{suffix}": image.mode,
+        f"image_size{suffix}": json.dumps(image.size),
+    }
+
+
+def _decode_image(pixels, mode, size) -> Optional[Image.Image]:
+    if not pixels:
+        return None
+    return Image.frombytes(mode.decode(), tuple(json.loads(size)), pixels)
+
+
+def save_state(connection, job_id: str, state: dict, image: Optional[Image.Image] = None,
+               extra_images: Sequence[Optional[Image.Image]] = ()):
+    """
+    Store the state handed to the next stage, with the base image as raw pixels.
+    Multi-variant jobs also hand over the base images of their alternates
+    (`extra_images`, numbered from 1; None for one that could not be rendered).
+    """
+    fields = {"state": json.dumps(state)}
+    if image is not None:
+        fields.update(_image_fields(image))
+    for index, extra in enumerate(extra_images, 1):
+        if extra is not None:
+            fields.update(_image_fields(extra, f":{index}"))
+    with connection.pipeline() as pipe:
+        pipe.hset(handoff_key(job_id), mapping=fields)
+        pipe.expire(handoff_key(job_id), PIPELINE_HANDOFF_TTL)
+        pipe.execute()
+
+
+def load_state(connection, job_id: str, with_image: bool = False) -> Tuple[Optional[dict], Optional[Image.Image]]:
+    """Read the state left by the previous stage (and the base image if asked for)"""
+    if not with_image:
+        raw = connection.hget(handoff_key(job_id), "state")
+        return (json.loads(raw) if raw else None), None
+
+    raw, pixels, mode, size = connection.hmget(
+        handoff_key(job_id), ["state", "image", "image_mode", "image_size"]
+    )
+    return (json.loads(raw) if raw else None), _decode_image(pixels, mode, size)
+
+
+def load_extra_images(connection, job_id: str, count: int) -> List[Optional[Image.Image]]:
+    """The alternates' base images stored by save_state, None where missing"""
+    fields = []
+    for index in range(1, count + 1):
+        fields += [f"image:{index}", f"image_mode:{index}", f"image_size:{index}"]
+    values = connection.hmget(handoff_key(job_id), fields) if fields else []
+    return [_decode_image(*values[i:i + 3]) for i in range(0, len(values), 3)]
+
+
+def clear_state(connection, job_id: str):
+    connection.delete(handoff_key(job_id))
+
+
+def enqueue_diffusion(connection, job_id: str):
+    queue = Queue(MEME_DIFFUSION_QUEUE, connection=connection, default_timeout=STAGE_TIMEOUT)
+    queue.enqueue(DIFFUSION_STAGE, job_id, job_id=stage_job_id(job_id, "diffusion"), result_ttl=0,
+                  on_failure=Callback(release_failed_stage))
+
+
+def release_finish(connection, job_id: str):
+    """Move the deferred public job onto the finish queue"""
+    queue = Queue(MEME_FINISH_QUEUE, connection=connection, default_timeout=STAGE_TIMEOUT)
+    job = Job.fetch(job_id, connection=connection)
+    # enqueue_job leaves deferred jobs alone, so clear that first
+    job.set_status(JobStatus.QUEUED)
+    queue.enqueue_job(job)
+
+
+def deferred_job_ids(connection, job_ids: Sequence[str]) -> List[str]:
+    """The public jobs among `job_ids` still waiting for an earlier stage to release them"""
+    return [
+        job.id for job in Job.fetch_many(list(job_ids), connection=connection)
+        if job is not None and job.get_status(refresh=False) == JobStatus.DEFERRED
+    ]
+
+
+def release_failed_stage(stage, connection, exc_type, exc_value, traceback):
+    """
+    on_failure callback of the text and diffusion stage jobs. A stage that timed out, or
+    whose worker died (RQ fails it when cleaning up the started registry), never handed
+    off: release its public job, and those batched with it, with an error instead of
+    leaving them deferred.
+    """
+    failed = STAGE_ERRORS.get(stage.func_name, "Meme generation failed")
+    for job_id in deferred_job_ids(connection, [stage.args[0]] + stage.meta.get("batch", [])):
+        if stage.func_name == TEXT_STAGE and connection.exists(Job.key_for(stage_job_id(job_id, "diffusion"))):
+            continue  # Handed off before failing: the diffusion stage releases it
+        state, _ = load_state(connection, job_id)
+        state = state or {}
+        state["error"] = f"{failed}: {exc_value}" if exc_value else failed
+        save_state(connection, job_id, state)
+        release_finish(connection, job_id)
@@ -0,0 +1,312 @@
+"""
+Pooled HTTP client for the Ollama API.
+
+One keep-alive connection pool per process instead of a new TCP connection per call,
+and at most OLLAMA_NUM_PARALLEL requests in flight (Ollama's parallel slots: extra
+requests only queue inside Ollama, where they cannot be timed or cancelled). Sync
+callers (workers) and asyncio callers (the API) each get their own pool and limit.
+Every call is timed, separating the wait for a slot from the request itself. A call's
+timeout is its whole budget: the wait for a slot, the connection and every read share one
+deadline, and a read still blocked when it passes is aborted, so a stuck Ollama can
+neither pile up workers behind the semaphore nor hold one past its timeout.
+"""
+import asyncio
+import json
+import socket
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, suppress
+from typing import Any, Dict, Iterator, Optional
+
+import httpx
+
+from config.settings import OLLAMA_HOST, OLLAMA_NUM_PARALLEL, OLLAMA_CONNECT_TIMEOUT
+
+
+class OllamaError(Exception):
+    """Custom exception for Ollama API errors."""
+    pass
+
+
+class OllamaRequestError(OllamaError):
+    """The request itself failed: connection error, timeout or HTTP error status."""
+    pass
+
+
+class _Deadline:
+    """End-to-end budget of one call"""
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.at = time.perf_counter() + timeout
+        self.expired = False
+        self._timer: Optional[threading.Timer] = None
+
+    def error(self) -> OllamaRequestError:
+        return OllamaRequestError(f"Ollama call exceeded its {self.timeout:g}s budget")
+
+    def passed(self) -> bool:
+        return self.expired or time.perf_counter() >= self.at
+
+    def remaining(self) -> float:
+        """Seconds left; raises OllamaRequestError once the budget is spent"""
+        remaining = self.at - time.perf_counter()
+        if remaining <= 0:
+            raise self.error()
+        return remaining
+
+    def watch(self, response: httpx.Response):
+        """Shut the response's socket down when the budget runs out, so a blocked read returns"""
+        stream = response.extensions.get("network_stream")
+        sock = stream.get_extra_info("socket") if stream is not None else None
+        if sock is None:
+            return
+
+        def expire():
+            self.expired = True
+            with suppress(OSError):
+                sock.shutdown(socket.SHUT_RDWR)
+
+        self._timer = threading.Timer(max(self.at - time.perf_counter(), 0), expire)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def cancel(self):
+        if self._timer is not None:
+            self._timer.cancel()
+
+
+class _CallStats:
+    """Timing of the calls to one endpoint"""
+
+    def __init__(self, window: int = 512):
+        self.calls = 0
+        self.errors = 0
+        self.durations = deque(maxlen=window)  # Recent request seconds, for percentiles
+        self.waits = deque(maxlen=window)      # Recent seconds spent waiting for a slot
+
+    def summary(self) -> dict:
+        durations = sorted(self.durations)
+
+        def percentile(p: float) -> float:
+            return round(durations[min(int(len(durations) * p), len(durations) - 1)] * 1000, 1) if durations else 0.0
+
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "p50_ms": percentile(0.5),
+            "p95_ms": percentile(0.95),
+            "max_ms": round(durations[-1] * 1000, 1) if durations else 0.0,
+            "avg_wait_ms": round(sum(self.waits) / len(self.waits) * 1000, 1) if self.waits else 0.0,
+        }
+
+
+class OllamaClient:
+    """Keep-alive, concurrency-limited Ollama client with sync and asyncio APIs"""
+
+    def __init__(self, host: str = OLLAMA_HOST, max_concurrency: int = OLLAMA_NUM_PARALLEL,
+                 timeout: float = 120, connect_timeout: float = OLLAMA_CONNECT_TIMEOUT):
+        """
+        Args:
+            host: Ollama base URL
+            max_concurrency: Requests allowed in flight at once (per sync/async side)
+            timeout: Default read timeout in seconds
+            connect_timeout: Connection timeout in seconds
+        """
+        self.host = host.rstrip("/")
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self._limits = httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency)
+        self._client: Optional[httpx.Client] = None
+        self._async_client: Optional[httpx.AsyncClient] = None
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._async_slots: Optional[asyncio.Semaphore] = None
+        self._lock = threading.Lock()
+        self._stats: Dict[str, _CallStats] = {}
+        self._in_flight = 0
+
+    def _timeout(self, timeout: Optional[float]) -> httpx.Timeout:
+        timeout = timeout or self.timeout
+        return httpx.Timeout(timeout, connect=min(self.connect_timeout, timeout))
+
+    def _sync_client(self) -> httpx.Client:
+        with self._lock:
+            if self._client is None:
+                self._client = httpx.Client(base_url=self.host, limits=self._limits, timeout=self._timeout(None))
+            return self._client
+
+    def _async_side(self):
+        # Created on first use so they bind to the running event loop
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(base_url=self.host, limits=self._limits, timeout=self._timeout(None))
+            self._async_slots = asyncio.Semaphore(self.max_concurrency)
+        return self._async_client, self._async_slots
+
+    def _track(self, delta: int):
+        with self._lock:
+            self._in_flight += delta
+
+    def _record(self, path: str, waited: float, duration: float, failed: bool):
+        with self._lock:
+            stats = self._stats.setdefault(path, _CallStats())
+            stats.calls += 1
+            stats.errors += failed
+            stats.waits.append(waited)
+            stats.durations.append(duration)
+
+    @contextmanager
+    def _slot(self, deadline: _Deadline):
+        if not self._slots.acquire(timeout=deadline.remaining()):
+            raise OllamaRequestError(f"No free Ollama slot within {deadline.timeout:g}s")
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+    @staticmethod
+    def _decode(response: httpx.Response) -> Dict[str, Any]:
+        response.raise_for_status()
+        return response.json()
+
+    def request(self, method: str, path: str, json: Optional[dict] = None,
+                timeout: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Make a request, waiting for a free slot first; slot wait and request together
+        take at most `timeout` seconds.
+
+        Returns:
+            Decoded JSON response
+
+        Raises:
+            OllamaRequestError: On connection errors, timeouts (including no free slot) and HTTP error statuses
+        """
+        client = self._sync_client()
+        deadline = _Deadline(timeout or self.timeout)
+        queued_at = time.perf_counter()
+        with self._slot(deadline):
+            started_at = time.perf_counter()
+            failed = True
+            self._track(1)
+            try:
+                with client.stream(method, path, json=json, timeout=self._timeout(deadline.remaining())) as response:
+                    deadline.watch(response)
+                    try:
+                        response.read()
+                    finally:
+                        deadline.cancel()
+                    result = self._decode(response)
+                failed = False
+                return result
+            except (httpx.HTTPError, ValueError) as e:
+                raise (deadline.error() if deadline.passed() else OllamaRequestError(f"HTTP request failed: {e}")) from e
+            finally:
+                self._track(-1)
+                self._record(path, started_at - queued_at, time.perf_counter() - started_at, failed)
+
+    async def arequest(self, method: str, path: str, json: Optional[dict] = None,
+                       timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Async version of request(), for use from the event loop"""
+        timeout = timeout or self.timeout
+        try:
+            return await asyncio.wait_for(self._arequest(method, path, json, timeout), timeout)
+        except asyncio.TimeoutError as e:
+            raise OllamaRequestError(f"Ollama call exceeded its {timeout:g}s budget") from e
+
+    async def _arequest(self, method: str, path: str, json: Optional[dict], timeout: float) -> Dict[str, Any]:
+        client, slots = self._async_side()
+        queued_at = time.perf_counter()
+        async with slots:
+            started_at = time.perf_counter()
+            failed = True
+            self._track(1)
+            try:
+                response = await client.request(method, path, json=json, timeout=self._timeout(timeout))
+                result = self._decode(response)
+                failed = False
+                return result
+            except (httpx.HTTPError, ValueError) as e:
+                raise OllamaRequestError(f"HTTP request failed: {e}") from e
+            finally:
+                self._track(-1)
+                self._record(path, started_at - queued_at, time.perf_counter() - started_at, failed)
+
+    def generate(self, body: dict, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """POST /api/generate (non-streaming)"""
+        return self.request("POST", "/api/generate", json=body, timeout=timeout)
+
+    async def agenerate(self, body: dict, timeout: Optional[float] = None) -> Dict[str, Any]:
+        return await self.arequest("POST", "/api/generate", json=body, timeout=timeout)
+
+    def stream_generate(self, body: dict, timeout: Optional[float] = None) -> Iterator[Dict[str, Any]]:
+        """
+        POST /api/generate with streaming: yields each chunk of Ollama's newline-delimited
+        JSON response. The slot is held until the iterator is exhausted or closed; closing
+        it early drops the connection, which makes Ollama stop generating. The whole
+        stream, slot wait included, must end within `timeout` seconds.
+
+        Raises:
+            OllamaRequestError: On connection errors, timeouts and HTTP error statuses
+        """
+        path = "/api/generate"
+        client = self._sync_client()
+        deadline = _Deadline(timeout or self.timeout)
+        queued_at = time.perf_counter()
+        with self._slot(deadline):
+            started_at = time.perf_counter()
+            failed = True
+            self._track(1)
+            try:
+                with client.stream("POST", path, json={**body, "stream": True},
+                                   timeout=self._timeout(deadline.remaining())) as response:
+                    deadline.watch(response)
+                    try:
+                        response.raise_for_status()
+                        for line in response.iter_lines():
+                            if line:
+                                yield json.loads(line)
+                    finally:
+                        deadline.cancel()
+                failed = False
+            except GeneratorExit:
+                failed = False  # Closed early by the caller
+                raise
+            except (httpx.HTTPError, ValueError) as e:
+                raise (deadline.error() if deadline.passed() else OllamaRequestError(f"HTTP request failed: {e}")) from e
+            finally:
+                self._track(-1)
+                self._record(path, started_at - queued_at, time.perf_counter() - started_at, failed)
+
+    def list_models(self, timeout: float = 10) -> list:
+        """Names of the models available in Ollama"""
+        data = self.request("GET", "/api/tags", timeout=timeout)
+        return [model.get("name", "") for model in data.get("models", [])]
+
+    async def alist_models(self, timeout: float = 10) -> list:
+        data = await self.arequest("GET", "/api/tags", timeout=timeout)
+        return [model.get("name", "") for model in data.get("models", [])]
+
+    def stats(self) -> dict:
+        """Per-endpoint call counts, errors and timings, plus requests in flight"""
+        with self._lock:
+            return {
+                "in_flight": self._in_flight,
+                "max_concurrency": self.max_concurrency,
+                "endpoints": {path: stats.summary() for path, stats in self._stats.items()},
+            }
+
+    def close(self):
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+
+    async def aclose(self):
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
+
+# Shared by every Ollama call of the process
+ollama_client = OllamaClient()
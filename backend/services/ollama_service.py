@@ -1,16 +1,241 @@
-import requests
 import json
 import logging
-from typing import Tuple, Optional, Dict, Any
-from config.settings import OLLAMA_HOST
+import hashlib
+import random
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from contextlib import closing
+from typing import Callable, Tuple, Optional, Dict, Any, List
+from config.settings import (
+    OLLAMA_STREAM, OLLAMA_KEEP_ALIVE, LLM_STATS_SAMPLE, LLM_TIMEOUT, LLM_CACHE_TTL, LLM_CACHE_LOCAL_SIZE, LLM_CACHE_MAX_ANSWERS,
+    LLM_CACHE_DIVERSITY, LLM_CACHE_NEAR_THRESHOLD,
+)
+from services.ollama_client import OllamaClient, OllamaError, OllamaRequestError, ollama_client
+from services.circuit_breaker import CircuitBreaker, CircuitOpenError
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
 
-class OllamaError(Exception):
-    """Custom exception for Ollama API errors."""
-    pass
+MINHASH_PERMUTATIONS = 64
+MINHASH_BANDS = 16  # LSH bands of MINHASH_PERMUTATIONS / MINHASH_BANDS rows each
+_MERSENNE_PRIME = (1 << 61) - 1
+_rng = random.Random(1729)
+_MINHASH_PARAMS = [
+    (_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME))
+    for _ in range(MINHASH_PERMUTATIONS)
+]
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Normalize a prompt so casing, punctuation and spacing variants share a cache entry"""
+    text = unicodedata.normalize("NFKC", prompt).casefold()
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+
+def minhash_signature(text: str, ngram: int = 3) -> List[int]:
+    """MinHash signature over the character n-grams of a normalized text"""
+    padded = f" {text} "
+    shingles = {padded[i:i + ngram] for i in range(max(len(padded) - ngram + 1, 1))}
+    hashes = [
+        int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=8).digest(), "big")
+        for shingle in shingles
+    ]
+    return [min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in _MINHASH_PARAMS]
+
+
+def signature_similarity(first: List[int], second: List[int]) -> float:
+    """Estimated Jaccard similarity of two MinHash signatures"""
+    if not first or len(first) != len(second):
+        return 0.0
+    return sum(1 for a, b in zip(first, second) if a == b) / len(first)
+
+
+class LLMCache:
+    """
+    Cache of generated meme texts keyed by (model, temperature, normalized prompt).
+
+    Entries live in a small in-process LRU backed by Redis with a TTL. Each entry keeps
+    a few answers; on a hit one is picked at random, and with probability `diversity`
+    the hit is skipped so a fresh answer gets generated and replaces the oldest one.
+    Near-duplicate prompts are found through MinHash LSH buckets stored in Redis.
+    """
+
+    def __init__(
+        self,
+        redis_connection=None,
+        ttl: int = LLM_CACHE_TTL,
+        local_size: int = LLM_CACHE_LOCAL_SIZE,
+        max_answers: int = LLM_CACHE_MAX_ANSWERS,
+        diversity: float = LLM_CACHE_DIVERSITY,
+        near_threshold: float = LLM_CACHE_NEAR_THRESHOLD,
+    ):
+        self.redis = redis_connection
+        self.ttl = ttl
+        self.local_size = local_size
+        self.max_answers = max(1, max_answers)
+        self.diversity = diversity
+        self.near_threshold = near_threshold
+        self._local: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+
+    @staticmethod
+    def _scope(model: str, temperature: float) -> str:
+        return hashlib.sha1(f"{model}:{round(float(temperature), 2)}".encode()).hexdigest()[:12]
+
+    def _entry_key(self, scope: str, normalized: str) -> str:
+        return f"llm_cache:{scope}:{hashlib.sha1(normalized.encode()).hexdigest()}"
+
+    @staticmethod
+    def _bucket_keys(scope: str, signature: List[int]) -> List[str]:
+        rows = MINHASH_PERMUTATIONS // MINHASH_BANDS
+        keys = []
+        for band in range(MINHASH_BANDS):
+            chunk = ",".join(str(v) for v in signature[band * rows:(band + 1) * rows])
+            keys.append(f"llm_cache:lsh:{scope}:{band}:{hashlib.sha1(chunk.encode()).hexdigest()[:16]}")
+        return keys
+
+    def _remember(self, key: str, entry: dict):
+        self._local[key] = (time.time() + self.ttl, entry)
+        self._local.move_to_end(key)
+        while len(self._local) > self.local_size:
+            self._local.popitem(last=False)
+
+    def _load(self, key: str) -> Optional[dict]:
+        local = self._local.get(key)
+        if local is not None:
+            expires_at, entry = local
+            if expires_at > time.time():
+                self._local.move_to_end(key)
+                return entry
+            del self._local[key]
+        if self.redis is None:
+            return None
+        try:
+            raw = self.redis.get(key)
+        except Exception as e:
+            logger.warning(f"LLM cache read failed: {e}")
+            return None
+        if raw is None:
+            return None
+        entry = json.loads(raw)
+        self._remember(key, entry)
+        return entry
+
+    def _find_near_duplicate(self, scope: str, signature: List[int]) -> Optional[dict]:
+        if self.redis is None:
+            return None
+        try:
+            with self.redis.pipeline(transaction=False) as pipe:
+                for bucket in self._bucket_keys(scope, signature):
+                    pipe.smembers(bucket)
+                members = pipe.execute()
+            candidates = list({m.decode() if isinstance(m, bytes) else m for bucket in members for m in bucket})[:32]
+            if not candidates:
+                return None
+            raw_entries = self.redis.mget(candidates)
+        except Exception as e:
+            logger.warning(f"LLM cache near-duplicate lookup failed: {e}")
+            return None
+
+        best, best_score = None, self.near_threshold
+        for raw in raw_entries:
+            if raw is None:
+                continue
+            entry = json.loads(raw)
+            score = signature_similarity(signature, entry.get("sig", []))
+            if score >= best_score:
+                best, best_score = entry, score
+        return best
+
+    def lookup(self, prompt: str, model: str, temperature: float) -> Optional[Tuple[str, str, str]]:
+        """
+        Look up cached meme texts for a prompt.
+
+        Returns:
+            Tuple of (image_prompt, top_text, bottom_text), or None when the caller
+            should generate (miss, or a hit skipped for diversity)
+        """
+        scope = self._scope(model, temperature)
+        normalized = normalize_prompt(prompt)
+        entry = self._load(self._entry_key(scope, normalized))
+        match = "exact"
+        if entry is None and self.near_threshold > 0:
+            entry = self._find_near_duplicate(scope, minhash_signature(normalized))
+            match = "near-duplicate"
+        if not entry or not entry.get("answers"):
+            return None
+        if random.random() < self.diversity:
+            logger.info(f"LLM cache {match} hit skipped for a fresh answer")
+            return None
+        logger.info(f"LLM cache {match} hit for prompt: {prompt!r}")
+        return tuple(random.choice(entry["answers"]))
+
+    def store(self, prompt: str, model: str, temperature: float, answer: Tuple[str, str, str]):
+        """Add a generated answer to the prompt's entry, keeping the newest `max_answers`"""
+        scope = self._scope(model, temperature)
+        normalized = normalize_prompt(prompt)
+        key = self._entry_key(scope, normalized)
+        entry = self._load(key) or {"answers": []}
+        entry["answers"] = [list(answer)] + [a for a in entry["answers"] if a != list(answer)]
+        entry["answers"] = entry["answers"][:self.max_answers]
+        signature = None
+        if self.near_threshold > 0:
+            signature = entry.get("sig") or minhash_signature(normalized)
+            entry["sig"] = signature
+        self._remember(key, entry)
+        if self.redis is None:
+            return
+        try:
+            with self.redis.pipeline(transaction=False) as pipe:
+                pipe.set(key, json.dumps(entry), ex=self.ttl)
+                if signature is not None:
+                    for bucket in self._bucket_keys(scope, signature):
+                        pipe.sadd(bucket, key)
+                        pipe.expire(bucket, self.ttl)
+                pipe.execute()
+        except Exception as e:
+            logger.warning(f"LLM cache write failed: {e}")
+
+
+# Static instruction block, sent once per request as the "system" field. It must not
+# vary between calls: Ollama reuses the evaluated prefix (KV cache) of a loaded model
+# only while the start of the prompt is identical, so per-call details go in the user turn.
+MEME_SYSTEM_PROMPT = (
+    "You are a meme idea generator. You receive a short user phrase and must return:"
+    "1) a brief visual description for an image model,"
+    "2) a witty TOP line (top_text),"
+    "3) a witty BOTTOM line (bottom_text)"
+    "OUTPUT:"
+    "- Return ONLY valid JSON (no extra text)."
+    "- Use the user's language (mirror the user's phrase language)."
+    "- Style: ALL CAPS, ideally 3–8 words per line, hard cap 100 characters/line."
+    "- Prefer ≤60 characters when possible for punchiness."
+    "MAKE THE LINES FUNNIER (very important):"
+    '- BE SPECIFIC: prefer concrete nouns, numbers, tiny details.'
+    "- CONTRAST or TWIST: set up in TOP, subvert or escalate in BOTTOM."
+    "- RHYTHM: use parallelism or the rule of three when it fits."
+    "- SURPRISE: add a left turn (unexpected consequence or overcommitment)."
+    "- KEEP IT CLEAN: no clichés or templated phrasings."
+    "CREATIVE DEVICES TO PREFER (pick 1–2):"
+    "- Hyperbole: tiny problem → epic disaster."
+    "- Specificity punch: mundane → oddly precise (brandless)."
+    "- Misdirection: expectation in TOP, reveal in BOTTOM."
+    "- Time jump: before/after, Friday → Monday."
+    "- Lists of three: beat, beat, flip."
+    "- Label arrows for template memes if useful (→)."
+    "INTERNAL TWO-PASS (do not reveal the notes):"
+    "1) Draft 5 candidate TOP/BOTTOM pairs with different angles (contrast, misdirection, rule-of-three, specificity, wholesome)."
+    "2) Score each 0–10 on: Novelty, Specificity, Readability, Template Fit. Pick the best."
+    "3) Output only the final JSON plus 2 alternates (or as many as the user asks for) in an \"alts\" array"
+    " (each with topText, bottomText and an imagePrompt if the scene changes)."
+    '"imagePrompt" (detailed visual description to generate the image), '
+    '"topText" (top text of the meme, short and impactful), '
+    '"bottomText" (bottom text of the meme, short and funny). '
+    "Respond only with JSON, no additional text."
+)
 
 
 def call_ollama(
@@ -18,7 +243,13 @@ def call_ollama(
     model: str = "qwen3:4b",
     temperature: float = 0.7,
     max_tokens: int = 256,
-    timeout: int = 120
+    timeout: float = LLM_TIMEOUT,
+    cache: Optional[LLMCache] = None,
+    client: Optional[OllamaClient] = None,
+    stream: bool = OLLAMA_STREAM,
+    on_text: Optional[Callable[[str, str], None]] = None,
+    on_stats: Optional[Callable[[dict], None]] = None,
+    breaker: Optional[CircuitBreaker] = None
 ) -> Tuple[str, str, str]:
     """
     Call Ollama API to generate meme content from user prompt using JSON mode.
@@ -28,55 +259,128 @@ def call_ollama(
         model: Ollama model to use (default: qwen3:4b)
         temperature: Sampling temperature (0.0-1.0, default: 0.7)
         max_tokens: Maximum tokens to generate (default: 256)
-        timeout: Request timeout in seconds (default: 120)
+        timeout: Latency budget in seconds for the whole call (default: LLM_TIMEOUT)
+        cache: Optional LLMCache consulted before calling the model
+        client: OllamaClient to call through (default: the shared pooled client)
+        stream: Stream the answer and stop as soon as the three fields are complete
+        on_text: Called with the (top_text, bottom_text) received so far while streaming
+        on_stats: Called with the token counts and timings of the call (see llm_stats);
+            not called on cache hits
+        breaker: Optional CircuitBreaker: the call is skipped while it is open, and
+            failures and slow calls are reported to it
         
     Returns:
         Tuple of (image_prompt, top_text, bottom_text)
         
     Raises:
         OllamaError: If the API call fails or returns invalid data
+        CircuitOpenError: If the breaker is open
+    """
+    if cache is not None:
+        cached = cache.lookup(prompt, model, temperature)
+        if cached is not None:
+            return cached
+
+    result = _guarded(breaker, lambda: _generate_meme_content(
+        prompt, model, temperature, max_tokens, timeout, client or ollama_client, stream, on_text, on_stats
+    ))[0]
+
+    # Only cache real answers, not the bare-prompt fallback
+    if cache is not None and (result[1] or result[2]):
+        cache.store(prompt, model, temperature, result)
+    return result
+
+
+def call_ollama_variants(
+    prompt: str,
+    count: int,
+    model: str = "qwen3:4b",
+    temperature: float = 0.7,
+    max_tokens: int = 256,
+    timeout: float = LLM_TIMEOUT,
+    cache: Optional[LLMCache] = None,
+    client: Optional[OllamaClient] = None,
+    stream: bool = OLLAMA_STREAM,
+    on_text: Optional[Callable[[str, str], None]] = None,
+    on_stats: Optional[Callable[[dict], None]] = None,
+    breaker: Optional[CircuitBreaker] = None
+) -> List[Tuple[str, str, str]]:
+    """
+    Generate a meme and its alternates (the "alts" of the answer) in a single call.
+
+    Args:
+        prompt: User input prompt for meme generation
+        count: Number of variants wanted, the primary included
+        max_tokens: Token budget per variant
+        (other arguments as in call_ollama)
+
+    Returns:
+        Up to `count` (image_prompt, top_text, bottom_text) tuples, the primary first.
+        Alternates without their own imagePrompt reuse the primary's. Fewer than
+        `count` come back when the model returns fewer distinct alternates.
+
+    Raises:
+        OllamaError: If the API call fails or returns invalid data
+        CircuitOpenError: If the breaker is open
+    """
+    variants = _guarded(breaker, lambda: _generate_meme_content(
+        prompt, model, temperature, max_tokens * count, timeout, client or ollama_client, stream, on_text,
+        on_stats, alternates=count - 1
+    ))[:count]
+
+    if cache is not None:
+        for variant in variants:
+            if variant[1] or variant[2]:
+                cache.store(prompt, model, temperature, variant)
+    return variants
+
+
+def _guarded(breaker: Optional[CircuitBreaker], call: Callable[[], List[Tuple[str, str, str]]]):
+    """Run an Ollama call through the circuit breaker (if any), reporting its outcome"""
+    if breaker is None:
+        return call()
+    if not breaker.allow():
+        raise CircuitOpenError("Ollama circuit breaker is open")
+    started_at = time.perf_counter()
+    try:
+        result = call()
+    except OllamaError:
+        breaker.record(time.perf_counter() - started_at, failed=True)
+        raise
+    breaker.record(time.perf_counter() - started_at)
+    return result
+
+
+def _generate_meme_content(
+    prompt: str,
+    model: str,
+    temperature: float,
+    max_tokens: int,
+    timeout: float,
+    client: OllamaClient,
+    stream: bool = False,
+    on_text: Optional[Callable[[str, str], None]] = None,
+    on_stats: Optional[Callable[[dict], None]] = None,
+    alternates: int = 0
+) -> List[Tuple[str, str, str]]:
+    """
+    Uncached Ollama request behind call_ollama and call_ollama_variants.
+    Returns the primary (image_prompt, top_text, bottom_text) followed by up to
+    `alternates` distinct alternates; the model always writes at least 2.
     """
-    # System message optimized for JSON mode
-    system_message = (
-        "You are a meme idea generator. You receive a short user phrase and must return:"
-        "1) a brief visual description for an image model,"
-        "2) a witty TOP line (top_text),"
-        "3) a witty BOTTOM line (bottom_text)"
-        "OUTPUT:"
-        "- Return ONLY valid JSON (no extra text)."
-        "- Use the user's language (mirror the user's phrase language)."
-        "- Style: ALL CAPS, ideally 3–8 words per line, hard cap 100 characters/line."
-        "- Prefer ≤60 characters when possible for punchiness."
-        "MAKE THE LINES FUNNIER (very important):"
-        '- BE SPECIFIC: prefer concrete nouns, numbers, tiny details.'
-        "- CONTRAST or TWIST: set up in TOP, subvert or escalate in BOTTOM."
-        "- RHYTHM: use parallelism or the rule of three when it fits."
-        "- SURPRISE: add a left turn (unexpected consequence or overcommitment)."
-        "- KEEP IT CLEAN: no clichés or templated phrasings."
-        "CREATIVE DEVICES TO PREFER (pick 1–2):"
-        "- Hyperbole: tiny problem → epic disaster."
-        "- Specificity punch: mundane → oddly precise (brandless)."
-        "- Misdirection: expectation in TOP, reveal in BOTTOM."
-        "- Time jump: before/after, Friday → Monday."
-        "- Lists of three: beat, beat, flip."
-        "- Label arrows for template memes if useful (→)."
-        "INTERNAL TWO-PASS (do not reveal the notes):"
-        "1) Draft 5 candidate TOP/BOTTOM pairs with different angles (contrast, misdirection, rule-of-three, specificity, wholesome)."
-        "2) Score each 0–10 on: Novelty, Specificity, Readability, Template Fit. Pick the best."
-        "3) Output only the final JSON plus 2 alternates in an \"alts\" array."
-        '"imagePrompt" (detailed visual description to generate the image), '
-        '"topText" (top text of the meme, short and impactful), '
-        '"bottomText" (bottom text of the meme, short and funny). '
-        "Respond only with JSON, no additional text."
-    )
     
-    # Build request body with JSON mode enabled
+    # Build request body with JSON mode enabled. The system block goes only in "system"
+    # (Ollama's template puts it first), so every call shares the same evaluated prefix.
+    user_turn = prompt
+    if alternates > 2:
+        user_turn += f"\n\n(Return {alternates} alternates.)"
     request_body = {
         "model": model,
-        "prompt": f"System: {system_message}\n\nUser: {prompt}\n\nJSON:",
+        "prompt": user_turn,
         "format": "json",  # Enable JSON mode for structured output
         "stream": False,
-        "system": system_message,  # Use system parameter for better prompt handling
+        "system": MEME_SYSTEM_PROMPT,
+        "keep_alive": OLLAMA_KEEP_ALIVE,  # Keep the model (and its prefix cache) loaded
         "options": {
             "temperature": temperature,
             "num_predict": max_tokens,
@@ -87,34 +391,38 @@ def call_ollama(
     try:
         logger.info(f"Calling Ollama API with model: {model}, prompt length: {len(prompt)}")
         
-        # Make API request
-        response = requests.post(
-            f"{OLLAMA_HOST}/api/generate", 
-            json=request_body, 
-            timeout=timeout,
-            headers={"Content-Type": "application/json"}
-        )
-        
-        # Check HTTP status
-        response.raise_for_status()
-        
-        # Parse response
-        response_data = response.json()
-        logger.debug(f"Raw Ollama response: {response_data}")
+        meme_data = None
+        if stream:
+            # Alternates come after the primary fields, so only stop early without them. A sample
+            # of calls runs to the end, as only Ollama's last chunk carries its token stats.
+            stop_early = not alternates and random.random() >= LLM_STATS_SAMPLE
+            generated_text, meme_data, stats = _stream_meme_fields(
+                client, request_body, timeout, on_text, stop_when_complete=stop_early
+            )
+        else:
+            # Make API request over the pooled, concurrency-limited client
+            response_data = client.generate(request_body, timeout=timeout)
+            logger.debug(f"Raw Ollama response: {response_data}")
+            stats = llm_stats(response_data)
+            
+            # Extract the generated text
+            generated_text = response_data.get("response", "").strip()
         
-        # Extract the generated text
-        generated_text = response_data.get("response", "").strip()
+        logger.info(f"Ollama call stats: {stats}")
+        if on_stats is not None:
+            on_stats(stats)
         
         if not generated_text:
             raise OllamaError("Empty response from Ollama API")
         
         # Parse JSON response (should be clean JSON due to format="json")
-        try:
-            meme_data = json.loads(generated_text)
-        except json.JSONDecodeError as e:
-            logger.warning(f"Failed to parse JSON response: {generated_text}")
-            # Fallback: try to extract JSON from response
-            meme_data = _extract_json_fallback(generated_text, prompt)
+        if meme_data is None:
+            try:
+                meme_data = json.loads(generated_text)
+            except json.JSONDecodeError as e:
+                logger.warning(f"Failed to parse JSON response: {generated_text}")
+                # Fallback: try to extract JSON from response
+                meme_data = _extract_json_fallback(generated_text, prompt)
         
         # Validate required fields
         image_prompt = meme_data.get("imagePrompt", "").strip()
@@ -129,12 +437,14 @@ def call_ollama(
         logger.info(f"Successfully generated meme content - Image: {len(image_prompt)} chars, "
                    f"Top: '{top_text}', Bottom: '{bottom_text}'")
         
-        return image_prompt, top_text, bottom_text
+        variants = [(image_prompt, top_text, bottom_text)]
+        if alternates:
+            variants += _parse_alternates(meme_data, variants[0], alternates)
+        return variants
         
-    except requests.exceptions.RequestException as e:
-        error_msg = f"HTTP request failed: {e}"
-        logger.error(error_msg)
-        raise OllamaError(error_msg) from e
+    except OllamaRequestError as e:
+        logger.error(str(e))
+        raise
         
     except json.JSONDecodeError as e:
         error_msg = f"Invalid JSON in API response: {e}"
@@ -145,7 +455,188 @@ def call_ollama(
         error_msg = f"Unexpected error calling Ollama: {e}"
         logger.error(error_msg)
         # Return fallback values instead of raising for better UX
-        return prompt, "", ""
+        return [(prompt, "", "")]
+
+
+MEME_FIELDS = ("imagePrompt", "topText", "bottomText")
+
+
+class MemeJsonScanner:
+    """
+    Incremental scanner for the top-level string fields of a streamed JSON object.
+    Fields nested deeper (e.g. inside the "alts" array) are ignored.
+    """
+
+    _ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+    def __init__(self, fields: Tuple[str, ...] = MEME_FIELDS):
+        self.wanted = fields
+        self.text = ""
+        self.fields: Dict[str, str] = {}
+        self._depth = 0
+        self._in_string = False
+        self._escape = ""  # Pending escape sequence, "" when none
+        self._buffer: List[str] = []
+        self._string_is_key = False
+        self._key: Optional[str] = None  # Last top-level key, until its value is read
+        self._value_key: Optional[str] = None  # Key of the top-level string being read
+
+    def feed(self, chunk: str):
+        self.text += chunk
+        for char in chunk:
+            if self._in_string:
+                self._feed_string(char)
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+            elif char == "," and self._depth == 1:
+                self._key = None
+            elif char == '"':
+                self._in_string = True
+                self._buffer = []
+                # At the top level a string is a key unless it follows "key":
+                self._string_is_key = self._depth == 1 and self._key is None
+                self._value_key = self._key if self._depth == 1 and self._key is not None else None
+
+    def _feed_string(self, char: str):
+        if self._escape:
+            self._escape += char
+            if self._escape[1] != "u":
+                self._buffer.append(self._ESCAPES.get(char, char))
+                self._escape = ""
+            elif len(self._escape) == 6:
+                try:
+                    self._buffer.append(chr(int(self._escape[2:], 16)))
+                except ValueError:
+                    pass
+                self._escape = ""
+        elif char == "\\":
+            self._escape = char
+        elif char == '"':
+            self._in_string = False
+            value = "".join(self._buffer)
+            if self._string_is_key:
+                self._key = value
+            elif self._value_key is not None:
+                if self._value_key in self.wanted:
+                    self.fields.setdefault(self._value_key, value)
+                self._key = None
+            self._value_key = None
+        else:
+            self._buffer.append(char)
+
+    def value(self, field: str) -> str:
+        """The field's value, or the part received so far while it is being streamed"""
+        if field in self.fields:
+            return self.fields[field]
+        if self._in_string and self._value_key == field:
+            return "".join(self._buffer)
+        return ""
+
+    def complete(self) -> bool:
+        return all(field in self.fields for field in self.wanted)
+
+
+def _stream_meme_fields(
+    client: OllamaClient,
+    request_body: dict,
+    timeout: float,
+    on_text: Optional[Callable[[str, str], None]],
+    stop_when_complete: bool = True
+) -> Tuple[str, Optional[Dict[str, str]], Dict[str, Any]]:
+    """
+    Stream a generation, by default stopping as soon as imagePrompt, topText and
+    bottomText are complete (the rest of the answer, e.g. the "alts", is never generated).
+    The whole stream must finish within `timeout` seconds, not just each read (the
+    client aborts it when the budget runs out, even in the middle of a read).
+
+    Returns:
+        (text received, the three fields if it stopped early else None, llm_stats of the call)
+    """
+    scanner = MemeJsonScanner()
+    started_at = time.perf_counter()
+    first_token_at = None
+    tokens = 0
+    final = {}
+    with closing(client.stream_generate(request_body, timeout=timeout)) as chunks:
+        for chunk in chunks:
+            if chunk.get("done"):
+                final = chunk  # Ollama's counters only come with the last chunk
+            if chunk.get("response"):
+                tokens += 1  # One token per chunk
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+            scanner.feed(chunk.get("response", ""))
+            if on_text is not None:
+                on_text(scanner.value("topText"), scanner.value("bottomText"))
+            if stop_when_complete and scanner.complete():
+                logger.info(f"Meme fields complete after {len(scanner.text)} chars; stopping generation")
+                break
+            if chunk.get("done"):
+                break
+    if final:
+        stats = llm_stats(final)
+    else:
+        # Closed before the last chunk, so Ollama sent no counters: only client-side estimates,
+        # under their own *_est keys (the time to first token also includes queueing and network)
+        ended_at = time.perf_counter()
+        first_token_at = first_token_at or ended_at
+        stats = {
+            "prompt_eval_count": None,
+            "prompt_eval_ms": None,
+            "eval_count": None,
+            "eval_ms": None,
+            "load_ms": None,
+            "total_ms": None,
+            "first_token_ms_est": round((first_token_at - started_at) * 1000, 1),
+            "eval_count_est": tokens,
+            "eval_ms_est": round((ended_at - first_token_at) * 1000, 1),
+            "total_ms_est": round((ended_at - started_at) * 1000, 1),
+            "estimated": True,
+            "stopped_early": True,
+        }
+    fields = dict(scanner.fields) if stop_when_complete and scanner.complete() else None
+    return scanner.text.strip(), fields, stats
+
+
+def llm_stats(response: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Token counts and timings (ms) from a final Ollama response. A low prompt_eval_count
+    on repeated calls means the system prompt prefix was reused from the KV cache.
+    """
+    def ms(field: str) -> Optional[float]:
+        value = response.get(field)
+        return round(value / 1e6, 1) if value is not None else None  # Ollama reports nanoseconds
+
+    return {
+        "prompt_eval_count": response.get("prompt_eval_count"),
+        "prompt_eval_ms": ms("prompt_eval_duration"),
+        "eval_count": response.get("eval_count"),
+        "eval_ms": ms("eval_duration"),
+        "load_ms": ms("load_duration"),
+        "total_ms": ms("total_duration"),
+    }
+
+
+def _parse_alternates(meme_data: Dict[str, Any], primary: Tuple[str, str, str], limit: int) -> List[Tuple[str, str, str]]:
+    """Distinct, non-empty alternates from the answer's "alts" array"""
+    alternates = []
+    seen = {primary[1:]}
+    alts = meme_data.get("alts")
+    for alt in alts if isinstance(alts, list) else []:
+        if not isinstance(alt, dict):
+            continue
+        top_text = str(alt.get("topText") or "").strip()
+        bottom_text = str(alt.get("bottomText") or "").strip()
+        if not (top_text or bottom_text) or (top_text, bottom_text) in seen:
+            continue
+        seen.add((top_text, bottom_text))
+        image_prompt = str(alt.get("imagePrompt") or "").strip() or primary[0]
+        alternates.append((image_prompt, top_text, bottom_text))
+        if len(alternates) == limit:
+            break
+    return alternates
 
 
 def _extract_json_fallback(text: str, original_prompt: str) -> Dict[str, str]:
@@ -189,8 +680,7 @@ def health_check() -> bool:
         True if service is healthy, False otherwise
     """
     try:
-        response = requests.get(f"{OLLAMA_HOST}/api/tags", timeout=10)
-        response.raise_for_status()
+        ollama_client.request("GET", "/api/tags", timeout=10)
         logger.info("Ollama health check passed")
         return True
     except Exception as e:
@@ -206,10 +696,7 @@ def list_available_models() -> Optional[list]:
         List of model names or None if request fails
     """
     try:
-        response = requests.get(f"{OLLAMA_HOST}/api/tags", timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        models = [model.get("name", "") for model in data.get("models", [])]
+        models = ollama_client.list_models()
         logger.info(f"Available models: {models}")
         return models
     except Exception as e:
@@ -0,0 +1,167 @@
+"""
+Off-thread encoding of finished images.
+
+Encoding a large PNG is a noticeable part of a job's non-GPU time. Outputs are encoded
+on a small thread pool in the configured OUTPUT_FORMAT (PNG at OUTPUT_PNG_COMPRESS_LEVEL,
+WebP or JPEG at OUTPUT_QUALITY) and written to a temp file that is renamed into place,
+so a reader never sees a partial file.
+
+In a long-lived worker (warm_worker.py, cpu_pool.py) the job returns as soon as the
+encode is submitted and the completion notification goes out once the file is in place,
+overlapping the encode with the next job; if the encode fails after the job has returned,
+the caller's on_failed marks the job as failed. While an encode is pending its filename is
+marked in Redis, so the API can wait briefly for the file instead of answering 404.
+Forking workers (`rq worker`) kill the work-horse when the job returns, so there the
+job waits for its encode.
+"""
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Optional
+from uuid import uuid4
+
+from PIL import Image
+
+from config.settings import (
+    OUT_DIR, OUTPUT_FORMAT, OUTPUT_PNG_COMPRESS_LEVEL, OUTPUT_QUALITY, OUTPUT_ENCODE_THREADS,
+)
+from services.output_files import output_pending_key, output_path
+
+# Format -> (PIL format, file extension)
+OUTPUT_FORMATS = {
+    "png": ("PNG", ".png"),
+    "webp": ("WEBP", ".webp"),
+    "jpeg": ("JPEG", ".jpg"),
+}
+PENDING_TTL = 300  # Seconds; outlives any encode, bounds leftovers from a crashed worker
+
+_executor = ThreadPoolExecutor(max_workers=OUTPUT_ENCODE_THREADS, thread_name_prefix="output-encoder")
+_background = False
+_lock = threading.Lock()
+
+
+def run_in_background(enabled: bool = True):
+    """Let jobs return before their encode finishes (only for in-process workers)"""
+    global _background
+    _background = enabled
+
+
+def drain():
+    """Wait for every submitted encode to finish (call before a worker exits)"""
+    with _lock:
+        _executor.shutdown(wait=True)
+
+
+def write_atomic(image: Image.Image, path: str, fmt: str, png_compress_level: int = OUTPUT_PNG_COMPRESS_LEVEL,
+                 quality: int = OUTPUT_QUALITY) -> int:
+    """
+    Encode an image to `path` through a temp file and rename.
+
+    Args:
+        image: Image to encode
+        path: Final file path
+        fmt: "png", "webp" or "jpeg"
+        png_compress_level: zlib level for PNG (0-9; lower is faster and larger)
+        quality: Quality for WebP and JPEG (1-100)
+
+    Returns:
+        Size of the written file in bytes
+    """
+    pil_format, _ = OUTPUT_FORMATS[fmt]
+    if pil_format == "PNG":
+        options = {"compress_level": png_compress_level}
+    else:
+        options = {"quality": quality}
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+
+    tmp_path = f"{path}.{uuid4().hex}.tmp"
+    try:
+        image.save(tmp_path, pil_format, **options)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return os.path.getsize(path)
+
+
+class OutputEncoder:
+    """Encodes finished images into their OUT_DIR shard on the shared encoder threads"""
+
+    def __init__(self, redis_connection=None, fmt: str = OUTPUT_FORMAT, out_dir: str = OUT_DIR):
+        """
+        Args:
+            redis_connection: Used to mark pending encodes for the API (optional)
+            fmt: Output format: "png", "webp" or "jpeg"
+            out_dir: Directory the outputs are written to
+        """
+        if fmt not in OUTPUT_FORMATS:
+            raise ValueError(f"Unknown OUTPUT_FORMAT '{fmt}', expected one of {tuple(OUTPUT_FORMATS)}")
+        self.redis = redis_connection
+        self.fmt = fmt
+        self.out_dir = out_dir
+
+    def filename(self, stem: str) -> str:
+        """Output filename for a job id"""
+        return stem + OUTPUT_FORMATS[self.fmt][1]
+
+    def submit(self, image: Image.Image, filename: str, on_written: Optional[Callable[[], None]] = None,
+               on_failed: Optional[Callable[[Exception], None]] = None) -> Future:
+        """
+        Encode an image to its OUT_DIR shard on the encoder threads.
+
+        Args:
+            image: Image to encode; it must not be modified afterwards
+            filename: Output filename (see filename()); the file goes to its shard directory
+            on_written: Called on the encoder thread once the file is in place
+            on_failed: Called on the encoder thread if encoding fails
+
+        Returns:
+            Future resolving to the file size
+        """
+        path = output_path(filename, self.out_dir)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._mark_pending(filename, True)
+
+        def encode():
+            try:
+                size = write_atomic(image, path, self.fmt)
+            except Exception as e:
+                print(f"Error encoding output {filename}: {e}")
+                if on_failed is not None:
+                    on_failed(e)
+                raise
+            finally:
+                self._mark_pending(filename, False)
+            if on_written is not None:
+                on_written()
+            return size
+
+        with _lock:
+            return _executor.submit(encode)
+
+    def save(self, image: Image.Image, filename: str, on_written: Optional[Callable[[], None]] = None,
+             on_failed: Optional[Callable[[Exception], None]] = None) -> Optional[Future]:
+        """
+        Submit an encode and, unless running in the background, wait for it.
+
+        Raises:
+            Exception: The encoding error, when not running in the background
+        """
+        future = self.submit(image, filename, on_written, on_failed)
+        if _background:
+            return future
+        future.result()
+        return None
+
+    def _mark_pending(self, filename: str, pending: bool):
+        if self.redis is None:
+            return
+        try:
+            if pending:
+                self.redis.set(output_pending_key(filename), 1, ex=PENDING_TTL)
+            else:
+                self.redis.delete(output_pending_key(filename))
+        except Exception as e:
+            print(f"Error marking output {filename} as pending: {e}")
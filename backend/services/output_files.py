@@ -0,0 +1,229 @@
+"""
+Cache-aware serving helpers for generated outputs.
+
+Job outputs never change once written, so they get strong ETags and immutable cache
+headers. Resized/re-encoded image variants (gallery thumbnails, WebP) are generated
+once, stored on disk and evicted oldest-first when the cache exceeds its size budget.
+"""
+import asyncio
+import hashlib
+import os
+import re
+import time
+from typing import Dict, Optional, Tuple
+from uuid import uuid4
+
+from PIL import Image
+
+from config.settings import (
+    OUT_DIR, VARIANT_CACHE_DIR, VARIANT_CACHE_MAX_BYTES, VARIANT_WIDTHS, OUTPUT_PENDING_WAIT
+)
+
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp")
+VARIANT_FORMATS = {
+    "webp": ("WEBP", "image/webp"),
+    "jpeg": ("JPEG", "image/jpeg"),
+    "png": ("PNG", "image/png"),
+}
+_SAFE_NAME = re.compile(r"^[A-Za-z0-9_-][A-Za-z0-9_.-]*$")
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class RangeNotSatisfiable(Exception):
+    """Raised when a Range header cannot be satisfied for the file size."""
+    pass
+
+
+def output_path(filename: str, root: str = OUT_DIR) -> str:
+    """
+    Sharded path of an output: root/ab/cd/<filename>, from a hash of the name.
+    Public URLs stay /outputs/<filename>; the shard follows from the name.
+    """
+    digest = hashlib.sha1(filename.encode()).hexdigest()
+    return os.path.join(root, digest[:2], digest[2:4], filename)
+
+
+def resolve_output_path(filename: str) -> Optional[str]:
+    """Map a public output filename to its path, rejecting anything but plain file names"""
+    if not _SAFE_NAME.match(filename):
+        return None
+    # Outputs written before sharding live flat in OUT_DIR
+    for path in (output_path(filename), os.path.join(OUT_DIR, filename)):
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def output_pending_key(filename: str) -> str:
+    """Redis key marking an output a worker is still encoding (see output_encoder)"""
+    return f"output_pending:{filename}"
+
+
+async def wait_for_output(async_redis, filename: str, timeout: float = OUTPUT_PENDING_WAIT) -> Optional[str]:
+    """
+    Resolve an output that may still be being encoded.
+    Waits up to `timeout` seconds while the worker's pending marker exists.
+    """
+    path = resolve_output_path(filename)
+    if path is not None or not _SAFE_NAME.match(filename):
+        return path
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline and await async_redis.exists(output_pending_key(filename)):
+        await asyncio.sleep(0.05)
+        path = resolve_output_path(filename)
+        if path is not None:
+            return path
+    return resolve_output_path(filename)
+
+
+def strong_etag(path: str, variant: str = "") -> str:
+    """Strong ETag for an immutable file (and optional variant spec)"""
+    stat = os.stat(path)
+    key = f"{os.path.basename(path)}:{stat.st_size}:{stat.st_mtime_ns}:{variant}"
+    return '"' + hashlib.sha1(key.encode()).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single-range "bytes=start-end" header into inclusive offsets.
+    Returns None when the header should be ignored (absent, malformed or multi-range).
+
+    Raises:
+        RangeNotSatisfiable: If the range lies outside the file
+    """
+    if not header:
+        return None
+    match = _RANGE.match(header.strip())
+    if not match:
+        return None
+    start, end = match.groups()
+    if start == "" and end == "":
+        return None
+    if start == "":
+        # Suffix range: the last N bytes
+        length = int(end)
+        if length == 0:
+            raise RangeNotSatisfiable(header)
+        return max(size - length, 0), size - 1
+    first = int(start)
+    last = min(int(end), size - 1) if end else size - 1
+    if first >= size or first > last:
+        raise RangeNotSatisfiable(header)
+    return first, last
+
+
+def iter_file_range(path: str, start: int, end: int, chunk_size: int = 256 * 1024):
+    """Yield bytes start..end (inclusive) of a file in chunks"""
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def snap_width(width: int) -> int:
+    """Round a requested width up to one of the cached sizes, to bound cache cardinality"""
+    for allowed in VARIANT_WIDTHS:
+        if width <= allowed:
+            return allowed
+    return VARIANT_WIDTHS[-1]
+
+
+class VariantCache:
+    """On-disk cache of resized/re-encoded image variants with a size budget"""
+
+    def __init__(self, root: str = VARIANT_CACHE_DIR, max_bytes: int = VARIANT_CACHE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._total_bytes: Optional[int] = None
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def _variant_path(self, source: str, width: Optional[int], fmt: str) -> str:
+        # Keyed by the full file name: x.png and x.webp (e.g. across an OUTPUT_FORMAT change) differ
+        return os.path.join(self.root, f"{os.path.basename(source)}.w{width or 0}.{fmt}")
+
+    async def get(self, source: str, width: Optional[int], fmt: str) -> str:
+        """Return the path of the variant, generating it on first request"""
+        path = self._variant_path(source, width, fmt)
+        if os.path.exists(path):
+            self._touch(path)
+            return path
+
+        lock = self._locks.setdefault(path, asyncio.Lock())
+        try:
+            async with lock:
+                if not os.path.exists(path):
+                    size = await asyncio.to_thread(self._render, source, path, width, fmt)
+                    self._account(size)
+        finally:
+            if not lock.locked():
+                self._locks.pop(path, None)
+        return path
+
+    def _render(self, source: str, path: str, width: Optional[int], fmt: str) -> int:
+        os.makedirs(self.root, exist_ok=True)
+        pil_format, _ = VARIANT_FORMATS[fmt]
+        with Image.open(source) as img:
+            img = img.convert("RGB") if pil_format == "JPEG" else img.copy()
+            if width and width < img.width:
+                img.thumbnail((width, width * img.height // img.width), Image.LANCZOS)
+            # Write to a temp file and rename so readers never see a partial variant
+            tmp_path = f"{path}.{uuid4().hex}.tmp"
+            options = {"quality": 80} if pil_format in ("WEBP", "JPEG") else {"optimize": True}
+            img.save(tmp_path, pil_format, **options)
+        os.replace(tmp_path, path)
+        return os.path.getsize(path)
+
+    def _touch(self, path: str):
+        # Refresh recency for eviction at most once an hour to keep hits read-only
+        try:
+            if time.time() - os.path.getmtime(path) > 3600:
+                os.utime(path)
+        except OSError:
+            pass
+
+    def _account(self, added: int):
+        if self._total_bytes is None:
+            self._total_bytes = self._scan()[1]
+        else:
+            self._total_bytes += added
+        if self._total_bytes > self.max_bytes:
+            self._evict()
+
+    def _scan(self):
+        entries = []
+        total = 0
+        if os.path.isdir(self.root):
+            for entry in os.scandir(self.root):
+                if entry.is_file() and not entry.name.endswith(".tmp"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+        return entries, total
+
+    def _evict(self):
+        """Delete least recently used variants until the cache is back under 90% of budget"""
+        entries, total = self._scan()
+        target = int(self.max_bytes * 0.9)
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        self._total_bytes = total
@@ -0,0 +1,186 @@
+"""
+Redis index of finished job outputs.
+
+Output files live in hash-prefix shard directories (see output_files.output_path). Each
+finished job is recorded in the index, so its result outlives RQ's result TTL and
+listing or cleaning up outputs never walks the directory tree:
+
+    output:{job_id}   hash: filename, path, size, kind, model, meta, result (JSON), created,
+                      extra (JSON paths of the job's other files, e.g. meme variants)
+    outputs:recent    sorted set of job ids by creation time
+    outputs:bytes     total size of the indexed files
+
+Garbage collection deletes outputs older than OUTPUT_MAX_AGE and then the oldest ones
+while the total exceeds OUTPUT_MAX_BYTES. Files from before the index are not tracked.
+"""
+import json
+import os
+import time
+from typing import List, Optional, Sequence, Tuple
+
+from config.settings import OUT_DIR, OUTPUT_MAX_AGE, OUTPUT_MAX_BYTES, OUTPUT_PAGE_MAX
+from services.output_files import output_path
+
+
+RECENT_KEY = "outputs:recent"
+BYTES_KEY = "outputs:bytes"
+GC_LOCK_KEY = "outputs:gc_lock"
+
+# Index an output, keeping the byte total right if the job is recorded again.
+# KEYS: output hash, recent zset, bytes counter; ARGV: created, job id, size, field/value pairs
+RECORD_SCRIPT = """
+local old = tonumber(redis.call('HGET', KEYS[1], 'size') or '0')
+redis.call('HSET', KEYS[1], unpack(ARGV, 4))
+redis.call('ZADD', KEYS[2], ARGV[1], ARGV[2])
+redis.call('INCRBY', KEYS[3], tonumber(ARGV[3]) - old)
+"""
+
+# Drop an output from the index; returns its path, size and extra paths (nil if it was not indexed)
+REMOVE_SCRIPT = """
+local entry = redis.call('HMGET', KEYS[1], 'path', 'size', 'extra')
+redis.call('ZREM', KEYS[2], ARGV[1])
+if not entry[1] then
+    return nil
+end
+redis.call('DEL', KEYS[1])
+redis.call('DECRBY', KEYS[3], tonumber(entry[2] or '0'))
+return entry
+"""
+
+
+def output_key(job_id: str) -> str:
+    return f"output:{job_id}"
+
+
+def _decode(entry: dict) -> dict:
+    """Public form of an index entry"""
+    fields = {key.decode(): value.decode() for key, value in entry.items()}
+    return {
+        "jobId": fields["job_id"],
+        "url": f"/outputs/{fields['filename']}",
+        "kind": fields.get("kind"),
+        "size": int(fields.get("size", 0)),
+        "model": fields.get("model") or None,
+        "meta": json.loads(fields.get("meta") or "{}"),
+        "created": float(fields.get("created", 0)),
+    }
+
+
+class OutputStore:
+    """Index of finished outputs, with paginated listing and budgeted cleanup"""
+
+    def __init__(self, redis_connection, root: str = OUT_DIR):
+        self.redis = redis_connection
+        self.root = root
+        self._record = self.redis.register_script(RECORD_SCRIPT)
+        self._remove = self.redis.register_script(REMOVE_SCRIPT)
+
+    def record(self, job_id: str, filename: str, kind: str, result: dict, model: Optional[str] = None,
+               extra_files: Sequence[str] = ()):
+        """
+        Index a job's output file (already written to its shard) and its result.
+
+        Args:
+            job_id: Public job id
+            filename: Output filename
+            kind: "image" or "video"
+            result: Job result, served once RQ has expired the job
+            model: Model that produced the output
+            extra_files: Other output filenames of the job, deleted and counted with it
+        """
+        path = output_path(filename, self.root)
+        extra_paths = [output_path(extra, self.root) for extra in extra_files]
+        now = time.time()
+        fields = {
+            "job_id": job_id,
+            "filename": filename,
+            "path": path,
+            "size": sum(os.path.getsize(p) for p in [path, *extra_paths]),
+            "extra": json.dumps(extra_paths),
+            "kind": kind,
+            "model": model or "",
+            "meta": json.dumps(result.get("meta", {})),
+            "result": json.dumps(result),
+            "created": now,
+        }
+        args = [now, job_id, fields["size"]]
+        for field, value in fields.items():
+            args += [field, value]
+        self._record(keys=[output_key(job_id), RECENT_KEY, BYTES_KEY], args=args)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        entry = self.redis.hgetall(output_key(job_id))
+        return _decode(entry) if entry else None
+
+    def recent(self, limit: int = 50, before: Optional[float] = None) -> Tuple[List[dict], Optional[float]]:
+        """
+        Newest outputs first.
+
+        Args:
+            limit: Page size (capped at OUTPUT_PAGE_MAX)
+            before: Cursor from the previous page: only outputs created before it
+
+        Returns:
+            (items, cursor of the next page or None on the last page)
+        """
+        limit = max(1, min(limit, OUTPUT_PAGE_MAX))
+        top = f"({before}" if before is not None else "+inf"
+        job_ids = self.redis.zrevrangebyscore(RECENT_KEY, top, "-inf", start=0, num=limit)
+        with self.redis.pipeline(transaction=False) as pipe:
+            for job_id in job_ids:
+                pipe.hgetall(output_key(job_id.decode()))
+            entries = pipe.execute()
+        items = [_decode(entry) for entry in entries if entry]
+        next_cursor = items[-1]["created"] if len(job_ids) == limit and items else None
+        return items, next_cursor
+
+    def delete(self, job_ids: List[str]) -> int:
+        """Delete outputs and their index entries; returns the bytes freed"""
+        freed = 0
+        for job_id in job_ids:
+            entry = self._remove(keys=[output_key(job_id), RECENT_KEY, BYTES_KEY], args=[job_id])
+            if not entry:
+                continue
+            paths = [entry[0].decode(), *json.loads(entry[2] or "[]")]
+            for path in paths:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            freed += int(entry[1] or 0)
+        return freed
+
+    def collect_garbage(self, max_age: int = OUTPUT_MAX_AGE, max_bytes: int = OUTPUT_MAX_BYTES,
+                        batch: int = 500) -> Tuple[int, int]:
+        """
+        Delete outputs past the age budget, then the oldest ones over the size budget.
+
+        Returns:
+            (outputs deleted, bytes freed)
+        """
+        deleted = freed = 0
+        if max_age > 0:
+            cutoff = time.time() - max_age
+            while True:
+                job_ids = [job_id.decode() for job_id in
+                           self.redis.zrangebyscore(RECENT_KEY, "-inf", cutoff, start=0, num=batch)]
+                if not job_ids:
+                    break
+                freed += self.delete(job_ids)
+                deleted += len(job_ids)
+
+        if max_bytes > 0:
+            while int(self.redis.get(BYTES_KEY) or 0) > max_bytes:
+                job_ids = [job_id.decode() for job_id in self.redis.zrange(RECENT_KEY, 0, batch - 1)]
+                if not job_ids:
+                    break
+                # Oldest first, stopping as soon as the total fits
+                for job_id in job_ids:
+                    if int(self.redis.get(BYTES_KEY) or 0) <= max_bytes:
+                        break
+                    freed += self.delete([job_id])
+                    deleted += 1
+
+        if deleted:
+            print(f"Output GC: deleted {deleted} output(s), freed {freed / 2**20:.1f} MiB")
+        return deleted, freed
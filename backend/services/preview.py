@@ -0,0 +1,125 @@
+"""
+Cheap previews of in-progress diffusion latents.
+
+Decoding intermediate latents with the full VAE would cost about as much as a denoising
+step, so previews use either a fixed linear latent -> RGB projection (free, latent
+resolution: 1/8 of the output) or the tiny TAESD-XL autoencoder (a few ms, full
+resolution), selected by PREVIEW_DECODER. Frames are small JPEGs published live on the
+job's `job_updates:*` channel; they are not kept in the job meta or event log.
+"""
+import base64
+import io
+import time
+from typing import List, Optional
+
+import torch
+from PIL import Image
+
+from config.settings import (
+    PREVIEW_DECODER, PREVIEW_MAX_SIZE, PREVIEW_QUALITY, PREVIEW_MAX_BYTES, PREVIEW_MIN_INTERVAL,
+    TAESD_MODEL_ID, device, dtype,
+)
+from models.registry import model_registry
+
+# Approximate projection of SDXL latents (shared by SSD-1B) onto RGB in [-1, 1]
+SDXL_LATENT_RGB_FACTORS = [
+    #   R        G        B
+    [0.3651, 0.4232, 0.4341],
+    [-0.2533, -0.0042, 0.1068],
+    [0.1076, 0.1111, -0.0362],
+    [-0.3165, -0.2492, -0.2188],
+]
+SDXL_LATENT_RGB_BIAS = [0.1084, -0.0175, -0.0011]
+
+PREVIEW_DECODERS = ("linear", "taesd")
+
+
+def _load_taesd():
+    from diffusers import AutoencoderTiny
+    return AutoencoderTiny.from_pretrained(TAESD_MODEL_ID, torch_dtype=dtype, cache_dir="./model_cache").to(device)
+
+
+model_registry.register("TAESD-XL", _load_taesd)
+
+
+def _to_images(rgb: torch.Tensor) -> List[Image.Image]:
+    """(batch, h, w, 3) tensor in [-1, 1] to PIL images"""
+    pixels = ((rgb.float() + 1) / 2).clamp(0, 1).mul(255).round().to(torch.uint8).cpu().numpy()
+    return [Image.fromarray(frame) for frame in pixels]
+
+
+def linear_decode(latents: torch.Tensor) -> List[Image.Image]:
+    """Project (batch, 4, h, w) latents to RGB images at latent resolution"""
+    factors = torch.tensor(SDXL_LATENT_RGB_FACTORS, dtype=torch.float32, device=latents.device)
+    bias = torch.tensor(SDXL_LATENT_RGB_BIAS, dtype=torch.float32, device=latents.device)
+    return _to_images(torch.einsum("bchw,cr->bhwr", latents.float(), factors) + bias)
+
+
+def tiny_decode(latents: torch.Tensor) -> List[Image.Image]:
+    """Decode (batch, 4, h, w) latents with the tiny autoencoder"""
+    vae = model_registry.get("TAESD-XL")
+    with torch.no_grad():
+        images = vae.decode(latents.to(vae.dtype)).sample
+    return _to_images(images.permute(0, 2, 3, 1))
+
+
+def decode_latents(latents: torch.Tensor, decoder: str = PREVIEW_DECODER) -> List[Image.Image]:
+    """
+    Approximate images for a batch of SDXL-family latents.
+
+    Args:
+        latents: Latents as passed to `callback_on_step_end`, shape (batch, 4, h, w)
+        decoder: "linear" or "taesd"
+
+    Returns:
+        One preview image per batch item
+    """
+    if decoder not in PREVIEW_DECODERS:
+        raise ValueError(f"Unknown PREVIEW_DECODER '{decoder}', expected one of {PREVIEW_DECODERS}")
+    return tiny_decode(latents) if decoder == "taesd" else linear_decode(latents)
+
+
+def encode_preview(image: Image.Image, max_size: int = PREVIEW_MAX_SIZE, quality: int = PREVIEW_QUALITY,
+                   max_bytes: int = PREVIEW_MAX_BYTES) -> Optional[bytes]:
+    """
+    JPEG-encode a preview no larger than `max_size` pixels per side and `max_bytes`.
+    The quality is halved until the frame fits; None if it never does.
+    """
+    image = image.convert("RGB")
+    image.thumbnail((max_size, max_size))
+    while quality >= 10:
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=quality)
+        if buffer.tell() <= max_bytes:
+            return buffer.getvalue()
+        quality //= 2
+    return None
+
+
+class PreviewPublisher:
+    """Rate-limited preview frames for one job"""
+
+    def __init__(self, job_id: str, notifier, min_interval: float = PREVIEW_MIN_INTERVAL):
+        """
+        Args:
+            job_id: Public job id the frames are published for
+            notifier: WebSocketNotifier used to publish them
+            min_interval: Minimum seconds between frames
+        """
+        self.job_id = job_id
+        self.notifier = notifier
+        self.min_interval = min_interval
+        self._last_sent: Optional[float] = None
+
+    def __call__(self, image: Image.Image) -> bool:
+        """Publish a frame unless the last one was too recent; returns True if sent"""
+        now = time.monotonic()
+        if self._last_sent is not None and now - self._last_sent < self.min_interval:
+            return False
+        frame = encode_preview(image)
+        if frame is None:
+            return False
+        data_url = "data:image/jpeg;base64," + base64.b64encode(frame).decode()
+        self.notifier.send_job_preview(self.job_id, data_url)
+        self._last_sent = now
+        return True
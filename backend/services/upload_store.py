@@ -0,0 +1,193 @@
+"""
+Content-addressed store for user uploaded images.
+
+Uploads are streamed in chunks, hashed while they are written and stored under
+their SHA-256 digest, so re-uploading the same template image is free. The store
+lives somewhere both the API and the workers can reach: a shared volume (default)
+or Redis blobs (UPLOAD_BACKEND=redis). Uploads are kept for UPLOAD_TTL seconds after
+their last upload: Redis expires the blobs, and the API's GC loop deletes old files.
+"""
+import hashlib
+import io
+import os
+import time
+from uuid import uuid4
+from typing import Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from config.settings import (
+    UPLOAD_DIR, UPLOAD_BACKEND, MAX_UPLOAD_BYTES, UPLOAD_CHUNK_SIZE, UPLOAD_TTL
+)
+
+
+class UploadTooLargeError(Exception):
+    """Raised when an upload exceeds MAX_UPLOAD_BYTES."""
+    pass
+
+
+class UploadNotFoundError(Exception):
+    """Raised when a referenced upload is not present in the store."""
+    pass
+
+
+class FileUploadStore:
+    """Stores uploads as files in hash-prefixed directories on a shared volume."""
+
+    def __init__(self, root: str = UPLOAD_DIR):
+        self.root = root
+
+    def path_for(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest)
+
+    async def save_stream(self, upload, max_bytes: int = MAX_UPLOAD_BYTES) -> str:
+        """
+        Stream an UploadFile to disk without holding it in memory.
+
+        Returns:
+            SHA-256 hex digest identifying the stored upload
+        """
+        tmp_dir = os.path.join(self.root, "tmp")
+        os.makedirs(tmp_dir, exist_ok=True)
+        tmp_path = os.path.join(tmp_dir, uuid4().hex)
+
+        hasher = hashlib.sha256()
+        total = 0
+        try:
+            with open(tmp_path, "wb") as f:
+                while True:
+                    chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    total += len(chunk)
+                    if total > max_bytes:
+                        raise UploadTooLargeError(f"Upload exceeds {max_bytes} bytes")
+                    hasher.update(chunk)
+                    await run_in_threadpool(f.write, chunk)
+
+            digest = hasher.hexdigest()
+            final_path = self.path_for(digest)
+            if os.path.exists(final_path):
+                # Duplicate upload: keep the stored copy and refresh its age
+                os.remove(tmp_path)
+                os.utime(final_path)
+            else:
+                os.makedirs(os.path.dirname(final_path), exist_ok=True)
+                os.replace(tmp_path, final_path)
+            return digest
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def collect_garbage(self, max_age: int = UPLOAD_TTL) -> int:
+        """
+        Delete uploads (and abandoned temp files) not uploaded again for `max_age` seconds.
+
+        Returns:
+            Number of files deleted
+        """
+        if max_age <= 0 or not os.path.isdir(self.root):
+            return 0
+        cutoff = time.time() - max_age
+        deleted = 0
+        for directory, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                        deleted += 1
+                except FileNotFoundError:
+                    pass
+        if deleted:
+            print(f"Upload GC: deleted {deleted} upload(s)")
+        return deleted
+
+    def open(self, digest: str):
+        """Open a stored upload for reading."""
+        path = self.path_for(digest)
+        if not os.path.exists(path):
+            raise UploadNotFoundError(f"Upload not found: {digest}")
+        return open(path, "rb")
+
+
+class RedisUploadStore:
+    """Stores uploads as Redis blobs with a TTL, for deployments without a shared volume."""
+
+    def __init__(self, redis_connection, ttl: int = UPLOAD_TTL):
+        self.redis = redis_connection
+        self.ttl = ttl
+
+    @staticmethod
+    def key_for(digest: str) -> str:
+        return f"upload:{digest}"
+
+    async def save_stream(self, upload, max_bytes: int = MAX_UPLOAD_BYTES) -> str:
+        """
+        Stream an UploadFile into Redis chunk by chunk.
+
+        Returns:
+            SHA-256 hex digest identifying the stored upload
+        """
+        tmp_key = f"upload:tmp:{uuid4().hex}"
+        hasher = hashlib.sha256()
+        total = 0
+        try:
+            while True:
+                chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                total += len(chunk)
+                if total > max_bytes:
+                    raise UploadTooLargeError(f"Upload exceeds {max_bytes} bytes")
+                hasher.update(chunk)
+                await run_in_threadpool(self._append, tmp_key, chunk)
+
+            digest = hasher.hexdigest()
+            key = self.key_for(digest)
+            await run_in_threadpool(self._commit, tmp_key, key)
+            return digest
+        except BaseException:
+            await run_in_threadpool(self.redis.delete, tmp_key)
+            raise
+
+    def _append(self, tmp_key: str, chunk: bytes):
+        with self.redis.pipeline() as pipe:
+            pipe.append(tmp_key, chunk)
+            pipe.expire(tmp_key, self.ttl)
+            pipe.execute()
+
+    def _commit(self, tmp_key: str, key: str):
+        if self.redis.exists(key):
+            # Duplicate upload: keep the stored blob and refresh its TTL
+            with self.redis.pipeline() as pipe:
+                pipe.delete(tmp_key)
+                pipe.expire(key, self.ttl)
+                pipe.execute()
+        else:
+            with self.redis.pipeline() as pipe:
+                pipe.rename(tmp_key, key)
+                pipe.expire(key, self.ttl)
+                pipe.execute()
+
+    def collect_garbage(self, max_age: int = UPLOAD_TTL) -> int:
+        """Nothing to do: the blobs expire on their own"""
+        return 0
+
+    def open(self, digest: str):
+        """Open a stored upload for reading."""
+        data = self.redis.get(self.key_for(digest))
+        if data is None:
+            raise UploadNotFoundError(f"Upload not found: {digest}")
+        return io.BytesIO(data)
+
+
+def get_upload_store(redis_connection=None, backend: Optional[str] = None):
+    """Build the upload store configured by UPLOAD_BACKEND."""
+    backend = backend or UPLOAD_BACKEND
+    if backend == "redis":
+        if redis_connection is None:
+            raise ValueError("Redis upload backend requires a Redis connection")
+        return RedisUploadStore(redis_connection)
+    return FileUploadStore()
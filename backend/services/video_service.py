@@ -6,6 +6,7 @@ from diffusers.utils import load_image, export_to_video
 from diffusers.utils import logging as dlogging
 from PIL import Image
 from config.settings import device, dtype
+from models.registry import model_registry
 dlogging.enable_progress_bar()
 
 class DummyCtx:
@@ -17,10 +18,6 @@ class DummyCtx:
         return False
 
 
-# Global video model instance
-_video_pipe = None
-
-
 def svd_step_logger(p, step_index, timestep, callback_kwargs):
     lat = callback_kwargs.get("latents", None)
     if lat is not None:
@@ -28,22 +25,27 @@ def svd_step_logger(p, step_index, timestep, callback_kwargs):
               f"mean={float(lat.mean().cpu()):.4f} std={float(lat.std().cpu()):.4f}")
     return callback_kwargs
 
-def load_video_model():
+def _load_svd():
     """Load Stable Video Diffusion model."""
-    global _video_pipe
+    print("\n== Loading Stable Video Diffusion model ==")
+    pipe = StableVideoDiffusionPipeline.from_pretrained(
+        "stabilityai/stable-video-diffusion-img2vid-xt",
+        torch_dtype=torch.float16 if device == "cuda" else torch.float32,
+        variant="fp16" if device == "cuda" else None,
+        cache_dir="./model_cache"
+    )
+    pipe = pipe.to(device)
+    print("\n== Stable Video Diffusion MODEL LOADED ==")
     
-    if _video_pipe is None:
-        print("\n== Loading Stable Video Diffusion model ==")
-        _video_pipe = StableVideoDiffusionPipeline.from_pretrained(
-            "stabilityai/stable-video-diffusion-img2vid-xt",
-            torch_dtype=torch.float16 if device == "cuda" else torch.float32,
-            variant="fp16" if device == "cuda" else None,
-            cache_dir="./model_cache"
-        )
-        _video_pipe = _video_pipe.to(device)
-        print("\n== Stable Video Diffusion MODEL LOADED ==")
-    
-    return _video_pipe
+    return pipe
+
+
+model_registry.register("SVD", _load_svd)
+
+
+def load_video_model():
+    """Return the Stable Video Diffusion pipeline, loading it if needed."""
+    return model_registry.get("SVD")
 
 
 def generate_video_from_image(image_path: str, output_path: str, num_frames: int = 16) -> str:
@@ -0,0 +1,132 @@
+"""
+CPU benchmark of the speed modes on a tiny, randomly initialized SDXL-style pipeline.
+
+Builds a few-megabyte UNet and VAE with SSD-1B/SDXL's layout (no downloads, no text
+encoders: random prompt embeddings stand in for them), switches it through every
+SPEED_MODES scheduler with models.schedulers.use_speed_mode, exactly like the workers
+do, and prints seconds per image with each mode's default steps and guidance. The
+images are noise; the point is the relative cost of the samplers, which comes from
+their step counts and from dropping classifier-free guidance (turbo). Turbo is timed
+with the LCM scheduler alone, as the tiny UNet has no LCM-LoRA.
+
+    python speed_benchmark.py [--images N] [--size PX] [--batch B] [--threads T]
+"""
+import argparse
+import sys
+import time
+
+import torch
+from diffusers import AutoencoderKL, EulerDiscreteScheduler, StableDiffusionXLPipeline, UNet2DConditionModel
+
+from config.settings import SPEED_MODES
+from models.schedulers import use_speed_mode
+
+# Embedding sizes of the tiny pipeline (SDXL concatenates two text encoders)
+TEXT_DIM = 64
+POOLED_DIM = 32
+TIME_EMBED_DIM = 8
+
+
+def tiny_pipeline() -> StableDiffusionXLPipeline:
+    """SDXL-style pipeline with random weights, small enough to sample on a CPU"""
+    torch.manual_seed(0)
+    unet = UNet2DConditionModel(
+        block_out_channels=(32, 64),
+        layers_per_block=2,
+        sample_size=32,
+        in_channels=4,
+        out_channels=4,
+        down_block_types=("DownBlock2D", "CrossAttnDownBlock2D"),
+        up_block_types=("CrossAttnUpBlock2D", "UpBlock2D"),
+        attention_head_dim=(2, 4),
+        use_linear_projection=True,
+        addition_embed_type="text_time",
+        addition_time_embed_dim=TIME_EMBED_DIM,
+        transformer_layers_per_block=(1, 2),
+        projection_class_embeddings_input_dim=6 * TIME_EMBED_DIM + POOLED_DIM,  # 6 size/crop ids + pooled text
+        cross_attention_dim=TEXT_DIM,
+        norm_num_groups=1,
+    )
+    vae = AutoencoderKL(
+        block_out_channels=(32, 64),
+        in_channels=3,
+        out_channels=3,
+        down_block_types=("DownEncoderBlock2D", "DownEncoderBlock2D"),
+        up_block_types=("UpDecoderBlock2D", "UpDecoderBlock2D"),
+        latent_channels=4,
+        norm_num_groups=1,
+        sample_size=128,
+    )
+    # Same scheduler config as the SDXL checkpoints
+    scheduler = EulerDiscreteScheduler(
+        beta_start=0.00085, beta_end=0.012, beta_schedule="scaled_linear",
+        steps_offset=1, timestep_spacing="leading",
+    )
+    pipe = StableDiffusionXLPipeline(
+        vae=vae, text_encoder=None, text_encoder_2=None, tokenizer=None, tokenizer_2=None,
+        unet=unet, scheduler=scheduler, add_watermarker=False,
+    )
+    pipe.set_progress_bar_config(disable=True)
+    return pipe
+
+
+def generate(pipe, mode: dict, size: int, batch: int, seed: int):
+    generator = torch.Generator("cpu").manual_seed(seed)
+    embeds = torch.randn(2, batch, 77, TEXT_DIM, generator=generator)
+    pooled = torch.randn(2, batch, POOLED_DIM, generator=generator)
+    return pipe(
+        prompt_embeds=embeds[0],
+        pooled_prompt_embeds=pooled[0],
+        negative_prompt_embeds=embeds[1],
+        negative_pooled_prompt_embeds=pooled[1],
+        num_inference_steps=mode["steps"],
+        guidance_scale=mode["guidance"],
+        width=size,
+        height=size,
+        generator=generator,
+    ).images
+
+
+def benchmark(images: int = 3, size: int = 128, batch: int = 1) -> dict:
+    """
+    Time every speed mode on the tiny pipeline.
+
+    Args:
+        images: Timed pipeline calls per mode (after one warmup call)
+        size: Image width and height in pixels
+        batch: Images per pipeline call
+
+    Returns:
+        Seconds per image for each mode
+    """
+    pipe = tiny_pipeline()
+    results = {}
+    print(f"\n{'mode':>9} {'scheduler':>10} {'steps':>5} {'cfg':>4} {'s/image':>8} {'speedup':>7}")
+    for speed, mode in SPEED_MODES.items():
+        scheduler = use_speed_mode(pipe, speed)
+        generate(pipe, mode, size, batch, seed=0)  # Warmup, and the scheduler is built
+        started_at = time.perf_counter()
+        for i in range(images):
+            generate(pipe, mode, size, batch, seed=i)
+        results[speed] = (time.perf_counter() - started_at) / (images * batch)
+        speedup = results.get("standard", results[speed]) / results[speed]
+        cfg = "yes" if mode["guidance"] > 1 else "no"
+        print(f"{speed:>9} {scheduler:>10} {mode['steps']:>5} {cfg:>4} {results[speed]:>8.3f} {speedup:>6.1f}x")
+    return results
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=3, help="Timed pipeline calls per mode")
+    parser.add_argument("--size", type=int, default=128, help="Image width and height in pixels")
+    parser.add_argument("--batch", type=int, default=1, help="Images per pipeline call")
+    parser.add_argument("--threads", type=int, default=0, help="torch threads, 0 = torch's default")
+    args = parser.parse_args(argv)
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    benchmark(args.images, args.size, args.batch)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,42 @@
+import math
+from typing import List
+
+from PIL import Image
+
+from config.settings import CONTACT_SHEET_THUMB
+
+
+def contact_sheet(images: List[Image.Image], thumb: int = CONTACT_SHEET_THUMB, gap: int = 8) -> Image.Image:
+    """
+    Tile images into one preview grid (as square as possible, row by row).
+
+    Args:
+        images: Images to tile, in order
+        thumb: Maximum width and height of each tile in pixels
+        gap: Pixels between tiles and around the edge
+
+    Returns:
+        RGB contact sheet
+    """
+    columns = math.ceil(math.sqrt(len(images)))
+    rows = math.ceil(len(images) / columns)
+    tiles = []
+    for image in images:
+        tile = image.convert("RGB")
+        tile.thumbnail((thumb, thumb))
+        tiles.append(tile)
+
+    cell_width = max(tile.width for tile in tiles)
+    cell_height = max(tile.height for tile in tiles)
+    sheet = Image.new(
+        "RGB",
+        (columns * (cell_width + gap) + gap, rows * (cell_height + gap) + gap),
+        (24, 24, 24),
+    )
+    for index, tile in enumerate(tiles):
+        row, column = divmod(index, columns)
+        # Center each tile in its cell
+        x = gap + column * (cell_width + gap) + (cell_width - tile.width) // 2
+        y = gap + row * (cell_height + gap) + (cell_height - tile.height) // 2
+        sheet.paste(tile, (x, y))
+    return sheet
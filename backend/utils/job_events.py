@@ -0,0 +1,69 @@
+"""
+Durable per-job event log.
+
+Workers append every job update to a capped Redis Stream (job_events:<job_id>) and
+publish it on job_updates:<job_id> in the same atomic step, tagging the live message
+with the stream entry id. Clients that reconnect replay the stream from their last
+seen event id instead of polling.
+"""
+import json
+import re
+from typing import Dict, List, Optional, Tuple
+
+
+EVENT_ID_PATTERN = re.compile(r"^\d+(-\d+)?$")
+
+# XADD + EXPIRE + PUBLISH in one round trip; the published payload gets the new entry id
+APPEND_EVENT_SCRIPT = """
+local id = redis.call('XADD', KEYS[1], 'MAXLEN', '~', ARGV[3], '*', 'data', ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+local receivers = redis.call('PUBLISH', ARGV[1], '{"event_id":"' .. id .. '",' .. string.sub(ARGV[2], 2))
+return {id, receivers}
+"""
+
+
+def job_events_key(job_id: str) -> str:
+    return f"job_events:{job_id}"
+
+
+def parse_event_id(event_id: Optional[str]) -> Optional[Tuple[int, int]]:
+    """Parse a stream entry id into a comparable tuple, or None if it is not one"""
+    if not event_id or not EVENT_ID_PATTERN.match(event_id):
+        return None
+    ms, _, seq = event_id.partition("-")
+    return int(ms), int(seq or 0)
+
+
+def _decode_entry(entry_id, fields) -> dict:
+    event_id = entry_id.decode() if isinstance(entry_id, bytes) else entry_id
+    data = fields.get(b"data") or fields.get("data") or b"{}"
+    return {"event_id": event_id, **json.loads(data)}
+
+
+async def read_job_events(async_redis, since: Dict[str, Optional[str]]) -> Dict[str, List[dict]]:
+    """
+    Read the events logged after the given ids, for many jobs in one pipelined round trip.
+
+    Args:
+        async_redis: redis.asyncio client
+        since: Mapping of job id to the last event id the client has seen
+            (None or an invalid id replays the whole log)
+
+    Returns:
+        Mapping of job id to its events in order, each tagged with "event_id"
+    """
+    job_ids = list(since)
+    if not job_ids:
+        return {}
+
+    async with async_redis.pipeline(transaction=False) as pipe:
+        for job_id in job_ids:
+            last = since[job_id]
+            start = f"({last}" if parse_event_id(last) else "-"
+            pipe.xrange(job_events_key(job_id), start, "+")
+        raw = await pipe.execute()
+
+    return {
+        job_id: [_decode_entry(entry_id, fields) for entry_id, fields in entries]
+        for job_id, entries in zip(job_ids, raw)
+    }
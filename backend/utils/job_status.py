@@ -0,0 +1,88 @@
+"""
+Non-blocking job status lookups for the API.
+
+RQ's Job.fetch and job.result go through a blocking Redis client. These helpers read
+the same keys through an asyncio Redis client in a single pipelined round trip and
+decode them with RQ's own restore logic. Jobs RQ has already expired fall back to the
+result kept in the output index (see services.output_store).
+"""
+import json
+from typing import Dict, Iterable, Optional
+
+from rq.job import Job, JobStatus
+from rq.results import Result
+
+from services.output_store import output_key
+
+
+NOT_FOUND = {"status": "error", "message": "not found"}
+
+
+def job_status(job: Job, result: Optional[Result] = None) -> dict:
+    """Build the public status payload for an RQ job and its latest result"""
+    status = job.get_status(refresh=False)
+    if status == JobStatus.FINISHED:
+        # The output failed to encode after the job had returned (see worker.finish_meme)
+        if (job.meta or {}).get("error"):
+            return {"status": "error", "message": job.meta["error"]}
+        if result is not None and result.type == Result.Type.SUCCESSFUL:
+            return result.return_value
+        # Results written by older RQ versions live in the job hash
+        return job._result
+    if status == JobStatus.FAILED:
+        if result is not None and result.type == Result.Type.FAILED:
+            return {"status": "error", "message": str(result.exc_string)}
+        return {"status": "error", "message": str(job._exc_info)}
+    meta = job.meta or {}
+    status = {"status": meta.get("status", "queued"), "progress": meta.get("progress", 0)}
+    if meta.get("eta") is not None:
+        status["eta"] = meta["eta"]
+    return status
+
+
+async def fetch_job_statuses(async_redis, connection, job_ids: Iterable[str]) -> Dict[str, Optional[dict]]:
+    """
+    Fetch status, meta and result for many jobs in one pipelined round trip.
+
+    Args:
+        async_redis: redis.asyncio client used for the reads
+        connection: Synchronous Redis connection attached to the decoded Job objects
+        job_ids: Job ids to look up
+
+    Returns:
+        Mapping of job id to its status payload, or None if the job does not exist
+    """
+    job_ids = list(job_ids)
+    if not job_ids:
+        return {}
+
+    async with async_redis.pipeline(transaction=False) as pipe:
+        for job_id in job_ids:
+            pipe.hgetall(Job.key_for(job_id))
+            pipe.xrevrange(Result.get_key(job_id), "+", "-", count=1)
+            pipe.hget(output_key(job_id), "result")
+        raw = await pipe.execute()
+
+    statuses: Dict[str, Optional[dict]] = {}
+    for index, job_id in enumerate(job_ids):
+        job_data, latest, indexed = raw[3 * index:3 * index + 3]
+        if not job_data:
+            # Expired from RQ: the output index keeps finished results
+            statuses[job_id] = json.loads(indexed) if indexed else None
+            continue
+
+        job = Job(job_id, connection=connection)
+        job.restore(job_data)
+        result = None
+        if latest:
+            result_id, payload = latest[0]
+            result = Result.restore(job_id, result_id.decode(), payload, connection=connection)
+        statuses[job_id] = job_status(job, result)
+
+    return statuses
+
+
+async def fetch_job_status(async_redis, connection, job_id: str) -> Optional[dict]:
+    """Fetch the status payload of a single job, or None if it does not exist"""
+    statuses = await fetch_job_statuses(async_redis, connection, [job_id])
+    return statuses[job_id]
@@ -0,0 +1,113 @@
+"""
+Throttled job progress reporting for workers.
+
+Each update writes the RQ job meta and appends/publishes the job event in one Redis
+pipeline. Updates closer than PROGRESS_MIN_INTERVAL seconds or PROGRESS_MIN_DELTA percent
+to the previous one are dropped unless forced, so per-step diffusion progress costs a
+bounded number of round trips no matter how many steps a job runs.
+"""
+import time
+from typing import Callable, Optional
+
+from config.settings import PROGRESS_MIN_INTERVAL, PROGRESS_MIN_DELTA, LIVE_TEXT_MIN_INTERVAL
+
+
+class ProgressReporter:
+    """Progress updates for one job (meta + WebSocket/SSE event)"""
+
+    def __init__(self, job, notifier=None, min_interval: float = PROGRESS_MIN_INTERVAL,
+                 min_delta: float = PROGRESS_MIN_DELTA):
+        """
+        Args:
+            job: RQ job whose meta carries the public progress (the public job id)
+            notifier: Optional WebSocketNotifier used to publish the updates
+            min_interval: Minimum seconds between unforced updates
+            min_delta: Minimum progress increase (percent) between unforced updates
+        """
+        self.job = job
+        self.notifier = notifier
+        self.min_interval = min_interval
+        self.min_delta = min_delta
+        self._last_progress: Optional[int] = None
+        self._last_sent = 0.0
+
+    def report(self, progress: float, force: bool = False, **extra) -> bool:
+        """
+        Report progress, skipping it if it is too close to the last update.
+
+        Args:
+            progress: Percent complete
+            force: Send even if throttled (stage milestones)
+            **extra: Extra fields for meta and the event (e.g. eta)
+
+        Returns:
+            True if the update was sent
+        """
+        progress = int(progress)
+        now = time.monotonic()
+        if not force and self._last_progress is not None:
+            if progress - self._last_progress < self.min_delta or now - self._last_sent < self.min_interval:
+                return False
+
+        self.job.meta.pop("eta", None)
+        self.job.meta.update({"status": "running", "progress": progress, **extra})
+        try:
+            with self.job.connection.pipeline() as pipe:
+                pipe.hset(self.job.key, "meta", self.job.serializer.dumps(self.job.meta))
+                if self.notifier is not None:
+                    self.notifier.send_job_update(self.job.id, "running", progress, pipeline=pipe, **extra)
+                pipe.execute()
+        except Exception as e:
+            # Don't fail the job if progress reporting fails
+            print(f"Error reporting progress for job {self.job.id}: {e}")
+            return False
+
+        self._last_progress = progress
+        self._last_sent = now
+        return True
+
+    def steps(self, start: float, end: float) -> Callable[[float], None]:
+        """
+        Callback for per-step diffusion progress.
+
+        Returns:
+            Function taking the fraction (0-1) of the run done; it maps it onto
+            start..end percent and reports it with an ETA for the rest of the run
+        """
+        began = time.monotonic()
+
+        def on_step(fraction: float):
+            elapsed = time.monotonic() - began
+            eta = elapsed * (1 - fraction) / fraction if fraction > 0 else None
+            self.report(start + (end - start) * fraction, eta=round(eta, 1) if eta is not None else None)
+
+        return on_step
+
+
+class LiveTextPublisher:
+    """Rate-limited live meme text for one job, while Ollama is still generating it"""
+
+    def __init__(self, job_id: str, notifier, min_interval: float = LIVE_TEXT_MIN_INTERVAL):
+        """
+        Args:
+            job_id: Public job id the text is published for
+            notifier: WebSocketNotifier used to publish it
+            min_interval: Minimum seconds between unforced updates
+        """
+        self.job_id = job_id
+        self.notifier = notifier
+        self.min_interval = min_interval
+        self._last_text = ("", "")
+        self._last_sent = 0.0
+
+    def __call__(self, top: str, bottom: str, force: bool = False) -> bool:
+        """Publish the text received so far unless unchanged or too recent; returns True if sent"""
+        now = time.monotonic()
+        if (top, bottom) == self._last_text:
+            return False
+        if not force and now - self._last_sent < self.min_interval:
+            return False
+        self.notifier.send_job_text(self.job_id, top, bottom)
+        self._last_text = (top, bottom)
+        self._last_sent = now
+        return True
@@ -6,18 +6,44 @@ import asyncio
 import traceback
 from typing import Dict, Any, Optional
 
+from config.settings import JOB_EVENTS_MAXLEN, JOB_EVENTS_TTL
+from utils.job_events import APPEND_EVENT_SCRIPT, job_events_key
+
 
 class WebSocketNotifier:
     """Utility class to send WebSocket notifications from workers"""
     
-    def __init__(self, redis_connection):
+    def __init__(self, redis_connection, maxlen: int = JOB_EVENTS_MAXLEN, ttl: int = JOB_EVENTS_TTL):
         self.redis = redis_connection
+        self.maxlen = maxlen
+        self.ttl = ttl
+        self._append_event = self.redis.register_script(APPEND_EVENT_SCRIPT)
+    
+    def _emit(self, job_id: str, message: Dict[str, Any], pipeline=None) -> Optional[int]:
+        """
+        Append the message to the job's event stream and publish it live.
+        Returns the number of API processes that received it (None when queued on a pipeline).
+        """
+        if pipeline is not None:
+            self._append_event(
+                keys=[job_events_key(job_id)],
+                args=[f"job_updates:{job_id}", json.dumps(message), self.maxlen, self.ttl],
+                client=pipeline,
+            )
+            return None
+        _, receivers = self._append_event(
+            keys=[job_events_key(job_id)],
+            args=[f"job_updates:{job_id}", json.dumps(message), self.maxlen, self.ttl],
+        )
+        return receivers
         
-    def send_job_update(self, job_id: str, status: str, progress: int = 0, **kwargs):
+    def send_job_update(self, job_id: str, status: str, progress: int = 0, pipeline=None, **kwargs):
         """
         Send job update via Redis pub/sub that will be picked up by WebSocket manager
         This allows workers (which don't have direct access to WebSocket manager) 
         to trigger WebSocket messages
+
+        Pass a Redis pipeline to queue the update with other writes (the caller executes it)
         """
         try:
             message = {
@@ -27,11 +53,13 @@ class WebSocketNotifier:
                 **kwargs
             }
             
-            # Publish to Redis channel that WebSocket manager listens to
-            result = self.redis.publish(f"job_updates:{job_id}", json.dumps(message))
+            # Log to the job stream and publish to the channel the WebSocket manager listens to
+            result = self._emit(job_id, message, pipeline)
             
+            if pipeline is not None:
+                return
             if result == 0:
-                print(f"Warning: No WebSocket clients listening for job {job_id}")
+                print(f"No live listeners for job {job_id}; update kept in event log")
             else:
                 print(f"WebSocket update sent for job {job_id}: {status} ({progress}%)")
                 
@@ -40,6 +68,39 @@ class WebSocketNotifier:
             # Don't fail the job if WebSocket notification fails
             traceback.print_exc()
         
+    def send_job_preview(self, job_id: str, preview: str):
+        """
+        Publish a preview frame (JPEG data URL) of a running job.
+        Previews are live only: they are not appended to the job's event log.
+        """
+        try:
+            message = {
+                "job_id": job_id,
+                "type": "preview",
+                "status": "running",
+                "preview": preview,
+            }
+            self.redis.publish(f"job_updates:{job_id}", json.dumps(message))
+        except Exception as e:
+            print(f"Error sending preview: {e}")
+        
+    def send_job_text(self, job_id: str, top_text: str, bottom_text: str):
+        """
+        Publish the meme text generated so far for a running job.
+        Like previews, live text is not appended to the job's event log.
+        """
+        try:
+            message = {
+                "job_id": job_id,
+                "type": "text",
+                "status": "running",
+                "topText": top_text,
+                "bottomText": bottom_text,
+            }
+            self.redis.publish(f"job_updates:{job_id}", json.dumps(message))
+        except Exception as e:
+            print(f"Error sending live text: {e}")
+        
     def send_job_complete(self, job_id: str, result: Dict[str, Any]):
         """Send job completion notification"""
         try:
@@ -49,7 +110,7 @@ class WebSocketNotifier:
                 "progress": 100,
                 **result
             }
-            self.redis.publish(f"job_updates:{job_id}", json.dumps(message))
+            self._emit(job_id, message)
             print(f"WebSocket completion notification sent for job {job_id}")
         except Exception as e:
             print(f"Error sending WebSocket completion: {e}")
@@ -62,7 +123,7 @@ class WebSocketNotifier:
                 "status": "error", 
                 "message": error_message
             }
-            self.redis.publish(f"job_updates:{job_id}", json.dumps(message))
+            self._emit(job_id, message)
             print(f"WebSocket error notification sent for job {job_id}")
         except Exception as e:
             print(f"Error sending WebSocket error notification: {e}")
\ No newline at end of file
@@ -1,9 +1,12 @@
 import os
+import time
 from rq import get_current_job
 
 # Import video generation service
-from config.settings import OUT_DIR
 from services.video_service import generate_video_from_image
+from services.admission import record_job_duration
+from services.output_files import output_path, resolve_output_path
+from services.output_store import OutputStore
 
 # Set up WebSocket notifier (with error handling)
 try:
@@ -11,11 +14,14 @@ try:
     from redis import Redis
     redis_client = Redis(host="redis", port=6379)
     websocket_notifier = WebSocketNotifier(redis_client)
+    output_store = OutputStore(redis_client)
     WEBSOCKET_ENABLED = True
 except Exception as e:
     print(f"WebSocket notifications disabled: {e}")
     WEBSOCKET_ENABLED = False
     websocket_notifier = None
+    redis_client = None
+    output_store = None
 
 
 def run_video_job(job_id: str, payload: dict):
@@ -30,6 +36,7 @@ def run_video_job(job_id: str, payload: dict):
         Job result with video information
     """
     job = get_current_job()
+    started_at = time.time()
     job.meta.update({"status": "running", "progress": 5})
     job.save_meta()
     
@@ -53,7 +60,8 @@ def run_video_job(job_id: str, payload: dict):
     # Convert image URL to file path
     # Assuming image_url is like "/outputs/job_id.png"
     if image_url.startswith("/outputs/"):
-        image_path = image_url  # Keep the full path since it's already absolute
+        # Outputs are sharded on disk; the URL only carries the filename
+        image_path = resolve_output_path(image_url[len("/outputs/"):]) or image_url
     else:
         error_msg = "Invalid image URL format"
         if WEBSOCKET_ENABLED and websocket_notifier:
@@ -85,8 +93,8 @@ def run_video_job(job_id: str, payload: dict):
     
     try:
         # Generate video from image
-        os.makedirs(OUT_DIR, exist_ok=True)
-        video_output_path = os.path.join(OUT_DIR, f"{job_id}.mp4")
+        video_output_path = output_path(f"{job_id}.mp4")
+        os.makedirs(os.path.dirname(video_output_path), exist_ok=True)
         
         job.meta.update({"progress": 30})
         job.save_meta()
@@ -115,10 +123,20 @@ def run_video_job(job_id: str, payload: dict):
             }
         }
         
+        if output_store is not None:
+            try:
+                output_store.record(job_id, f"{job_id}.mp4", "video", result, model=result["meta"]["model"])
+            except Exception as e:
+                print(f"Error indexing output of job {job_id}: {e}")
+        
         # Send WebSocket completion update
         if WEBSOCKET_ENABLED and websocket_notifier:
             websocket_notifier.send_job_complete(job_id, result)
         
+        # Feed the API's queue wait estimate
+        if redis_client is not None:
+            record_job_duration(redis_client, job.origin, time.time() - started_at)
+        
         return result
         
     except Exception as e:
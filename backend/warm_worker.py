@@ -0,0 +1,126 @@
+"""
+Long-lived RQ worker that keeps models resident between jobs.
+
+`rq worker` forks a work-horse per job, so the lazily loaded pipelines are thrown away
+after every job. This entry point loads the configured models once, runs a short warmup
+inference, and only then starts taking jobs, executing them in-process (no fork):
+
+    python warm_worker.py meme_diffusion [queue ...]
+
+Job timeouts still apply (SIGALRM in the main thread, as with rq's SimpleWorker). A
+failed job frees cached GPU memory; a CUDA error that can leave the device unusable
+stops the worker with a non-zero exit so the container restarts it clean. Readiness is
+the WORKER_READY_FILE existing: it is written after warmup and removed on exit.
+"""
+import gc
+import json
+import os
+import sys
+import time
+
+import torch
+from redis import Redis
+from rq import SimpleWorker
+from rq.exceptions import StopRequested
+
+from config.settings import (
+    WORKER_PRELOAD, WORKER_WARMUP_STEPS, WORKER_READY_FILE, WORKER_MAX_JOBS, device,
+)
+from models.registry import model_registry
+from services import output_encoder
+
+
+def warm_up(models=WORKER_PRELOAD, steps: int = WORKER_WARMUP_STEPS):
+    """
+    Load the given models and run a short inference on each.
+
+    Args:
+        models: Model names ("SSD-1B", "SDXL", "Flux-1", "SVD")
+        steps: Denoising steps of the warmup inference
+    """
+    for model in models:
+        started_at = time.time()
+        print(f"\n== Warming up {model} ==")
+        if model == "SVD":
+            # A video warmup run costs about as much as a real job: load only
+            from services.video_service import load_video_model
+            load_video_model()
+        else:
+            from services.image_service import generate_image
+            generate_image("warmup", steps=steps, model=model, seed=0)
+        print(f"== {model} ready in {time.time() - started_at:.1f}s ==")
+
+
+def free_gpu_memory():
+    gc.collect()
+    if device == "cuda":
+        torch.cuda.empty_cache()
+
+
+def is_fatal_cuda_error(exc_value) -> bool:
+    """CUDA errors other than OOM can leave the context unusable for later jobs"""
+    if isinstance(exc_value, torch.cuda.OutOfMemoryError):
+        return False
+    message = str(exc_value)
+    return "CUDA error" in message or "cuDNN error" in message or "CUBLAS_STATUS" in message
+
+
+class WarmWorker(SimpleWorker):
+    """SimpleWorker that cleans up after failed jobs and stops on fatal CUDA errors"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fatal_error = False
+        self.push_exc_handler(self._handle_failure)
+        # Jobs run in this process, so their outputs can finish encoding after they return
+        output_encoder.run_in_background()
+
+    def _handle_failure(self, job, exc_type, exc_value, traceback):
+        free_gpu_memory()
+        if is_fatal_cuda_error(exc_value):
+            print(f"Fatal CUDA error in job {job.id}; stopping worker for a restart: {exc_value}")
+            self.fatal_error = True
+        return True  # Continue with the default handlers (move to failed registry)
+
+    def execute_job(self, job, queue):
+        super().execute_job(job, queue)
+        publish_registry_stats(self.connection, self.name)
+        if self.fatal_error:
+            raise StopRequested()
+
+
+def publish_registry_stats(connection, worker_name: str):
+    """Store the model registry stats of this worker under model_registry:{worker_name} (1h TTL)"""
+    try:
+        connection.set(f"model_registry:{worker_name}", json.dumps(model_registry.stats()), ex=3600)
+    except Exception as e:
+        print(f"Error publishing model registry stats: {e}")
+
+
+def set_ready(ready: bool):
+    if ready:
+        with open(WORKER_READY_FILE, "w") as f:
+            f.write(str(os.getpid()))
+    elif os.path.exists(WORKER_READY_FILE):
+        os.remove(WORKER_READY_FILE)
+
+
+def main(queues):
+    set_ready(False)
+    warm_up()
+
+    connection = Redis(host="redis", port=6379)
+    worker = WarmWorker(queues or ["meme"], connection=connection)
+    publish_registry_stats(connection, worker.name)
+    set_ready(True)
+    try:
+        worker.work(max_jobs=WORKER_MAX_JOBS or None)
+    finally:
+        set_ready(False)
+        output_encoder.drain()
+    if worker.fatal_error:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,12 +1,30 @@
-import os
 import random
+import threading
+import time
+from typing import List, Optional, Sequence, Tuple
 from rq import get_current_job
+from rq.job import Job
 
 # Import from our new modules
-from config.settings import OUT_DIR
-from services.ollama_service import call_ollama
-from services.image_service import generate_image
+from config.settings import (
+    BASE_CACHE_ENABLED, LLM_CACHE_ENABLED, MEME_DIFFUSION_QUEUE, DIFFUSION_BATCH_SIZE, PREVIEWS_ENABLED,
+    OLLAMA_STREAM, MAX_VARIANTS, SPEED_MODES,
+)
+from services.ollama_service import call_ollama, call_ollama_variants, LLMCache
+from services.circuit_breaker import CircuitBreaker
+from services.fallback_captions import fallback_captions
+from services.image_service import generate_image, generate_images, resolve_pipeline_speed
+from models.schedulers import resolve_speed
+from services.upload_store import get_upload_store, UploadNotFoundError
+from services.admission import record_job_duration
+from services.base_image_cache import BaseImageCache, base_image_key
+from services.preview import PreviewPublisher
+from services.output_encoder import OutputEncoder
+from services.output_store import OutputStore
+from services import meme_pipeline
 from utils.text_overlay import overlay_caption
+from utils.contact_sheet import contact_sheet
+from utils.progress import LiveTextPublisher, ProgressReporter
 
 # Set up WebSocket notifier (with error handling)
 try:
@@ -19,138 +37,583 @@ except Exception as e:
     print(f"WebSocket notifications disabled: {e}")
     WEBSOCKET_ENABLED = False
     websocket_notifier = None
+    redis_client = None
 
-def run_job(job_id: str, payload: dict):
-    job = get_current_job()
-    job.meta.update({"status":"running","progress":5}); job.save_meta()
-    
-    # Send WebSocket update
+upload_store = get_upload_store(redis_client)
+base_image_cache = BaseImageCache(redis_client) if BASE_CACHE_ENABLED and redis_client is not None else None
+llm_cache = LLMCache(redis_client) if LLM_CACHE_ENABLED else None
+ollama_breaker = CircuitBreaker(redis_client, "ollama") if redis_client is not None else None
+output_encoder = OutputEncoder(redis_client)
+output_store = OutputStore(redis_client) if redis_client is not None else None
+
+def progress_reporter(job) -> ProgressReporter:
+    """Throttled progress reporting on the public job's meta and event stream"""
+    return ProgressReporter(job, websocket_notifier if WEBSOCKET_ENABLED else None)
+
+
+def preview_publisher(job_id: str) -> Optional[PreviewPublisher]:
+    """Live preview frames for a job, or None when previews are off"""
+    if PREVIEWS_ENABLED and WEBSOCKET_ENABLED and websocket_notifier:
+        return PreviewPublisher(job_id, websocket_notifier)
+    return None
+
+
+def text_publisher(job_id: str) -> Optional[LiveTextPublisher]:
+    """Live meme text for a job while Ollama streams it, or None when streaming is off"""
+    if OLLAMA_STREAM and WEBSOCKET_ENABLED and websocket_notifier:
+        return LiveTextPublisher(job_id, websocket_notifier)
+    return None
+
+
+def job_error(job_id: str, error_msg: str) -> dict:
     if WEBSOCKET_ENABLED and websocket_notifier:
-        websocket_notifier.send_job_update(job_id, "running", 5)
+        websocket_notifier.send_job_error(job_id, error_msg)
+    return {
+        "status": "error",
+        "message": error_msg
+    }
 
-    user_prompt = payload.get("prompt","")
-    seed = int(payload.get("seed") or random.randint(1, 2**31-1))
-    steps = payload.get("steps", 30)  
-    guidance = payload.get("guidance", 5.0)
-    model = payload.get("model", "SSD-1B")
-    aspect = payload.get("aspect", "1:1")
-    has_image_upload = payload.get("has_image_upload", False)
-    image_path = payload.get("image_path")
+
+def load_uploaded_image(image_ref: str):
+    """
+    Load an uploaded image from the shared store.
+    Returns None when the upload cannot be decoded (the caller falls back to generation).
+
+    Raises:
+        UploadNotFoundError: If the upload is gone
+    """
+    print(f"Processing uploaded image: {image_ref}")
     
-    # Get meme text - use provided text or generate via Ollama
+    from PIL import Image
+    try:
+        with upload_store.open(image_ref) as f:
+            image = Image.open(f)
+            # Convert to RGB if needed (also forces the lazy decode before the file closes)
+            return image.convert('RGB')
+    except UploadNotFoundError:
+        # The user asked to caption their own image; don't silently generate a different one
+        raise
+    except Exception as e:
+        print(f"Error loading uploaded image: {e}")
+        return None
+
+
+def llm_stats_recorder(job):
+    """Callback keeping an Ollama call's token counts and timings in the job meta (saved by the next progress update)"""
+    return lambda stats: job.meta.update(llm=stats)
+
+
+def meme_text(payload: dict, uploaded: bool, on_text=None, on_stats=None):
+    """
+    Use the user's meme text or generate it via Ollama.
+
+    Args:
+        payload: Job payload
+        uploaded: Whether the meme uses an uploaded image
+        on_text: Receives the (top, bottom) text while it is generated
+        on_stats: Receives the Ollama call's token counts and timings
+
+    Returns:
+        Tuple of (image_prompt, top, bottom)
+    """
+    user_prompt = payload.get("prompt","")
     user_top_text = payload.get("top_text", "")
     user_bottom_text = payload.get("bottom_text", "")
+    
+    if uploaded:
+        if user_top_text or user_bottom_text:
+            return "User uploaded image with custom meme text", user_top_text, user_bottom_text
+        # Generate meme text via Ollama for uploaded image
+        _, top, bottom = generated_text(f"Create meme text for: {user_prompt}", user_prompt, 1, on_text, on_stats)[0]
+        print(f"Using uploaded image with text - Top: '{top}', Bottom: '{bottom}'")
+        return user_prompt, top, bottom
 
-    # Initialize variables
-    image = None
-    top = ""
-    bottom = ""
-    image_prompt = user_prompt
+    if user_top_text or user_bottom_text:
+        # User provided meme text, use prompt for image generation
+        return user_prompt, user_top_text, user_bottom_text
+    # Generate both image prompt and meme text via Ollama
+    return generated_text(user_prompt, user_prompt, 1, on_text, on_stats)[0]
 
-    # Try to load uploaded image first
-    if has_image_upload and image_path and os.path.exists(image_path):
-        print(f"Processing uploaded image: {image_path}")
-        
-        from PIL import Image
+
+def generated_text(llm_prompt: str, user_prompt: str, count: int = 1, on_text=None,
+                   on_stats=None) -> List[Tuple[str, str, str]]:
+    """
+    Meme text from Ollama within the LLM_TIMEOUT budget, or local fallback captions when
+    Ollama fails, runs over budget, is skipped by the open circuit breaker or returns no
+    captions.
+
+    Returns:
+        Up to `count` (image_prompt, top, bottom), the primary first
+    """
+    if ollama_breaker is not None:
+        ollama_breaker.count("texts")
+    try:
+        if count == 1:
+            variants = [call_ollama(llm_prompt, cache=llm_cache, breaker=ollama_breaker, on_text=on_text,
+                                    on_stats=on_stats)]
+        else:
+            variants = call_ollama_variants(llm_prompt, count, cache=llm_cache, breaker=ollama_breaker,
+                                            on_text=on_text, on_stats=on_stats)
+        variants = [variant for variant in variants if variant[1] or variant[2]]
+        if variants:
+            print(f"Generated {len(variants)} meme text(s): {variants}")
+            return variants
+        print("Ollama returned no captions; using local fallback captions")
+    except Exception as e:
+        print(f"Ollama error ({e}); using local fallback captions")
+    if ollama_breaker is not None:
+        ollama_breaker.count("fallbacks")
+    return fallback_captions(user_prompt, count)
+
+
+def variant_count(payload: dict) -> int:
+    return max(1, min(int(payload.get("variants") or 1), MAX_VARIANTS))
+
+
+def meme_variants(payload: dict, uploaded: bool, on_text=None, on_stats=None) -> List[Tuple[str, str, str]]:
+    """
+    Meme text for every variant a job asked for, from a single Ollama call.
+    Jobs with one variant or with their own text get just meme_text().
+
+    Returns:
+        List of (image_prompt, top, bottom), the primary first
+    """
+    if variant_count(payload) == 1 or payload.get("top_text") or payload.get("bottom_text"):
+        return [meme_text(payload, uploaded, on_text, on_stats)]
+
+    user_prompt = payload.get("prompt", "")
+    llm_prompt = f"Create meme text for: {user_prompt}" if uploaded else user_prompt
+    variants = generated_text(llm_prompt, user_prompt, variant_count(payload), on_text, on_stats)
+    if uploaded:
+        # Every variant captions the uploaded image
+        return [(user_prompt, top, bottom) for _, top, bottom in variants]
+    return variants
+
+
+def variant_prompts(variants: Sequence[Sequence[str]]) -> List[str]:
+    """Distinct image prompts of a job's variants (one base image each), the primary's first"""
+    return list(dict.fromkeys(variant[0] for variant in variants))
+
+
+def settle_speed(payload: dict):
+    """
+    Resolve the job's speed mode on this worker's pipelines before anything depends on it
+    (turbo whose LCM-LoRA cannot be loaded runs as TURBO_FALLBACK) and keep it in the
+    payload, so steps, guidance, cache key and the result's meta all follow the mode that ran.
+    """
+    payload["resolved_speed"] = resolve_pipeline_speed(payload.get("speed"), payload.get("model") or "SSD-1B")
+
+
+def diffusion_params(payload: dict):
+    """
+    Diffusion settings of a meme payload, with defaults applied.
+    Steps and guidance left unset take the defaults of the job's speed mode (as settled
+    by the diffusion worker, see settle_speed).
+
+    Returns:
+        Tuple of (neg_prompt, steps, guidance, model, aspect, speed)
+    """
+    # Prepare negative prompt
+    neg_prompt = payload.get("negative", "ugly, blurry, poor quality")
+    if not neg_prompt:
+        neg_prompt = "ugly, blurry, poor quality"
+    model = payload.get("model") or "SSD-1B"
+    speed = payload.get("resolved_speed") or resolve_speed(payload.get("speed"), model)
+    steps = payload.get("steps")
+    guidance = payload.get("guidance")
+    return (
+        neg_prompt,
+        steps if steps is not None else SPEED_MODES[speed]["steps"],
+        guidance if guidance is not None else SPEED_MODES[speed]["guidance"],
+        model,
+        payload.get("aspect", "1:1"),
+        speed,
+    )
+
+
+def cached_base_image(cache_key: str):
+    image = base_image_cache.get(cache_key) if base_image_cache else None
+    if image is not None:
+        print(f"Base image cache hit: {cache_key}")
+    return image
+
+
+def cache_base_image(cache_key: str, image):
+    if base_image_cache:
         try:
-            image = Image.open(image_path)
-            # Convert to RGB if needed
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-                
-            job.meta.update({"progress":30}); job.save_meta()
-            if WEBSOCKET_ENABLED and websocket_notifier:
-                websocket_notifier.send_job_update(job_id, "running", 30)
-            
-            # Use provided meme text or generate via Ollama
-            if user_top_text or user_bottom_text:
-                top, bottom = user_top_text, user_bottom_text
-                image_prompt = f"User uploaded image with custom meme text"
-            else:
-                # Generate meme text via Ollama for uploaded image
-                try:
-                    _, top, bottom = call_ollama(f"Create meme text for: {user_prompt}")
-                    print(f"Generated meme text - Top: {top}, Bottom: {bottom}")
-                except Exception as e:
-                    print(f"Ollama error: {e}")
-                    top, bottom = "", ""
-            
-            print(f"Using uploaded image with text - Top: '{top}', Bottom: '{bottom}'")
-            
+            base_image_cache.put(cache_key, image)
         except Exception as e:
-            print(f"Error loading uploaded image: {e}")
-            image = None  # Will trigger generation fallback
+            print(f"Error caching base image: {e}")
+
+
+def base_image(payload: dict, image_prompt: str, seed: int, on_step=None, on_preview=None):
+    """Generate the pre-caption image, reusing the base image cache when possible"""
+    print("Generating new image...")
+    settle_speed(payload)
+    neg_prompt, steps, guidance, model, aspect, speed = diffusion_params(payload)
 
-    # If no valid image from upload, generate one
+    # Identical diffusion parameters give an identical image: reuse it and only re-caption
+    cache_key = base_image_key(image_prompt, neg_prompt, seed, steps, guidance, model, aspect, speed)
+    image = cached_base_image(cache_key)
     if image is None:
-        print("Generating new image...")
-        
-        # Determine meme text strategy
-        if user_top_text or user_bottom_text:
-            # User provided meme text, use prompt for image generation
-            top, bottom = user_top_text, user_bottom_text
-            image_prompt = user_prompt
-        else:
-            # Generate both image prompt and meme text via Ollama
-            try:
-                image_prompt, top, bottom = call_ollama(user_prompt)
-                print(f"Generated - Image prompt: {image_prompt}, Top: {top}, Bottom: {bottom}")
-            except Exception as e:
-                print(f"Ollama error: {e}")
-                image_prompt, top, bottom = user_prompt, "", ""
-        
-        job.meta.update({"progress":25}); job.save_meta()
-        if WEBSOCKET_ENABLED and websocket_notifier:
-            websocket_notifier.send_job_update(job_id, "running", 25)
-        
-        # Prepare negative prompt
-        neg_prompt = payload.get("negative", "ugly, blurry, poor quality")
-        if not neg_prompt:
-            neg_prompt = "ugly, blurry, poor quality"
+        image = generate_image(image_prompt, neg_prompt, steps, guidance, model, aspect, seed=seed,
+                               on_step=on_step, on_preview=on_preview, speed=speed)
+        cache_base_image(cache_key, image)
+    return image
 
-        # Generate image with new parameters
-        image = generate_image(image_prompt, neg_prompt, steps, guidance, model, aspect)
-        
-        job.meta.update({"progress":70}); job.save_meta()
-        if WEBSOCKET_ENABLED and websocket_notifier:
-            websocket_notifier.send_job_update(job_id, "running", 70)
-    
-    job.meta.update({"progress":85}); job.save_meta()
-    if WEBSOCKET_ENABLED and websocket_notifier:
-        websocket_notifier.send_job_update(job_id, "running", 85)
 
-    # Apply meme text overlay
-    final_img = overlay_caption(image, top, bottom)
+def base_images(payload: dict, image_prompts: List[str], seed: int, on_step=None, on_preview=None) -> list:
+    """Base images of a multi-variant job: cached ones are reused, the rest render in one batched call"""
+    settle_speed(payload)
+    neg_prompt, steps, guidance, model, aspect, speed = diffusion_params(payload)
+    cache_keys = [base_image_key(prompt, neg_prompt, seed, steps, guidance, model, aspect, speed)
+                  for prompt in image_prompts]
+    images = [cached_base_image(cache_key) for cache_key in cache_keys]
+    missing = [index for index, image in enumerate(images) if image is None]
+    if missing:
+        print(f"Generating {len(missing)} variant image(s) in one batch...")
+        # Previews follow the primary image
+        primary_preview = (lambda previews: on_preview(previews[0])) if on_preview and missing[0] == 0 else None
+        rendered = generate_images(
+            [(image_prompts[index], neg_prompt, seed) for index in missing], steps, guidance, model, aspect,
+            on_step=on_step, on_preview=primary_preview, speed=speed,
+        )
+        for index, image in zip(missing, rendered):
+            images[index] = image
+            cache_base_image(cache_keys[index], image)
+    return images
 
-    # Save final result
-    os.makedirs(OUT_DIR, exist_ok=True)
-    out_path = os.path.join(OUT_DIR, f"{job_id}.png")
-    final_img.save(out_path, "PNG")
 
-    # Clean up uploaded image if exists
-    if has_image_upload and image_path and os.path.exists(image_path):
-        try:
-            os.remove(image_path)
-        except:
-            pass  # Ignore cleanup errors
+def finish_meme(job_id: str, image, payload: dict, seed: int, image_prompt: str, top: str, bottom: str,
+                alternates: Sequence[Tuple] = ()) -> dict:
+    """
+    Caption, save and announce the finished meme.
+    The completion notification goes out once the output files are in place; in-process
+    workers return before that, while the encode runs on the encoder threads.
+
+    Multi-variant jobs pass their `alternates` as (base image, image_prompt, top, bottom):
+    each is captioned and saved too, along with a contact sheet of all the variants.
+    """
+    # Apply meme text overlay (alternates may share the base image, so they caption copies first)
+    alternate_imgs = [overlay_caption(base.copy(), alt_top, alt_bottom) for base, _, alt_top, alt_bottom in alternates]
+    final_img = overlay_caption(image, top, bottom)
+    filename = output_encoder.filename(job_id)
+    _, steps, guidance, model, aspect, speed = diffusion_params(payload)
 
     result = {
         "status": "done",
-        "imageUrl": f"/outputs/{job_id}.png",
+        "imageUrl": f"/outputs/{filename}",
         "meta": {
             "seed": seed,
             "steps": steps,
             "guidance": guidance,
             "model": model,
             "aspect": aspect,
+            "speed": speed,
             "prompt": image_prompt,
             "top": top, 
             "bottom": bottom
         }
     }
     
-    # Send WebSocket completion update
-    if WEBSOCKET_ENABLED and websocket_notifier:
-        websocket_notifier.send_job_complete(job_id, result)
+    outputs = [(final_img, filename)]
+    if alternates:
+        outputs += [
+            (alternate_img, output_encoder.filename(f"{job_id}-v{index}"))
+            for index, alternate_img in enumerate(alternate_imgs, 1)
+        ]
+        result["variants"] = [
+            {"imageUrl": f"/outputs/{variant_filename}", "prompt": variant_prompt, "top": variant_top, "bottom": variant_bottom}
+            for (_, variant_filename), (variant_prompt, variant_top, variant_bottom) in zip(
+                outputs, [(image_prompt, top, bottom)] + [alternate[1:] for alternate in alternates]
+            )
+        ]
+        sheet_filename = output_encoder.filename(f"{job_id}-sheet")
+        outputs.append((contact_sheet([final_img, *alternate_imgs]), sheet_filename))
+        result["contactSheetUrl"] = f"/outputs/{sheet_filename}"
+
+    # Index the outputs, then send the WebSocket completion update
+    def announce():
+        if output_store is not None:
+            try:
+                output_store.record(job_id, filename, "image", result, model=result["meta"]["model"],
+                                    extra_files=[extra for _, extra in outputs[1:]])
+            except Exception as e:
+                print(f"Error indexing output of job {job_id}: {e}")
+        if WEBSOCKET_ENABLED and websocket_notifier:
+            websocket_notifier.send_job_complete(job_id, result)
+
+    def announce_failure(error: Exception):
+        message = f"Saving the image failed: {error}"
+        # In-process workers have already returned the "done" result: flag the job so status lookups report the error
+        try:
+            job = Job.fetch(job_id, connection=redis_client)
+            job.meta["error"] = message
+            job.save_meta()
+        except Exception as e:
+            print(f"Error marking job {job_id} as failed: {e}")
+        job_error(job_id, message)
+
+    # Announce once, after the last file is written (or fail on the first error)
+    lock = threading.Lock()
+    remaining = [len(outputs)]
+    failed = []
+
+    def on_written():
+        with lock:
+            remaining[0] -= 1
+            done = remaining[0] == 0 and not failed
+        if done:
+            announce()
+
+    def on_failed(error: Exception):
+        with lock:
+            first = not failed
+            failed.append(error)
+        if first:
+            announce_failure(error)
+
+    for output_img, output_filename in outputs:
+        output_encoder.save(output_img, output_filename, on_written=on_written, on_failed=on_failed)
+    return result
+
+
+def run_job(job_id: str, payload: dict):
+    """Single-stage meme job: text, diffusion and finishing in one worker"""
+    job = get_current_job()
+    started_at = time.time()
+    progress = progress_reporter(job)
+    progress.report(5, force=True)
+
+    seed = int(payload.get("seed") or random.randint(1, 2**31-1))
+    image = None
+
+    # Try to load uploaded image first
+    if payload.get("has_image_upload", False) and payload.get("image_ref"):
+        try:
+            image = load_uploaded_image(payload["image_ref"])
+        except UploadNotFoundError as e:
+            return job_error(job_id, str(e))
+
+    if image is not None:
+        progress.report(30, force=True)
+        variants = meme_variants(payload, uploaded=True, on_text=text_publisher(job_id),
+                                 on_stats=llm_stats_recorder(job))
+        bases = {variants[0][0]: image}
+    else:
+        # If no valid image from upload, generate one
+        variants = meme_variants(payload, uploaded=False, on_text=text_publisher(job_id),
+                                 on_stats=llm_stats_recorder(job))
+        progress.report(25, force=True)
+        prompts = variant_prompts(variants)
+        if len(prompts) == 1:
+            images = [base_image(payload, prompts[0], seed, on_step=progress.steps(25, 70),
+                                 on_preview=preview_publisher(job_id))]
+        else:
+            images = base_images(payload, prompts, seed, on_step=progress.steps(25, 70),
+                                 on_preview=preview_publisher(job_id))
+        bases = dict(zip(prompts, images))
+        progress.report(70, force=True)
+    
+    progress.report(85, force=True)
+    image_prompt, top, bottom = variants[0]
+    alternates = [(bases[variant[0]], *variant) for variant in variants[1:]]
+    result = finish_meme(job_id, bases[image_prompt], payload, seed, image_prompt, top, bottom, alternates)
+    
+    # Feed the API's queue wait estimate
+    if redis_client is not None:
+        record_job_duration(redis_client, job.origin, time.time() - started_at)
+    
+    return result
+
+
+def run_text_stage(job_id: str, payload: dict):
+    """First pipeline stage: meme text (and uploaded image), then hand off to diffusion or finish"""
+    stage = get_current_job()
+    started_at = time.time()
+    connection = stage.connection
+    progress = progress_reporter(Job.fetch(job_id, connection=connection))
+    progress.report(5, force=True)
+
+    state = {"payload": payload, "seed": int(payload.get("seed") or random.randint(1, 2**31-1))}
+    try:
+        image = None
+        if payload.get("has_image_upload", False) and payload.get("image_ref"):
+            image = load_uploaded_image(payload["image_ref"])
+        
+        variants = meme_variants(payload, uploaded=image is not None, on_text=text_publisher(job_id),
+                                 on_stats=llm_stats_recorder(progress.job))
+        image_prompt, top, bottom = variants[0]
+        state.update({"image_prompt": image_prompt, "top": top, "bottom": bottom})
+        if len(variants) > 1:
+            state["variants"] = variants
+        
+        if image is not None:
+            # Nothing for the GPU to do: go straight to finishing
+            progress.report(30, force=True)
+            meme_pipeline.save_state(connection, job_id, state, image)
+            meme_pipeline.release_finish(connection, job_id)
+        else:
+            progress.report(25, force=True)
+            meme_pipeline.save_state(connection, job_id, state)
+            meme_pipeline.enqueue_diffusion(connection, job_id)
+    except Exception as e:
+        # Let the finish stage report the error on the public job
+        state["error"] = str(e)
+        meme_pipeline.save_state(connection, job_id, state)
+        meme_pipeline.release_finish(connection, job_id)
+    
+    record_job_duration(connection, stage.origin, time.time() - started_at)
+
+
+def run_diffusion_stage(job_id: str):
+    """
+    Second pipeline stage: generate the base image, then hand off to finish. Under
+    diffusion_batcher.py the stage job also renders the public jobs batched with it
+    (meta "batch"); their own stage jobs then find nothing left to do.
+    """
+    stage = get_current_job()
+    job_ids = meme_pipeline.deferred_job_ids(stage.connection, [job_id] + stage.meta.get("batch", []))
+    if job_ids:
+        run_diffusion_batch(job_ids, stage.connection)
+
+
+def run_diffusion_batch(job_ids: List[str], connection):
+    """
+    Diffusion stage for several pipeline jobs at once (see diffusion_batcher.py).
+    Each job needs one base image per distinct image prompt of its variants. Cache hits
+    are used right away; the rest are grouped by model, aspect, steps, guidance and speed and
+    each group runs as one batched pipeline call. If a batched call fails, its images
+    are retried one by one so a bad prompt only fails its own job. A job is handed to
+    the finish stage once all its images are done, with an error if the primary failed
+    (alternates whose image failed are dropped).
+    """
+    started_at = time.time()
+    pending = set(job_ids)
+    reporters = {
+        job.id: progress_reporter(job)
+        for job in Job.fetch_many(job_ids, connection=connection) if job is not None
+    }
+
+    def hand_off(job_id: str, state: dict, image=None, error: Optional[str] = None, extra_images=()):
+        if error is not None:
+            state["error"] = error
+        elif job_id in reporters:
+            reporters[job_id].report(70, force=True)
+        meme_pipeline.save_state(connection, job_id, state, image, extra_images)
+        meme_pipeline.release_finish(connection, job_id)
+        pending.discard(job_id)
+
+    # Base images per job: None while pending, the exception if rendering failed
+    renders = {}
+
+    def rendered(job_id: str, index: int, image):
+        state, images = renders[job_id]
+        images[index] = image
+        if any(image is None for image in images):
+            return
+        if isinstance(images[0], Exception):
+            hand_off(job_id, state, error=str(images[0]))
+        else:
+            extras = [None if isinstance(extra, Exception) else extra for extra in images[1:]]
+            hand_off(job_id, state, images[0], extra_images=extras)
+
+    try:
+        groups = {}
+        for job_id in job_ids:
+            state, _ = meme_pipeline.load_state(connection, job_id)
+            if state is None:
+                # The finish stage reports the expired state
+                meme_pipeline.release_finish(connection, job_id)
+                pending.discard(job_id)
+                continue
+            settle_speed(state["payload"])  # Saved with the state, for the finish stage's meta
+            neg_prompt, steps, guidance, model, aspect, speed = diffusion_params(state["payload"])
+            prompts = variant_prompts(state.get("variants") or [[state["image_prompt"]]])
+            renders[job_id] = (state, [None] * len(prompts))
+            for index, image_prompt in enumerate(prompts):
+                # Identical diffusion parameters give an identical image: reuse it and only re-caption
+                cache_key = base_image_key(image_prompt, neg_prompt, state["seed"], steps, guidance, model, aspect, speed)
+                image = cached_base_image(cache_key)
+                if image is not None:
+                    rendered(job_id, index, image)
+                    continue
+                groups.setdefault((model, aspect, steps, guidance, speed), []).append(
+                    (job_id, index, (image_prompt, neg_prompt, state["seed"]), cache_key)
+                )
+
+        for (model, aspect, steps, guidance, speed), members in groups.items():
+            for start in range(0, len(members), DIFFUSION_BATCH_SIZE):
+                chunk = members[start:start + DIFFUSION_BATCH_SIZE]
+                requests = [request for _, _, request, _ in chunk]
+                print(f"Generating {len(chunk)} image(s) with {model} {aspect}, {steps} steps, guidance {guidance} ({speed})")
+                chunk_jobs = dict.fromkeys(job_id for job_id, _, _, _ in chunk)
+                step_callbacks = [reporters[job_id].steps(25, 70) for job_id in chunk_jobs if job_id in reporters]
+                # Previews follow each job's primary image
+                publishers = [preview_publisher(job_id) if index == 0 else None for job_id, index, _, _ in chunk]
+                try:
+                    images = generate_images(
+                        requests, steps, guidance, model, aspect, speed=speed,
+                        on_step=lambda fraction: [on_step(fraction) for on_step in step_callbacks],
+                        on_preview=lambda previews: [
+                            publish(preview) for publish, preview in zip(publishers, previews) if publish
+                        ],
+                    )
+                except Exception as e:
+                    print(f"Batched generation failed ({e}); retrying {len(chunk)} image(s) one by one")
+                    images = []
+                    for (job_id, _, _, _), request, publish in zip(chunk, requests, publishers):
+                        on_step = reporters[job_id].steps(25, 70) if job_id in reporters else None
+                        on_preview = (lambda previews, publish=publish: publish(previews[0])) if publish else None
+                        try:
+                            images.append(generate_images([request], steps, guidance, model, aspect, on_step, on_preview,
+                                                          speed=speed)[0])
+                        except Exception as item_error:
+                            images.append(item_error)
+
+                for (job_id, index, _, cache_key), image in zip(chunk, images):
+                    if not isinstance(image, Exception):
+                        cache_base_image(cache_key, image)
+                    rendered(job_id, index, image)
+    finally:
+        # Never leave a public job deferred: whatever is left goes to finish with an error
+        for job_id in list(pending):
+            try:
+                state, _ = meme_pipeline.load_state(connection, job_id)
+                hand_off(job_id, state or {}, error="Image generation failed")
+            except Exception as e:
+                print(f"Error handing off job {job_id}: {e}")
+
+    # Feed the API's queue wait estimate with the per-job share of the batch
+    per_job = (time.time() - started_at) / max(len(job_ids), 1)
+    for _ in job_ids:
+        record_job_duration(connection, MEME_DIFFUSION_QUEUE, per_job)
+
+
+def run_finish_stage(job_id: str):
+    """Last pipeline stage (the public job): caption, encode, save and notify"""
+    job = get_current_job()
+    started_at = time.time()
+    connection = job.connection
+
+    state, image = meme_pipeline.load_state(connection, job_id, with_image=True)
+    alternates = []
+    if state is not None and state.get("variants"):
+        prompts = variant_prompts(state["variants"])
+        bases = dict(zip(prompts, [image] + meme_pipeline.load_extra_images(connection, job_id, len(prompts) - 1)))
+        # Alternates whose base image failed to render are dropped
+        alternates = [(bases[variant[0]], *variant) for variant in state["variants"][1:] if bases[variant[0]] is not None]
+    meme_pipeline.clear_state(connection, job_id)
+    if state is None:
+        return job_error(job_id, "Pipeline state expired")
+    if state.get("error") or image is None:
+        return job_error(job_id, state.get("error") or "No image produced")
+
+    progress_reporter(job).report(85, force=True)
+    result = finish_meme(
+        job_id, image, state["payload"], state["seed"], state["image_prompt"], state["top"], state["bottom"],
+        alternates,
+    )
     
-    return result
\ No newline at end of file
+    record_job_duration(connection, job.origin, time.time() - started_at)
+    return result
@@ -13,6 +13,8 @@ export async function createJob(data: CreateJob): Promise<{ jobId: string }> {
     if (data.aspect) formData.append('aspect', data.aspect);
     if (data.top_text) formData.append('top_text', data.top_text);
     if (data.bottom_text) formData.append('bottom_text', data.bottom_text);
+    if (data.variants) formData.append('variants', data.variants.toString());
+    if (data.speed) formData.append('speed', data.speed);
     formData.append('image', data.image);
 
     const r = await fetch('/api/jobs', {
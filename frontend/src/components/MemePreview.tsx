@@ -36,6 +36,53 @@ export default function MemePreview({ selectedImage, topText, bottomText, status
             className="w-full max-w-md mx-auto rounded-lg border-2 border-neutral-700 shadow-lg"
           />
         </div>
+
+        {/* Alternates generated in the same job */}
+        {status.variants && status.variants.length > 1 && (
+          <div className="text-center">
+            <h4 className="text-sm font-semibold mb-2">Variantes</h4>
+            <div className="grid grid-cols-2 gap-2 max-w-md mx-auto">
+              {status.variants.map((variant) => (
+                <a key={variant.imageUrl} href={variant.imageUrl} target="_blank" rel="noreferrer">
+                  <img 
+                    src={`${variant.imageUrl}?w=256`} 
+                    alt={`${variant.top} ${variant.bottom}`} 
+                    className="w-full rounded-md border border-neutral-700 hover:opacity-80 transition-opacity"
+                  />
+                </a>
+              ))}
+            </div>
+            {status.contactSheetUrl && (
+              <a href={status.contactSheetUrl} target="_blank" rel="noreferrer" className="inline-block mt-2 text-xs text-blue-500 hover:underline">
+                Ver hoja de contactos
+              </a>
+            )}
+          </div>
+        )}
+      </div>
+    );
+  }
+
+  // Show the live preview of the image and the meme text being generated
+  if (status.status === 'running' && (status.preview || status.liveText)) {
+    return (
+      <div className={`space-y-4 ${className}`}>
+        <div className="text-center">
+          <h3 className="text-lg font-semibold mb-2">Generando...</h3>
+          {status.preview && (
+            <img 
+              src={status.preview} 
+              alt="Vista previa de la generación" 
+              className="w-full max-w-md mx-auto rounded-lg border-2 border-neutral-700"
+            />
+          )}
+          {status.liveText && (
+            <div className="mt-2 text-sm text-neutral-300 font-bold uppercase">
+              {status.liveText.topText && <p>{status.liveText.topText}</p>}
+              {status.liveText.bottomText && <p>{status.liveText.bottomText}</p>}
+            </div>
+          )}
+        </div>
       </div>
     );
   }
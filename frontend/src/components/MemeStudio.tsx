@@ -33,6 +33,8 @@ export default function MemeStudio() {
   const [useRandomSeed, setUseRandomSeed] = useState(true);
   const [model, setModel] = useState('SSD-1B');
   const [aspect, setAspect] = useState('1:1');
+  const [variants, setVariants] = useState(1);
+  const [speed, setSpeed] = useState('standard');
   const [negative, setNegative] = useState('');
 
   // UI state
@@ -95,6 +97,8 @@ export default function MemeStudio() {
         seed: useRandomSeed ? undefined : (seed ? Number(seed) : undefined),
         model,
         aspect,
+        variants,
+        speed,
         negative: negative.trim() || undefined,
         image: selectedImage || undefined,
         top_text: topText.trim() || undefined,
@@ -254,6 +258,10 @@ export default function MemeStudio() {
               setModel={setModel}
               aspect={aspect}
               setAspect={setAspect}
+              variants={variants}
+              setVariants={setVariants}
+              speed={speed}
+              setSpeed={setSpeed}
               negative={negative}
               setNegative={setNegative}
             />
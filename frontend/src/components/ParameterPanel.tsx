@@ -14,6 +14,10 @@ interface ParameterPanelProps {
   setModel: (value: string) => void;
   aspect: string;
   setAspect: (value: string) => void;
+  variants: number;
+  setVariants: (value: number) => void;
+  speed: string;
+  setSpeed: (value: string) => void;
   negative: string;
   setNegative: (value: string) => void;
   className?: string;
@@ -32,6 +36,16 @@ const ASPECT_RATIOS = [
   { value: '9:16', label: '9:16 (Vertical)' },
 ];
 
+const VARIANT_COUNTS = [1, 2, 3, 4];
+
+// Same defaults as SPEED_MODES in the backend settings
+const SPEED_MODES = [
+  { value: 'standard', label: 'Estándar (30 pasos)', steps: 30, guidance: 5.0 },
+  { value: 'fast', label: 'Rápido (DPM++, 12 pasos)', steps: 12, guidance: 5.0 },
+  { value: 'draft', label: 'Borrador (Euler a, 8 pasos)', steps: 8, guidance: 4.0 },
+  { value: 'turbo', label: 'Turbo (LCM, 4 pasos)', steps: 4, guidance: 1.0 },
+];
+
 export default function ParameterPanel({
   steps, setSteps,
   guidance, setGuidance,
@@ -39,6 +53,8 @@ export default function ParameterPanel({
   useRandomSeed, setUseRandomSeed,
   model, setModel,
   aspect, setAspect,
+  variants, setVariants,
+  speed, setSpeed,
   negative, setNegative,
   className = ''
 }: ParameterPanelProps) {
@@ -50,10 +66,38 @@ export default function ParameterPanel({
     }
   };
 
+  const handleSpeedChange = (value: string) => {
+    setSpeed(value);
+    const mode = SPEED_MODES.find(m => m.value === value);
+    if (mode) {
+      setSteps(mode.steps);
+      setGuidance(mode.guidance);
+    }
+  };
+
   return (
     <div className={`space-y-6 ${className}`}>
       <h3 className="text-lg font-semibold">Parámetros</h3>
 
+      {/* Speed mode */}
+      <div className="space-y-2">
+        <label htmlFor="speed" className="block text-sm font-medium">
+          Velocidad
+        </label>
+        <select
+          id="speed"
+          value={speed}
+          onChange={(e) => handleSpeedChange(e.target.value)}
+          className="w-full p-2 bg-white dark:bg-neutral-800 border border-neutral-300 dark:border-neutral-600 rounded-md focus:ring-2 focus:ring-blue-500 focus:border-transparent"
+        >
+          {SPEED_MODES.map(m => (
+            <option key={m.value} value={m.value}>
+              {m.label}
+            </option>
+          ))}
+        </select>
+      </div>
+
       {/* Steps */}
       <div className="space-y-2">
         <label htmlFor="steps" className="block text-sm font-medium">
@@ -133,6 +177,25 @@ export default function ParameterPanel({
         </select>
       </div>
 
+      {/* Variants */}
+      <div className="space-y-2">
+        <label htmlFor="variants" className="block text-sm font-medium">
+          Variantes
+        </label>
+        <select
+          id="variants"
+          value={variants}
+          onChange={(e) => setVariants(Number(e.target.value))}
+          className="w-full p-2 bg-white dark:bg-neutral-800 border border-neutral-300 dark:border-neutral-600 rounded-md focus:ring-2 focus:ring-blue-500 focus:border-transparent"
+        >
+          {VARIANT_COUNTS.map(n => (
+            <option key={n} value={n}>
+              {n === 1 ? '1 (solo el meme principal)' : `${n} opciones`}
+            </option>
+          ))}
+        </select>
+      </div>
+
       {/* Seed */}
       <div className="space-y-2">
         <div className="flex items-center justify-between">
@@ -31,8 +31,24 @@ export function useWebSocketJob(jobId?: string) {
             // Handle keepalive pong
             return;
           }
-          // Update job status with real-time data
-          setStatus(data);
+          if (data.type === 'preview') {
+            // Live preview frame: keep the current progress, swap the image
+            setStatus((prev) => (prev.status === 'queued' || prev.status === 'running')
+              ? { ...prev, status: 'running', preview: data.preview }
+              : prev);
+            return;
+          }
+          if (data.type === 'text') {
+            // Meme text as the model writes it
+            setStatus((prev) => (prev.status === 'queued' || prev.status === 'running')
+              ? { ...prev, status: 'running', liveText: { topText: data.topText, bottomText: data.bottomText } }
+              : prev);
+            return;
+          }
+          // Update job status with real-time data, keeping the last preview and text until the result
+          setStatus((prev) => (data.status === 'running' && prev.status === 'running')
+            ? { ...data, preview: prev.preview, liveText: prev.liveText }
+            : data);
           
           // If job is complete, don't reconnect if connection drops
           if (data.status === 'done') {
@@ -9,10 +9,20 @@ export type CreateJob = {
   image?: File;
   top_text?: string;
   bottom_text?: string;
+  variants?: number;
+  speed?: string;
 };
 export type CreateVideoJob = { imageUrl: string; numFrames?: number };
-export type JobQueued = { status: 'queued' | 'running'; progress?: number };
-export type JobDone = { status: 'done'; imageUrl: string; meta: { seed: number; steps: number; model: string; prompt: string; top?: string; bottom?: string } };
+export type LiveText = { topText: string; bottomText: string };
+export type JobQueued = { status: 'queued' | 'running'; progress?: number; eta?: number; preview?: string; liveText?: LiveText };
+export type MemeVariant = { imageUrl: string; prompt: string; top: string; bottom: string };
+export type JobDone = {
+  status: 'done';
+  imageUrl: string;
+  meta: { seed: number; steps: number; model: string; prompt: string; top?: string; bottom?: string; speed?: string };
+  variants?: MemeVariant[];
+  contactSheetUrl?: string;
+};
 export type VideoJobDone = { status: 'done'; videoUrl: string; meta: { numFrames: number; model: string; sourceImage: string } };
 export type JobError = { status: 'error'; message: string };
 export type JobStatus = JobQueued | JobDone | JobError;